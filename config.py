@@ -50,12 +50,69 @@ if not AI_API_KEY:
 AI_MODEL = get_config("AI_MODEL") # e.g. gpt-4, claude-3-opus
 AI_BASE_URL = get_config("AI_BASE_URL") # For custom compatible endpoints
 
+# Session Signing Key. Must be set (and identical) for every worker/instance of a deployment;
+# a local dev install without one gets a generated key kept in secrets.json.
+DEPLOYED = bool(os.getenv("DATABASE_URL") or os.getenv("VERCEL") or os.getenv("DYNO") or os.getenv("RENDER"))
+SESSION_SECRET = get_config("SESSION_SECRET")
+if not SESSION_SECRET:
+    if DEPLOYED:
+        # Generating one here would give each worker its own key (and fail on read-only filesystems)
+        raise RuntimeError("SESSION_SECRET is not set. Set it to the same random value on every instance "
+                           "(python -c \"import secrets; print(secrets.token_hex(32))\").")
+    import secrets as _secrets_mod
+    SESSION_SECRET = _secrets_mod.token_hex(32)
+    print("[WARN] SESSION_SECRET is not set; generated a development key in secrets.json. "
+          "Set SESSION_SECRET before running more than one worker or deploying.")
+    if not save_secrets({"SESSION_SECRET": SESSION_SECRET}):
+        print("[WARN] Could not persist SESSION_SECRET; sessions will not survive a restart.")
+
 # Email Config
 SMTP_SERVER = get_config("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(get_config("SMTP_PORT", 587))
 SMTP_USER = get_config("SMTP_USER")
 SMTP_PASSWORD = get_config("SMTP_PASSWORD")
 SENDER_NAME = get_config("SENDER_NAME", "B2B Outreach System")
+SMTP_TIMEOUT = int(get_config("SMTP_TIMEOUT", 30)) # Seconds per SMTP command
+SMTP_POOL_IDLE_TTL = int(get_config("SMTP_POOL_IDLE_TTL", 60)) # Close pooled sessions idle longer than this
+SEND_INTERVAL_SECONDS = float(get_config("SEND_INTERVAL_SECONDS", 5)) # Default gap between sends per account
+SEND_MAX_IN_FLIGHT = int(get_config("SEND_MAX_IN_FLIGHT", 1)) # Default concurrent sends per account
+SEND_MAX_FAILURES = int(get_config("SEND_MAX_FAILURES", 3)) # Consecutive failures before an account sits out the batch
+DUE_TASK_PAGE_SIZE = int(get_config("DUE_TASK_PAGE_SIZE", 1000)) # Due leads fetched per page when streaming
+JOB_LEASE_SECONDS = int(get_config("JOB_LEASE_SECONDS", 300)) # A claimed send job returns to the queue if not renewed in time
+JOB_BATCH_SIZE = int(get_config("JOB_BATCH_SIZE", 200)) # Send jobs claimed per worker round
+JOB_MAX_ATTEMPTS = int(get_config("JOB_MAX_ATTEMPTS", 3)) # Attempts before a send job is marked Failed
+JOB_RETRY_BACKOFF_SECONDS = int(get_config("JOB_RETRY_BACKOFF_SECONDS", 60)) # First retry delay after a failed send; doubles per attempt
+JOB_RETRY_BACKOFF_MAX = int(get_config("JOB_RETRY_BACKOFF_MAX", 3600)) # Cap on the retry delay
+WORKER_POLL_SECONDS = int(get_config("WORKER_POLL_SECONDS", 30)) # Idle send worker sleep between polls
+WRITE_BEHIND_MAX_ITEMS = int(get_config("WRITE_BEHIND_MAX_ITEMS", 100)) # Flush send outcomes once this many are buffered
+WRITE_BEHIND_MAX_AGE = float(get_config("WRITE_BEHIND_MAX_AGE", 2)) # ...or once the oldest is this many seconds old
+WRITE_BEHIND_JOURNAL_DIR = get_config("WRITE_BEHIND_JOURNAL_DIR", os.path.join("data", "journal"))
+SCHEDULER_ENABLED = str(get_config("SCHEDULER_ENABLED", "false")).lower() in ("1", "true", "yes") # Wake the sender on due times instead of polling
+SCHEDULER_HORIZON_SECONDS = int(get_config("SCHEDULER_HORIZON_SECONDS", 3600)) # How far ahead the scheduler keeps due times in memory
+SCHEDULER_RELOAD_SECONDS = int(get_config("SCHEDULER_RELOAD_SECONDS", 300)) # Refresh from the DB (catches other processes' changes)
+PRERENDER_WINDOW_HOURS = int(get_config("PRERENDER_WINDOW_HOURS", 24)) # How far ahead to materialize messages
+PRERENDER_WORKERS = int(get_config("PRERENDER_WORKERS", 0)) or None # Render processes (None = CPU count)
+IMPORT_CHUNK_SIZE = int(get_config("IMPORT_CHUNK_SIZE", 5000)) # Rows read, validated and inserted per batch when importing leads
+KNOWLEDGE_CACHE_TTL = int(get_config("KNOWLEDGE_CACHE_TTL", 300)) # Max age of a cached knowledge context (writes elsewhere invalidate sooner)
+KNOWLEDGE_CONTEXT_ITEMS = int(get_config("KNOWLEDGE_CONTEXT_ITEMS", 10)) # Knowledge base items embedded in a prompt (the user's own first)
+KNOWLEDGE_CONTEXT_MAX_CHARS = int(get_config("KNOWLEDGE_CONTEXT_MAX_CHARS", 4000)) # ...truncated to this many characters
+SQLITE_PRODUCTION = str(get_config("SQLITE_PRODUCTION", "false")).lower() in ("1", "true", "yes") # WAL + tuned pragmas + single writer thread
+SQLITE_BUSY_TIMEOUT_MS = int(get_config("SQLITE_BUSY_TIMEOUT_MS", 5000)) # How long a connection waits on a lock before "database is locked"
+SQLITE_CACHE_SIZE_KB = int(get_config("SQLITE_CACHE_SIZE_KB", 65536)) # Page cache per connection
+SQLITE_MMAP_SIZE = int(get_config("SQLITE_MMAP_SIZE", 268435456)) # Bytes of the DB file memory-mapped for reads
+DB_WRITER_BATCH = int(get_config("DB_WRITER_BATCH", 64)) # Queued writes committed together by the writer thread
+DB_THREADPOOL_SIZE = int(get_config("DB_THREADPOOL_SIZE", 10)) # Request-handler DB calls running at once (keep <= the engine pool size)
+DASHBOARD_CACHE_TTL = int(get_config("DASHBOARD_CACHE_TTL", 30)) # Seconds a user's dashboard stats are served from cache
+LEADS_PAGE_SIZE = int(get_config("LEADS_PAGE_SIZE", 50)) # Rows per page on /leads and /inbox
+SESSION_TTL_SECONDS = int(get_config("SESSION_TTL_SECONDS", 7 * 24 * 3600)) # Login lifetime of a signed session token
+USER_CACHE_TTL = int(get_config("USER_CACHE_TTL", 300)) # Seconds a user row is served from the in-process cache
+LOCATION_CACHE_TTL = int(get_config("LOCATION_CACHE_TTL", 24 * 3600)) # Seconds the server's geo lookup is reused from data/
+METRICS_TOKEN = get_config("METRICS_TOKEN") # Bearer token required by /metrics (unset = open to the network)
+READINESS_TIMEOUT_SECONDS = float(get_config("READINESS_TIMEOUT_SECONDS", 2)) # /readyz reports 503 if the DB check takes longer
+SQL_PROFILER_ENABLED = str(get_config("SQL_PROFILER_ENABLED", "true")).lower() in ("1", "true", "yes") # Per-request/job query counts, slow-query and N+1 logging
+SQL_SLOW_QUERY_MS = float(get_config("SQL_SLOW_QUERY_MS", 200)) # Log any statement slower than this
+SQL_N_PLUS_ONE_THRESHOLD = int(get_config("SQL_N_PLUS_ONE_THRESHOLD", 20)) # Log a request/job that runs one statement this many times
+IMPORT_BUDGET_MS = int(get_config("IMPORT_BUDGET_MS", 1500)) # `python -m src.startup_profile` fails when importing server takes longer
 
 # Scraping Config
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
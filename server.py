@@ -1,16 +1,19 @@
 from fastapi import FastAPI, BackgroundTasks, Request, Response, Form, Depends
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import sys
 import os
+import time
 from datetime import datetime
 
 # Add src to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from src import data_manager, scraper, email_sender, campaign_manager, account_manager, auth
-from src.data_manager import Lead, Campaign, SMTPAccount, KnowledgeBase, User, get_db
+import config
+from src import data_manager, scraper, email_sender, campaign_manager, account_manager, auth, prerender, scheduler, db_writer, dashboard_stats, lead_listing, lead_search, metrics, health, sql_profiler
+from src.db_async import run_db, run_db_within
+from src.data_manager import KnowledgeBase, User, get_db
 
 
 app = FastAPI(title="B2B Outreach Pro")
@@ -37,49 +40,119 @@ def url_to_domain(url):
 templates.env.filters["domain"] = url_to_domain
 
 # Server Location Cache
+# Looked up in the background after startup (never at import) and cached on disk,
+# so worker spawns don't wait on ip-api.com. Unknown until the first lookup lands.
 SERVER_LOCATION = {"city": "Unknown", "country": "Unknown", "query": "127.0.0.1"}
-try:
-    print("[INFO] Fetching Server Location...")
-    import requests
-    resp = requests.get("http://ip-api.com/json/", timeout=2)
-    if resp.status_code == 200:
-        SERVER_LOCATION = resp.json()
-        try:
-            print(f"[INFO] Server Location: {SERVER_LOCATION.get('city')}, {SERVER_LOCATION.get('country')}")
-        except:
-            print("[INFO] Server Location: (Unicode Name)")
-except Exception as e:
-    print(f"[WARN] Could not fetch location: {e}")
+LOCATION_CACHE_FILE = os.path.join("data", "server_location.json")
+
+def load_cached_location():
+    """The cached lookup if it is younger than LOCATION_CACHE_TTL, else None."""
+    import json
+    try:
+        if time.time() - os.path.getmtime(LOCATION_CACHE_FILE) > config.LOCATION_CACHE_TTL:
+            return None
+        with open(LOCATION_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def refresh_server_location():
+    global SERVER_LOCATION
+    cached = load_cached_location()
+    if cached:
+        SERVER_LOCATION = cached
+        return
+    try:
+        import json
+        import requests
+        resp = requests.get("http://ip-api.com/json/", timeout=2)
+        if resp.status_code == 200:
+            SERVER_LOCATION = resp.json()
+            os.makedirs(os.path.dirname(LOCATION_CACHE_FILE), exist_ok=True)
+            with open(LOCATION_CACHE_FILE, "w") as f:
+                json.dump(SERVER_LOCATION, f)
+            try:
+                print(f"[INFO] Server Location: {SERVER_LOCATION.get('city')}, {SERVER_LOCATION.get('country')}")
+            except:
+                print("[INFO] Server Location: (Unicode Name)")
+    except Exception as e:
+        print(f"[WARN] Could not fetch location: {e}")
+
+# --- Schema ---
+@app.on_event("startup")
+def prepare_database():
+    """Creates missing tables, columns and indexes (uvicorn never runs the __main__ block below)."""
+    try:
+        data_manager.prepare_schema()
+    except Exception as e:
+        # e.g. another worker creating the same index at the same moment; the next start retries
+        print(f"[ERROR] Schema preparation failed: {e}")
+
+@app.on_event("startup")
+def start_location_lookup():
+    import threading
+    threading.Thread(target=refresh_server_location, name="server-location", daemon=True).start()
+
+# --- Background Scheduler ---
+@app.on_event("startup")
+def start_due_scheduler():
+    """Wakes the sender when sends come due (opt-in via SCHEDULER_ENABLED)."""
+    import config
+    if config.SCHEDULER_ENABLED:
+        scheduler.start(lambda lead_ids: email_sender.process_email_queue())
+
+@app.on_event("shutdown")
+def stop_due_scheduler():
+    scheduler.stop()
 
 # --- Middleware / Dependency ---
+SESSION_COOKIE = "session"
+
 async def get_current_user(request: Request):
     """
-    Dependency to check if user is logged in via cookie.
-    Simple session check: cookie 'session_user' should exist.
-    In prod, sign this cookie or use JWT.
+    Dependency returning the logged-in user's id from the signed session cookie (None if absent/invalid).
     """
-    user = request.cookies.get("session_user")
-    if not user:
-        return None
-    return user
+    return auth.verify_session_token(request.cookies.get(SESSION_COOKIE))
 
 @app.middleware("http")
 async def auth_middleware(request: Request, call_next):
-    # Public routes
-    if request.url.path in ["/login", "/register", "/static", "/favicon.ico"]:
+    # Public routes (/metrics checks its own bearer token; probes expose no user data)
+    if request.url.path in ["/login", "/register", "/static", "/favicon.ico", "/metrics", "/healthz", "/readyz"]:
         response = await call_next(request)
         return response
     
-    # Check valid cookie
-    user = request.cookies.get("session_user")
-    if not user:
+    # Check the signed session token (no DB access)
+    user_id = auth.verify_session_token(request.cookies.get(SESSION_COOKIE))
+    if not user_id:
         # If API call, return 401? For now assume browser only app
         # If trying to access protected page, redirect to login
-        return RedirectResponse(url="/login")
-        
+        resp = RedirectResponse(url="/login")
+        resp.delete_cookie(SESSION_COOKIE)
+        return resp
+
+    request.state.user_id = user_id
     response = await call_next(request)
     return response
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    # Registered last, so it is outermost and also times auth redirects.
+    # Labelled by route template ("/campaigns/{campaign_id}"), never the raw path.
+    # The SQL profile follows the request into run_db() threads; its totals go out as Server-Timing
+    start = time.perf_counter()
+    status = 500
+    with sql_profiler.profile(f"{request.method} {request.url.path}") as queries:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["Server-Timing"] = f'db;dur={queries.seconds * 1000:.1f};desc="{queries.queries} queries"'
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_name = route.path if route else "unrouted"
+            queries.name = f"{request.method} {route_name}"
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route_name, str(status))
+
 
 # --- Auth Routes ---
 
@@ -89,14 +162,13 @@ async def login_page(request: Request):
 
 @app.post("/login")
 async def login(response: Response, username: str = Form(...), password: str = Form(...)):
-    db = next(get_db())
-    user = db.query(User).filter(User.username == username).first()
-    db.close()
+    user = await run_db(find_user, username)
     
     if user and auth.verify_password(password, user.password_hash):
         # Success
         resp = RedirectResponse(url="/dashboard", status_code=303)
-        resp.set_cookie(key="session_user", value=user.username, httponly=True)
+        resp.set_cookie(key=SESSION_COOKIE, value=auth.create_session_token(user.id),
+                        max_age=config.SESSION_TTL_SECONDS, httponly=True, samesite="lax")
         return resp
     else:
         return templates.TemplateResponse("login.html", {"request": {}, "error": "Invalid credentials"})
@@ -104,7 +176,7 @@ async def login(response: Response, username: str = Form(...), password: str = F
 @app.get("/logout")
 async def logout():
     resp = RedirectResponse(url="/login", status_code=303)
-    resp.delete_cookie("session_user")
+    resp.delete_cookie(SESSION_COOKIE)
     return resp
 
 @app.get("/register", response_class=HTMLResponse)
@@ -113,17 +185,12 @@ async def register_page(request: Request):
 
 @app.post("/register")
 async def register(username: str = Form(...), password: str = Form(...)):
-    db = next(get_db())
-    if db.query(User).filter(User.username == username).first():
-        db.close()
+    if await run_db(find_user, username):
         return templates.TemplateResponse("register.html", {"request": {}, "error": "Username already taken"})
-    
+
     # Create User
     hashed_pw = auth.get_password_hash(password)
-    user = User(username=username, password_hash=hashed_pw)
-    db.add(user)
-    db.commit()
-    db.close()
+    await run_db(db_writer.write, lambda w: w.add(User(username=username, password_hash=hashed_pw)))
     
     # Redirect to Login with success message (or just login logic)
     # For now, redirect to login
@@ -132,11 +199,36 @@ async def register(username: str = Form(...), password: str = Form(...)):
 
 # --- Protected Routes ---
 
-# Helper to get user obj
-def get_user_from_request(request: Request, db):
-    username = request.cookies.get("session_user")
-    if not username: return None
-    return db.query(User).filter(User.username == username).first()
+# user_id -> (User row detached from its session, cached_at)
+_user_cache = {}
+
+async def current_user(request: Request):
+    """The logged-in user's row: from the in-process cache, or one lookup by primary key on a miss."""
+    user_id = getattr(request.state, "user_id", None) or auth.verify_session_token(request.cookies.get(SESSION_COOKIE))
+    if not user_id:
+        return None
+    cached = _user_cache.get(user_id)
+    if cached and time.monotonic() - cached[1] < config.USER_CACHE_TTL:
+        return cached[0]
+    user = await run_db(load_user, user_id)
+    if user:
+        _user_cache[user_id] = (user, time.monotonic())
+    return user
+
+# Sync DB helpers below run in the DB threadpool via run_db, never on the event loop
+def find_user(username):
+    db = next(get_db())
+    try:
+        return db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+
+def load_user(user_id):
+    db = next(get_db())
+    try:
+        return db.get(User, user_id)
+    finally:
+        db.close()
 
 @app.get("/", response_class=HTMLResponse)
 async def landing_page(request: Request):
@@ -144,9 +236,7 @@ async def landing_page(request: Request):
     Public Landing Page.
     Redirects to dashboard if already logged in.
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
-    db.close()
+    user = await current_user(request)
     
     if user:
         return RedirectResponse("/dashboard")
@@ -158,40 +248,11 @@ async def dashboard(request: Request):
     """
     Main Dashboard View (Protected).
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
-        
-    # Text Stats (Scoped)
-    total_leads = db.query(Lead).filter_by(user_id=user.id).count()
-    emails_sent = db.query(Lead).filter_by(user_id=user.id).filter(Lead.status.in_(['Contacted', 'Replied'])).count()
-    replies = db.query(Lead).filter_by(user_id=user.id).filter(Lead.status == "Replied").count()
-    active_campaigns = db.query(Campaign).filter_by(user_id=user.id).filter(Campaign.status == "Active").count()
-    
-    reply_rate = round((replies / emails_sent * 100), 1) if emails_sent > 0 else 0
-    
-    stats = {
-        "total_leads": total_leads,
-        "emails_sent": emails_sent,
-        "replies": replies,
-        "reply_rate": reply_rate,
-        "active_campaigns": active_campaigns
-    }
-    
-    # Recent Activity (Scoped)
-    recent_activity = []
-    recent_leads = db.query(Lead).filter_by(user_id=user.id).order_by(Lead.last_contacted_at.desc()).limit(5).all()
-    for lead in recent_leads:
-        if lead.last_contacted_at:
-            recent_activity.append({
-                "type": "Sent",
-                "title": f"Sent email to {lead.email}",
-                "time": lead.last_contacted_at.strftime("%H:%M")
-            })
-            
-    db.close()
+
+    stats, recent_activity = await run_db(dashboard_data, user.id)
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request, 
@@ -202,24 +263,17 @@ async def dashboard(request: Request):
         "server_location": SERVER_LOCATION
     })
 
+def dashboard_data(user_id):
+    # One grouped aggregate, cached per user for DASHBOARD_CACHE_TTL
+    return dashboard_stats.get_dashboard(user_id)
+
 @app.get("/campaigns", response_class=HTMLResponse)
 async def campaigns_page(request: Request):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user: 
-        db.close()
         return RedirectResponse("/login")
 
-    campaigns_orm = db.query(Campaign).filter_by(user_id=user.id).all()
-    campaigns = []
-    for c in campaigns_orm:
-        campaigns.append({
-            "name": c.name,
-            "status": c.status,
-            "leads_count": len(c.leads),
-            "created_at": c.created_at
-        })
-    db.close()
+    campaigns = await run_db(campaigns_data, user.id)
     
     return templates.TemplateResponse("campaigns.html", {
         "request": request,
@@ -228,83 +282,112 @@ async def campaigns_page(request: Request):
         "username": user.username
     })
 
+def campaigns_data(user_id):
+    # Lead counts per campaign/status/step in one GROUP BY (no lead rows loaded)
+    return campaign_manager.get_campaign_summaries(user_id)
+
 @app.post("/campaigns/create")
 async def create_campaign(request: Request, name: str = Form(...)):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if user:
-        campaign_manager.create_campaign(name, [], user_id=user.id) # Updated signature
-    db.close()
+        await run_db(campaign_manager.create_campaign, name, [], user_id=user.id) # Updated signature
     return RedirectResponse(url="/campaigns", status_code=303)
 
+# Query-string filters shared by /leads and /inbox
+LIST_FILTERS = ["status", "campaign_id", "intent", "q", "date_from", "date_to"]
+
+def list_filters(request: Request):
+    return {key: request.query_params.get(key, "") for key in LIST_FILTERS}
+
+def next_page_url(request: Request, next_cursor):
+    return str(request.url.include_query_params(cursor=next_cursor)) if next_cursor else None
+
 @app.get("/leads", response_class=HTMLResponse)
-async def leads_page(request: Request):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+async def leads_page(request: Request, cursor: str = "", search: str = ""):
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
-        
-    leads = db.query(Lead).filter_by(user_id=user.id).order_by(Lead.id.desc()).limit(100).all()
-    db.close()
+
+    filters = list_filters(request)
+    if search.strip():
+        # Ranked full-text results (one page of best matches)
+        leads, next_cursor = await run_db(lead_search.search_leads, user.id, search), None
+    else:
+        leads, next_cursor = await run_db(lead_listing.list_leads, user.id, filters, cursor)
     
     return templates.TemplateResponse("leads.html", {
         "request": request,
         "page": "leads",
         "leads": leads,
+        "filters": filters,
+        "next_url": next_page_url(request, next_cursor),
+        "is_first_page": not cursor,
+        "search": search,
         "username": user.username
     })
 
+@app.get("/api/leads/search")
+async def search_leads_api(request: Request, q: str = "", limit: int = 50):
+    """Full-text lead search: best matches first, across name, company, role, notes, reply summary and email."""
+    user = await current_user(request)
+    if not user:
+        return JSONResponse({"error": "Not logged in"}, status_code=401)
+    leads = await run_db(lead_search.search_leads, user.id, q, max(1, min(limit, 200)))
+    return {"results": [
+        {"id": l.id, "email": l.email, "name": l.name, "company": l.company, "role": l.role,
+         "status": l.status, "reply_summary": l.reply_summary}
+        for l in leads
+    ]}
+
 @app.get("/brain", response_class=HTMLResponse)
 async def brain_page(request: Request):
     """
     Brain/Knowledge Base View.
     Shows BOTH Private (user_id) and Global (is_global=True) items.
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
         
+    knowledge = await run_db(knowledge_data, user.id)
+    
+    return templates.TemplateResponse("brain.html", {
+        "request": request,
+        "page": "brain",
+        "knowledge": knowledge,
+        "username": user.username
+    })
+
+def knowledge_data(user_id):
+    db = next(get_db())
     # Fetch Private + Global
     from sqlalchemy import or_
     knowledge = db.query(KnowledgeBase).filter(
         or_(
-            KnowledgeBase.user_id == user.id,
+            KnowledgeBase.user_id == user_id,
             KnowledgeBase.is_global == True
         )
     ).order_by(KnowledgeBase.created_at.desc()).all()
     db.close()
-    
-    return templates.TemplateResponse("brain.html", {
-        "request": request,
-        "page": "brain",
-        "knowledge": knowledge,
-        "username": user.username
-    })
+    return knowledge
 
 @app.post("/brain/add")
 async def add_knowledge(request: Request, category: str = Form(...), content: str = Form(...)):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if user:
         # User adds PRIVATE knowledge by default
         item = KnowledgeBase(user_id=user.id, category=category, content=content, is_global=False)
-        db.add(item)
-        db.commit()
-    db.close()
+        await run_db(db_writer.write, lambda w: w.add(item))
+        data_manager.bump_knowledge_version()
     return RedirectResponse(url="/brain", status_code=303)
 
 @app.post("/brain/delete/{item_id}")
 async def delete_knowledge(request: Request, item_id: int):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if user:
         # Only delete if user owns it
-        db.query(KnowledgeBase).filter_by(id=item_id, user_id=user.id).delete()
-        db.commit()
-    db.close()
+        await run_db(db_writer.write, lambda w: w.query(KnowledgeBase).filter_by(id=item_id, user_id=user.id).delete())
+        data_manager.bump_knowledge_version()
     return RedirectResponse(url="/brain", status_code=303)
 
 # --- API Endpoints (kept for background tasks) ---
@@ -312,32 +395,28 @@ async def delete_knowledge(request: Request, item_id: int):
 @app.post("/trigger/scrape")
 def trigger_scrape(background_tasks: BackgroundTasks):
     """Triggers scraping in the background."""
+    @sql_profiler.profiled("job:scrape")
     def task():
         queries = ["AI agency founder", "SaaS founder"]
         leads = scraper.run_discovery(queries)
-        for lead in leads:
-             # Add to DB
-             db = next(data_manager.get_db())
-             try:
-                 # Check if exists
-                 exists = db.query(Lead).filter_by(email=lead["Email"]).first()
-                 if not exists:
-                     new_lead = Lead(
-                         user_id=1, # Default to admin for background scrapes (simplification)
-                         email=lead["Email"],
-                         first_name=lead["Name"], # Scraper returns "Name": "Founder" usually
-                         company=lead["Company"],
-                         job_title="Founder",
-                         status="New",
-                         source="Auto-Scraper"
-                     )
-                     db.add(new_lead)
-                     db.commit()
-                     print(f"[DB] Saved lead: {lead['Email']}")
-             except Exception as e:
-                 print(f"[ERROR] DB Save failed: {e}")
-             finally:
-                 db.close()
+        records = [
+            {
+                "user_id": 1, # Default to admin for background scrapes (simplification)
+                "email": lead["Email"].strip().lower(),
+                "name": lead["Name"], # Scraper returns "Name": "Founder" usually
+                "company": lead["Company"],
+                "role": "Founder",
+                "status": "New",
+                "notes": "Source: Auto-Scraper",
+            }
+            for lead in leads if lead.get("Email")
+        ]
+        try:
+            # One upsert; emails already on file are skipped
+            saved = data_manager.insert_leads(records)
+            print(f"[DB] Saved {saved} new leads ({len(records) - saved} already known).")
+        except Exception as e:
+            print(f"[ERROR] DB Save failed: {e}")
     background_tasks.add_task(task)
     return {"message": "Scraping started"}
 
@@ -346,13 +425,26 @@ def trigger_send(background_tasks: BackgroundTasks):
     background_tasks.add_task(email_sender.process_email_queue)
     return {"message": "Sending started"}
 
+@app.post("/trigger/requeue-failed")
+def trigger_requeue_failed():
+    """Gives sends that ran out of attempts (e.g. during an SMTP outage) a fresh set."""
+    from src import job_queue
+    return {"message": f"Re-queued {job_queue.requeue_failed()} sends"}
+
+@app.post("/trigger/prerender")
+def trigger_prerender(background_tasks: BackgroundTasks):
+    """Renders tomorrow's sends ahead of time (run off-peak)."""
+    background_tasks.add_task(prerender.prerender_upcoming)
+    return {"message": "Pre-render started"}
+
 @app.get("/settings", response_class=HTMLResponse)
 async def settings_view(request: Request):
     """
     User Settings Page.
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
+    if not user:
+        return RedirectResponse("/login")
     # Pass current config to template for pre-filling
     import config
     current_config = {
@@ -396,28 +488,25 @@ async def update_settings(
         return RedirectResponse(url="/settings?error=Failed to save", status_code=303)
 
 @app.get("/inbox", response_class=HTMLResponse)
-async def inbox_view(request: Request):
+async def inbox_view(request: Request, cursor: str = ""):
     """
     Inbox View (Leads with Replied status).
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
     
-    # Fetch leads with 'Replied' status (or just list all contacted for now as a fallback if no replies)
-    # For a real inbox we'd want Replied. Let's show "Replied" and "Contacted" so list isn't empty for demo.
-    leads = db.query(Lead).filter_by(user_id=user.id).filter(
-        Lead.status.in_(['Replied', 'Contacted'])
-    ).order_by(Lead.last_contacted_at.desc()).all()
-    
-    db.close()
+    # Shows "Replied" and "Contacted" (most recent first) unless a status filter is set
+    filters = list_filters(request)
+    leads, next_cursor = await run_db(lead_listing.list_inbox, user.id, filters, cursor)
     
     return templates.TemplateResponse("inbox.html", {
         "request": request,
         "page": "inbox",
         "leads": leads,
+        "filters": filters,
+        "next_url": next_page_url(request, next_cursor),
+        "is_first_page": not cursor,
         "username": user.username
     })
 
@@ -429,12 +518,9 @@ async def favicon():
 
 @app.post("/admin/train")
 async def admin_train(request: Request, background_tasks: BackgroundTasks):
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
-    db.close()
 
     # Run in background
     from src import ai_trainer
@@ -445,37 +531,19 @@ async def admin_train(request: Request, background_tasks: BackgroundTasks):
 @app.get("/admin/health", response_class=HTMLResponse)
 async def admin_health(request: Request):
     """
-    Runs the system verification suite and shows a report card.
+    Shows the readiness report (the same checks as /readyz) as a report card.
     """
-    db = next(get_db())
-    user = get_user_from_request(request, db)
+    user = await current_user(request)
     if not user:
-        db.close()
         return RedirectResponse("/login")
-    db.close() # Close quickly
-    
-    # Run Pytest and capture output
-    import pytest
-    from io import StringIO
-    
-    # Redirect stdout to capture test output
-    capture = StringIO()
-    old_stdout = sys.stdout
-    sys.stdout = capture
-    
-    try:
-        # Run tests/test_system.py
-        # clean output, verbose
-        exit_code = pytest.main(["-v", "tests/test_system.py"])
-    except Exception as e:
-        exit_code = 1
-        print(f"Test Execution Failed: {e}")
-    finally:
-        sys.stdout = old_stdout # Restore stdout
-        
-    output_log = capture.getvalue()
-    status = "Healthy" if exit_code == 0 else "Issues Detected"
-    color = "text-emerald-600 font-bold" if exit_code == 0 else "text-red-600 font-bold"
+
+    report, _ = await readiness_report()
+    ok = report["status"] == "ok"
+    status = "Healthy" if ok else "Issues Detected"
+    color = "text-emerald-600 font-bold" if ok else "text-red-600 font-bold"
+    import html
+    import json
+    output_log = html.escape(json.dumps(report, indent=2))
     
     html_report = f"""
     <!DOCTYPE html>
@@ -499,7 +567,7 @@ async def admin_health(request: Request):
             </div>
             
             <div class="bg-black text-green-400 p-4 rounded font-mono text-sm overflow-x-auto whitespace-pre">
-{{output_log}}
+{output_log}
             </div>
         </div>
     </body>
@@ -508,6 +576,35 @@ async def admin_health(request: Request):
     
     return HTMLResponse(content=html_report)
 
+# --- Probes ---
+
+async def readiness_report():
+    """(report, HTTP status). Not ready if the DB doesn't answer within READINESS_TIMEOUT_SECONDS."""
+    try:
+        # Abandons a hung check rather than waiting on it (fail_after alone can't cancel a thread)
+        report = await run_db_within(config.READINESS_TIMEOUT_SECONDS, health.readiness)
+    except TimeoutError:
+        report = {"status": "unavailable", "database": {"ok": False, "error": "timed out"}}
+    return report, 200 if report["status"] == "ok" else 503
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the event loop is serving. Touches neither the DB nor the thread pool."""
+    return health.liveness()
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: DB round trip plus pool/queue depths and last send/poll times."""
+    report, status_code = await readiness_report()
+    return JSONResponse(report, status_code=status_code)
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape target. Requires `Authorization: Bearer <METRICS_TOKEN>` when one is set."""
+    if config.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {config.METRICS_TOKEN}":
+        return PlainTextResponse("Unauthorized\n", status_code=401)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     print("[INFO] Cloud Server Starting...")
     print("[INFO] Initializing Database...")
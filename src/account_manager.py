@@ -1,5 +1,6 @@
 # src/account_manager.py
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
 from src.data_manager import get_db, SMTPAccount
 import config
 
@@ -52,6 +53,73 @@ def get_next_available_account():
     finally:
         db.close()
 
+def get_sendable_accounts():
+    """Returns every Active account with quota left today (detached, safe to share across threads)."""
+    db = next(get_db())
+    try:
+        return db.query(SMTPAccount).filter(
+            SMTPAccount.status == "Active",
+            SMTPAccount.sent_today < SMTPAccount.daily_limit
+        ).order_by(SMTPAccount.last_used_at.asc()).all()
+    finally:
+        db.close()
+
+def lease_sendable_accounts(owner, lease_seconds=None):
+    """
+    Leases every Active account with quota left that no other send run holds, and returns them
+    (detached). While leased, only `owner` sends through an account, so its daily cap and pacing,
+    enforced by the send engine within one run, hold across all workers and processes.
+    """
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    now = datetime.utcnow()
+    db = next(get_db())
+    try:
+        db.execute(
+            update(SMTPAccount)
+            .where(
+                SMTPAccount.status == "Active",
+                SMTPAccount.sent_today < SMTPAccount.daily_limit,
+                or_(SMTPAccount.lease_owner.is_(None), SMTPAccount.lease_expires_at < now, SMTPAccount.lease_owner == owner)
+            )
+            .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return db.query(SMTPAccount).filter(
+            SMTPAccount.lease_owner == owner,
+            SMTPAccount.status == "Active",
+            SMTPAccount.sent_today < SMTPAccount.daily_limit
+        ).order_by(SMTPAccount.last_used_at.asc()).all()
+    finally:
+        db.close()
+
+def renew_account_leases(owner, lease_seconds=None):
+    """Extends the leases `owner` holds (called alongside the job lease heartbeat)."""
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    db = next(get_db())
+    try:
+        db.execute(
+            update(SMTPAccount)
+            .where(SMTPAccount.lease_owner == owner)
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def release_accounts(owner):
+    """Hands back every account `owner` leased."""
+    db = next(get_db())
+    try:
+        db.execute(
+            update(SMTPAccount)
+            .where(SMTPAccount.lease_owner == owner)
+            .values(lease_owner=None, lease_expires_at=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
 def increment_usage(account_id):
     """Updates usage stats for an account."""
     db = next(get_db())
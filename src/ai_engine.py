@@ -1,35 +1,43 @@
 # src/ai_engine.py
 import os
 import sys
+import importlib
+import importlib.util
 import config
-from src import data_manager
-
-# Lazy checking for deps
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-
-try:
-    import anthropic
-except ImportError:
-    anthropic = None
+from src import data_manager, metrics
+
+# Provider SDKs are imported on first use: each costs hundreds of ms at import time
+_SDK_MODULES = {
+    "openai": "openai",
+    "custom": "openai",
+    "anthropic": "anthropic",
+    "google": "google.generativeai",
+}
+
+def _sdk(provider):
+    """The provider's SDK module, imported now if needed, or None if it is not installed."""
+    try:
+        return importlib.import_module(_SDK_MODULES[provider])
+    except ImportError:
+        return None
 
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+def _sdk_installed(provider):
+    # find_spec checks availability without paying for the import
+    try:
+        return importlib.util.find_spec(_SDK_MODULES[provider]) is not None
+    except ModuleNotFoundError:
+        return False
 
 def check_dependencies(provider):
     """Ensures the required package is installed for the chosen provider."""
     if provider == "openai" or provider == "custom":
-        if OpenAI is None:
+        if not _sdk_installed(provider):
             return "Missing Dependency: Please run `pip install openai`"
     elif provider == "anthropic":
-        if anthropic is None:
+        if not _sdk_installed(provider):
             return "Missing Dependency: Please run `pip install anthropic`"
     elif provider == "google":
-        if genai is None:
+        if not _sdk_installed(provider):
             return "Missing Dependency: Please run `pip install google-generativeai`"
     return None
 
@@ -39,22 +47,9 @@ def get_knowledge_context(user_id):
     MERGES:
     1. Global Knowledge (is_global=True) -> Shared training data
     2. Private Knowledge (user_id=user_id) -> User specific data
+    Cached in data_manager until the knowledge base changes.
     """
-    db = next(data_manager.get_db())
-    
-    items = db.query(KnowledgeBase).filter(
-        or_(
-            KnowledgeBase.is_global == True,
-            KnowledgeBase.user_id == user_id
-        )
-    ).limit(10).all() # Simple retrieval for now, RAG usually does vector search
-    
-    context = ""
-    for item in items:
-        context += f"[{item.category.upper()}]: {item.content}\n\n"
-        
-    db.close()
-    return context
+    return data_manager.get_knowledge_context(user_id)
 
 def get_system_prompt(lead_data, user_id=None):
     """Returns the prompt logic."""
@@ -88,51 +83,61 @@ def get_system_prompt(lead_data, user_id=None):
     """
 
 def generate_with_openai(api_key, model, base_url, prompt):
-    if not OpenAI: return "Error: openai package not installed."
+    openai = _sdk("openai")
+    if not openai: return "Error: openai package not installed."
     
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = openai.OpenAI(api_key=api_key, base_url=base_url)
+    provider = "custom" if base_url else "openai"
     try:
-        response = client.chat.completions.create(
-            model=model or "gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=60,
-            temperature=0.7
-        )
+        with metrics.AI_REQUEST_SECONDS.time(provider):
+            response = client.chat.completions.create(
+                model=model or "gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=60,
+                temperature=0.7
+            )
         return response.choices[0].message.content.strip()
     except Exception as e:
+        metrics.AI_ERRORS.inc(provider)
         return f"OpenAI Error: {e}"
 
 def generate_with_anthropic(api_key, model, prompt):
+    anthropic = _sdk("anthropic")
     if not anthropic: return "Error: anthropic package not installed."
     
     client = anthropic.Anthropic(api_key=api_key)
     try:
-        message = client.messages.create(
-            model=model or "claude-3-haiku-20240307",
-            max_tokens=60,
-            temperature=0.7,
-            system="You are a helpful assistant.",
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
+        with metrics.AI_REQUEST_SECONDS.time("anthropic"):
+            message = client.messages.create(
+                model=model or "claude-3-haiku-20240307",
+                max_tokens=60,
+                temperature=0.7,
+                system="You are a helpful assistant.",
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            )
         return message.content[0].text.strip()
     except Exception as e:
+        metrics.AI_ERRORS.inc("anthropic")
         return f"Anthropic Error: {e}"
 
 def generate_with_google(api_key, model, prompt):
+    genai = _sdk("google")
     if not genai: return "Error: google-generativeai package not installed."
     
     genai.configure(api_key=api_key)
     try:
         model_name = model or "gemini-pro"
         m = genai.GenerativeModel(model_name)
-        response = m.generate_content(prompt)
+        with metrics.AI_REQUEST_SECONDS.time("google"):
+            response = m.generate_content(prompt)
         return response.text.strip()
     except Exception as e:
+        metrics.AI_ERRORS.inc("google")
         return f"Gemini Error: {e}"
 
 def generate_personalization(lead_data):
@@ -166,9 +171,9 @@ def generate_personalization(lead_data):
     else:
         return "Unknown AI Provider configured."
 
-def get_analysis_prompt(email_body):
-    # Fetch KB
-    kb_context = data_manager.get_knowledge_context()
+def get_analysis_prompt(email_body, user_id=None):
+    # Fetch KB (the mailbox owner's, plus global)
+    kb_context = data_manager.get_knowledge_context(user_id)
     
     return f"""
     Analyze this email reply from a lead.
@@ -193,12 +198,12 @@ def get_analysis_prompt(email_body):
     Return ONLY JSON.
     """
 
-def analyze_reply(email_body):
+def analyze_reply(email_body, user_id=None):
     """
     Analyzes a reply to determine intent and sentiment.
     Returns dict: {'intent': ..., 'sentiment': ..., 'summary': ...}
     """
-    prompt = get_analysis_prompt(email_body)
+    prompt = get_analysis_prompt(email_body, user_id)
     
     provider = config.AI_PROVIDER
     api_key = config.AI_API_KEY
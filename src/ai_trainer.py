@@ -2,6 +2,7 @@ import sys
 import os
 import requests
 import json
+from src import data_manager, sql_profiler
 from src.data_manager import KnowledgeBase, get_db
 
 # Datasets to pull from
@@ -22,6 +23,7 @@ DATASETS = [
 
 TARGET_TOTAL = 1000
 
+@sql_profiler.profiled("job:train")
 def import_hf_data():
     print(f"[*] Starting AI Enrichment (Target: {TARGET_TOTAL} Curated Examples)...")
     db = next(get_db())
@@ -92,6 +94,7 @@ def import_hf_data():
                         imported_this_ds += 1
                 
                 db.commit() # Commit after each batch
+                data_manager.bump_knowledge_version()
                 print(f"      -> Added {added_count} new examples.")
                 
                 offset += batch_size
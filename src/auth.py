@@ -1,5 +1,8 @@
 import hashlib
+import hmac
 import os
+import time
+import config
 
 def get_password_hash(password: str) -> str:
     """
@@ -11,3 +14,27 @@ def get_password_hash(password: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return get_password_hash(plain_password) == hashed_password
+
+# --- Session Tokens ---
+# Stateless signed cookie: "<user_id>.<expires_at>.<signature>". Checked without a DB lookup.
+
+def _sign(payload: str) -> str:
+    return hmac.new(config.SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+def create_session_token(user_id: int, ttl_seconds: int = None) -> str:
+    expires_at = int(time.time()) + (ttl_seconds or config.SESSION_TTL_SECONDS)
+    payload = f"{user_id}.{expires_at}"
+    return f"{payload}.{_sign(payload)}"
+
+def verify_session_token(token: str):
+    """Returns the user id if the token is authentic and unexpired, else None."""
+    try:
+        user_id, expires_at, signature = (token or "").split(".")
+        # Compare bytes: compare_digest raises TypeError on non-ASCII str (cookies are client input)
+        if not hmac.compare_digest(signature.encode(), _sign(f"{user_id}.{expires_at}").encode()):
+            return None
+        if int(expires_at) < time.time():
+            return None
+        return int(user_id)
+    except (ValueError, TypeError):
+        return None
@@ -1,6 +1,9 @@
 # src/campaign_manager.py
+import time
 from datetime import datetime, timedelta
-from src import data_manager
+from sqlalchemy import select, update, and_, tuple_, event, func, cast, literal, String
+import config
+from src import data_manager, template_registry, scheduler, dashboard_stats
 from src.data_manager import Lead, Campaign, CampaignStep, get_db
 
 def create_campaign(name, steps_data, user_id):
@@ -10,6 +13,9 @@ def create_campaign(name, steps_data, user_id):
     """
     db = next(get_db())
     try:
+        # Fail once here rather than on every send
+        template_registry.validate_steps(steps_data)
+
         # Check if exists for THIS user
         exists = db.query(Campaign).filter_by(user_id=user_id, name=name).first()
         if exists:
@@ -27,15 +33,16 @@ def create_campaign(name, steps_data, user_id):
             new_step = CampaignStep(
                 campaign_id=campaign.id,
                 step_number=index + 1,
-                delay_days=step.get('delay', 2),
-                subject_template=step.get('subject', ''),
-                body_template=step.get('body', '')
+                day_delay=step.get('delay', 2),
+                template_subject=step.get('subject', ''),
+                template_body=step.get('body', '')
             )
             db.add(new_step)
         
         db.commit()
         db.refresh(campaign)
         db.expunge(campaign) # Detach so it can be used after session close
+        dashboard_stats.invalidate(user_id)
         return campaign
     except Exception as e:
         print(f"[ERROR] Create Campaign Failed: {e}")
@@ -44,63 +51,204 @@ def create_campaign(name, steps_data, user_id):
     finally:
         db.close()
 
-def enroll_leads(campaign_id, limit=50):
+def enroll_leads(campaign_id, limit=50, user_id=None, statuses=None, spread_seconds=0):
     """
-    Enrolls new leads into a campaign.
+    Enrolls unassigned leads into a campaign with one set-based UPDATE. Returns the count.
+    user_id: whose leads to enroll (defaults to the campaign owner). limit=None enrolls all of them.
+    statuses: only leads in these states (defaults to any state except Replied/Bounced).
+    spread_seconds: staggers the first send over this window (by lead id) instead of starting all at once.
     """
     db = next(get_db())
     try:
+        campaign = db.query(Campaign).filter_by(id=campaign_id).first()
+        if not campaign:
+            print(f"[ERROR] Campaign {campaign_id} not found.")
+            return 0
+
         # Find leads not in any campaign
-        leads = db.query(Lead).filter(Lead.campaign_id == None).limit(limit).all()
-        
-        count = 0
-        for lead in leads:
-            lead.campaign_id = campaign_id
-            lead.current_step = 1
-            lead.next_action_at = datetime.utcnow() # Ready immediately for Step 1
-            count += 1
-            
+        conditions = [Lead.campaign_id == None, Lead.user_id == (user_id or campaign.user_id)]
+        if statuses:
+            conditions.append(Lead.status.in_(statuses))
+        else:
+            conditions.append(func.coalesce(Lead.status, "").notin_(["Replied", "Bounced"]))
+        if limit is not None:
+            picked = select(Lead.id).where(*conditions).order_by(Lead.id).limit(limit)
+            conditions = [Lead.id.in_(picked.scalar_subquery()), Lead.campaign_id == None]
+
+        now = datetime.utcnow()
+        result = db.execute(
+            update(Lead)
+            .where(*conditions)
+            .values(
+                campaign_id=campaign_id,
+                current_step=1,
+                next_action_at=_staggered_start(db.bind.dialect.name, now, spread_seconds) # Ready for Step 1
+            )
+            .execution_options(synchronize_session=False)
+        )
         db.commit()
+        count = result.rowcount
+        if count:
+            scheduler.reload()
+            dashboard_stats.invalidate(user_id or campaign.user_id)
         print(f"[INFO] Enrolled {count} leads into Campaign {campaign_id}")
         return count
     finally:
         db.close()
 
-def get_due_leads():
+def _staggered_start(dialect, now, spread_seconds):
+    """SQL for `now + (lead id mod spread_seconds) seconds`, so a big enrollment does not all come due at once."""
+    if not spread_seconds or spread_seconds <= 1:
+        return now
+    offset = Lead.id % int(spread_seconds)
+    if dialect == "sqlite":
+        # Same text format SQLAlchemy stores (…SS.ffffff): the keyset cursor in iter_due_tasks
+        # compares these strings, and datetime() alone would drop the fraction
+        shifted = func.strftime("%Y-%m-%d %H:%M:%S", now.strftime("%Y-%m-%d %H:%M:%S"), "+" + cast(offset, String) + " seconds")
+        return shifted.concat(f".{now.microsecond:06d}")
+    if dialect == "postgresql":
+        return literal(now) + func.make_interval(0, 0, 0, 0, 0, 0, offset)
+    print(f"[WARN] Staggered enrollment not supported on {dialect}; all leads start now.")
+    return now
+
+def get_campaign_summaries(user_id):
     """
-    Returns leads that are ready for their next step.
+    Lists a user's campaigns with lead counts, broken down by status and by step.
+    Two queries total: the campaigns, and one GROUP BY over their leads.
     """
     db = next(get_db())
     try:
-        now = datetime.utcnow()
-        # Find leads where next_action_at is past, status is not Replied/Completed
-        leads = db.query(Lead).filter(
-            Lead.next_action_at <= now,
-            Lead.status.notin_(['Replied', 'Bounced', 'Completed']),
-            Lead.campaign_id != None
+        campaigns = db.execute(
+            select(Campaign.id, Campaign.name, Campaign.status, Campaign.created_at)
+            .where(Campaign.user_id == user_id)
+            .order_by(Campaign.id)
         ).all()
-        
-        results = []
-        for lead in leads:
-            # Fetch the actual step template
-            step = db.query(CampaignStep).filter_by(
-                campaign_id=lead.campaign_id, 
-                step_number=lead.current_step
-            ).first()
-            
-            if step:
-                results.append({
-                    "lead_obj": lead, # Pass ORM object for updates
-                    "email": lead.email,
-                    "name": lead.name,
-                    "company": lead.company,
-                    "personalization": lead.personalization_line,
-                    "subject": step.subject_template,
-                    "body_template": step.body_template,
-                    "step_number": lead.current_step,
-                    "step_delay": step.delay_days
-                })
-        return results
+        counts = db.execute(
+            select(Lead.campaign_id, Lead.status, Lead.current_step, func.count())
+            .join(Campaign, Campaign.id == Lead.campaign_id)
+            .where(Campaign.user_id == user_id)
+            .group_by(Lead.campaign_id, Lead.status, Lead.current_step)
+        ).all()
+    finally:
+        db.close()
+
+    summaries = {
+        c.id: {"id": c.id, "name": c.name, "status": c.status, "created_at": c.created_at,
+               "leads_count": 0, "by_status": {}, "by_step": {}}
+        for c in campaigns
+    }
+    for campaign_id, status, step, count in counts:
+        summary = summaries[campaign_id]
+        summary["leads_count"] += count
+        summary["by_status"][status or "New"] = summary["by_status"].get(status or "New", 0) + count
+        summary["by_step"][step] = summary["by_step"].get(step, 0) + count
+    for summary in summaries.values():
+        summary["by_step"] = dict(sorted(summary["by_step"].items(), key=lambda item: item[0] or 0))
+    return list(summaries.values())
+
+# (campaign_id, step_number) -> (day_delay or None if the step does not exist, cached_at)
+_step_cache = {}
+STEP_CACHE_TTL = 60 # Seconds; bounds staleness when another process edits steps
+
+# Leads in these states never get another sequence email
+STOPPED_STATUSES = ['Replied', 'Bounced', 'Completed']
+
+def due_filter(now):
+    """SQL conditions for 'this lead has a sequence step due by `now`'."""
+    return [
+        Lead.next_action_at <= now,
+        Lead.status.notin_(STOPPED_STATUSES),
+        Lead.campaign_id != None
+    ]
+
+class DueTask:
+    """One due send, holding only what the sender needs (no ORM object, no per-instance dict)."""
+    __slots__ = ("lead_id", "email", "name", "company", "personalization", "due_at",
+                 "step_id", "step_number", "subject", "body_template", "step_delay", "campaign_id", "job_id")
+
+    def __init__(self, lead_id, email, name, company, personalization, due_at,
+                 step_id, step_number, subject, body_template, step_delay, campaign_id=None, job_id=None):
+        self.lead_id = lead_id
+        self.email = email
+        self.name = name
+        self.company = company
+        self.personalization = personalization
+        self.due_at = due_at
+        self.step_id = step_id
+        self.step_number = step_number
+        self.subject = subject
+        self.body_template = body_template
+        self.step_delay = step_delay
+        self.campaign_id = campaign_id
+        self.job_id = job_id
+
+    def __repr__(self):
+        return f"<DueTask lead={self.lead_id} step={self.step_number}>"
+
+def iter_due_tasks(until=None, lead_ids=None, batch_size=None):
+    """
+    Yields a DueTask for every lead ready for its next step
+    (or ready by `until`, for look-ahead work like pre-rendering).
+    `lead_ids` narrows the lookup to specific leads, e.g. the ones a send worker claimed.
+
+    Pages through the leads with keyset pagination on (next_action_at, id), one short
+    session per page, so memory stays flat however large the backlog is.
+    """
+    now = until or datetime.utcnow()
+    batch_size = batch_size or config.DUE_TASK_PAGE_SIZE
+
+    # Find leads where next_action_at is past, status is not Replied/Completed,
+    # joined to their current step in the same query (no per-lead step lookup)
+    query = select(
+        Lead.id, Lead.email, Lead.name, Lead.company, Lead.personalization_line, Lead.next_action_at,
+        CampaignStep.id, Lead.current_step, CampaignStep.template_subject, CampaignStep.template_body,
+        CampaignStep.day_delay, Lead.campaign_id
+    ).join(
+        CampaignStep,
+        and_(CampaignStep.campaign_id == Lead.campaign_id, CampaignStep.step_number == Lead.current_step)
+    ).where(*due_filter(now)).order_by(Lead.next_action_at, Lead.id).limit(batch_size)
+    if lead_ids is not None:
+        query = query.where(Lead.id.in_(lead_ids))
+
+    cursor = None
+    while True:
+        page = query if cursor is None else query.where(tuple_(Lead.next_action_at, Lead.id) > cursor)
+        db = next(get_db())
+        try:
+            rows = db.execute(page).all()
+        finally:
+            db.close()
+
+        for row in rows:
+            yield DueTask(*row)
+        if len(rows) < batch_size:
+            return
+        cursor = (rows[-1][5], rows[-1][0])
+
+def get_due_leads(until=None, lead_ids=None):
+    """
+    Returns the due tasks as a list. Prefer iter_due_tasks() for large backlogs.
+    """
+    return list(iter_due_tasks(until=until, lead_ids=lead_ids))
+
+def get_step_delay(campaign_id, step_number):
+    """
+    Returns the day_delay of a campaign step, or None if the step does not exist.
+    Cached per (campaign_id, step_number); CampaignStep edits clear the cache.
+    """
+    key = (campaign_id, step_number)
+    cached = _step_cache.get(key)
+    if cached and time.monotonic() - cached[1] < STEP_CACHE_TTL:
+        return cached[0]
+
+    db = next(get_db())
+    try:
+        step = db.query(CampaignStep.day_delay).filter_by(
+            campaign_id=campaign_id, step_number=step_number
+        ).first()
+        delay = None if step is None else (step.day_delay or 0)
+        _step_cache[key] = (delay, time.monotonic())
+        return delay
     finally:
         db.close()
 
@@ -114,18 +262,13 @@ def advance_lead(lead_id):
         if not lead: return
         
         # Check if there is a next step
-        current_step = lead.current_step
-        next_step_num = current_step + 1
+        next_step_num = lead.current_step + 1
+        next_delay = get_step_delay(lead.campaign_id, next_step_num)
         
-        next_step = db.query(CampaignStep).filter_by(
-            campaign_id=lead.campaign_id, 
-            step_number=next_step_num
-        ).first()
-        
-        if next_step:
+        if next_delay is not None:
             lead.current_step = next_step_num
             # Schedule next email based on delay
-            lead.next_action_at = datetime.utcnow() + timedelta(days=next_step.delay_days)
+            lead.next_action_at = datetime.utcnow() + timedelta(days=next_delay)
             lead.status = "Contacted"
         else:
             # Sequence complete
@@ -134,5 +277,12 @@ def advance_lead(lead_id):
             
         lead.last_contacted_at = datetime.utcnow()
         db.commit()
+        scheduler.notify(lead.id, lead.next_action_at)
     finally:
         db.close()
+
+@event.listens_for(CampaignStep, "after_insert")
+@event.listens_for(CampaignStep, "after_update")
+@event.listens_for(CampaignStep, "after_delete")
+def _on_step_changed(mapper, connection, target):
+    _step_cache.clear()
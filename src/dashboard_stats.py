@@ -0,0 +1,81 @@
+# src/dashboard_stats.py
+"""
+Dashboard statistics. All counts come from one grouped aggregate (lead and campaign counts by
+status, served by per-tenant indexes) and are cached per user for a few seconds, so page loads
+cost at most one aggregate per user per DASHBOARD_CACHE_TTL however often the page is hit.
+"""
+import time
+import threading
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from sqlalchemy import select, func, literal, union_all
+from src.data_manager import Lead, Campaign, get_db
+
+# user_id -> (cached_at, stats, recent_activity)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _status_counts(db, user_id):
+    """{("lead"|"campaign", status): count} in one round trip."""
+    leads = select(literal("lead").label("kind"), Lead.status, func.count()).where(
+        Lead.user_id == user_id
+    ).group_by(Lead.status)
+    campaigns = select(literal("campaign").label("kind"), Campaign.status, func.count()).where(
+        Campaign.user_id == user_id
+    ).group_by(Campaign.status)
+    return {(kind, status): count for kind, status, count in db.execute(union_all(leads, campaigns))}
+
+
+def compute_dashboard(user_id):
+    db = next(get_db())
+    try:
+        counts = _status_counts(db, user_id)
+        recent = db.execute(
+            select(Lead.email, Lead.last_contacted_at)
+            .where(Lead.user_id == user_id, Lead.last_contacted_at != None)
+            .order_by(Lead.last_contacted_at.desc())
+            .limit(5)
+        ).all()
+    finally:
+        db.close()
+
+    total_leads = sum(count for (kind, _), count in counts.items() if kind == "lead")
+    emails_sent = counts.get(("lead", "Contacted"), 0) + counts.get(("lead", "Replied"), 0)
+    replies = counts.get(("lead", "Replied"), 0)
+    stats = {
+        "total_leads": total_leads,
+        "emails_sent": emails_sent,
+        "replies": replies,
+        "reply_rate": round((replies / emails_sent * 100), 1) if emails_sent > 0 else 0,
+        "active_campaigns": counts.get(("campaign", "Active"), 0)
+    }
+    recent_activity = [
+        {"type": "Sent", "title": f"Sent email to {email}", "time": contacted_at.strftime("%H:%M")}
+        for email, contacted_at in recent
+    ]
+    return stats, recent_activity
+
+
+def get_dashboard(user_id):
+    """Returns (stats, recent_activity) for a user, from cache when fresh."""
+    cached = _cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < config.DASHBOARD_CACHE_TTL:
+        return cached[1], cached[2]
+    stats, recent_activity = compute_dashboard(user_id)
+    with _lock:
+        _cache[user_id] = (time.monotonic(), stats, recent_activity)
+    return stats, recent_activity
+
+
+def invalidate(user_id=None):
+    """Drops cached stats for one user (or everyone). Called by lead inserts/imports, enrollment and campaign creation."""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
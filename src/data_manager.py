@@ -1,15 +1,18 @@
 # src/data_manager.py
 import os
 import sys
+import time
 import config
 from datetime import datetime
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, inspect, text, or_, case, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.sql import func
 
 # Add parent path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import sql_profiler
 
 Base = declarative_base()
 
@@ -27,6 +30,7 @@ class Campaign(Base):
 
 class CampaignStep(Base):
     __tablename__ = 'campaign_steps'
+    __table_args__ = (Index('ix_campaign_steps_lookup', 'campaign_id', 'step_number'),)
     id = Column(Integer, primary_key=True)
     campaign_id = Column(Integer, ForeignKey('campaigns.id'))
     step_number = Column(Integer) # 1, 2, 3...
@@ -38,9 +42,28 @@ class CampaignStep(Base):
 
 class Lead(Base):
     __tablename__ = 'leads'
+    __table_args__ = (
+        # Scheduler index: only leads in a sequence, ordered the way the due scan pages through them
+        # (next_action_at, id). Cost tracks the number of sequenced leads, not the size of the table.
+        Index('ix_leads_due', 'next_action_at', 'id',
+              sqlite_where=text("campaign_id IS NOT NULL AND next_action_at IS NOT NULL"),
+              postgresql_where=text("campaign_id IS NOT NULL AND next_action_at IS NOT NULL"),
+              postgresql_include=['status', 'campaign_id', 'current_step']),
+        # One row per address per tenant; also the conflict target for insert_leads()
+        Index('uq_leads_user_email', 'user_id', 'email', unique=True),
+        # Lookups by address alone (mark_sent, update_personalization)
+        Index('ix_leads_email', 'email'),
+        # /leads pages: newest first within a tenant
+        Index('ix_leads_user_page', 'user_id', 'id'),
+        # Dashboard: per-tenant status counts (index-only) and most recent contacts
+        Index('ix_leads_user_status', 'user_id', 'status'),
+        Index('ix_leads_user_contacted', 'user_id', 'last_contacted_at'),
+        # Campaigns page: per-campaign counts by status and step, index-only
+        Index('ix_leads_campaign_progress', 'campaign_id', 'status', 'current_step'),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    email = Column(String, nullable=False) # Removed unique=True constraint globally, unique per user ideally but for simplicity keep it loose
+    email = Column(String, nullable=False) # Unique per user (uq_leads_user_email), not globally
     name = Column(String)
     company = Column(String)
     role = Column(String)
@@ -68,6 +91,37 @@ class Lead(Base):
 
     campaign = relationship("Campaign", back_populates="leads")
 
+class RenderedMessage(Base):
+    __tablename__ = 'rendered_messages'
+    __table_args__ = (UniqueConstraint('lead_id', 'step_number', name='uq_rendered_lead_step'),)
+    id = Column(Integer, primary_key=True)
+    lead_id = Column(Integer, ForeignKey('leads.id'), nullable=False)
+    step_number = Column(Integer, nullable=False)
+    content_hash = Column(String, nullable=False) # Hash of the inputs it was rendered from
+    message = Column(LargeBinary, nullable=False) # Final MIME bytes, minus the From header
+    rendered_at = Column(DateTime, default=datetime.utcnow)
+
+class SendJob(Base):
+    __tablename__ = 'send_jobs'
+    __table_args__ = (
+        # At most one open job per lead, so two enqueuers can never both queue the same send
+        Index('uq_send_jobs_open_lead', 'lead_id', unique=True,
+              sqlite_where=text("status IN ('Queued', 'Leased')"),
+              postgresql_where=text("status IN ('Queued', 'Leased')")),
+        Index('ix_send_jobs_claim', 'status', 'lease_expires_at'),
+    )
+    id = Column(Integer, primary_key=True)
+    lead_id = Column(Integer, ForeignKey('leads.id'), nullable=False)
+    step_number = Column(Integer, nullable=False)
+    status = Column(String, default="Queued") # Queued, Leased, Done, Failed, Retried (failure cleared by requeue_failed)
+    lease_owner = Column(String, nullable=True) # Lease token of the worker holding it
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    not_before = Column(DateTime, nullable=True) # Retry backoff: not claimable until then
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class SMTPAccount(Base):
     __tablename__ = 'smtp_accounts'
     id = Column(Integer, primary_key=True)
@@ -81,6 +135,10 @@ class SMTPAccount(Base):
     sent_today = Column(Integer, default=0)
     last_used_at = Column(DateTime, nullable=True)
     status = Column(String, default="Active") # Active, Error, Paused
+    send_interval = Column(Integer, nullable=True) # Seconds between sends (None = config default)
+    max_in_flight = Column(Integer, nullable=True) # Concurrent sends (None = config default)
+    lease_owner = Column(String, nullable=True) # The one send run pacing this inbox (quota/pacing are per run)
+    lease_expires_at = Column(DateTime, nullable=True)
 
 class KnowledgeBase(Base):
     __tablename__ = 'knowledge_base'
@@ -105,6 +163,33 @@ if DB_URL.startswith("postgres://"):
 
 engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if "sqlite" in DB_URL else {})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+sql_profiler.install(engine) # Statement timing for both /metrics and the SQL profiler
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself (see _begin_sqlite), so savepoints and BEGIN IMMEDIATE work
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL") # Readers no longer wait for the writer
+    cursor.execute("PRAGMA synchronous=NORMAL") # Durable at each WAL checkpoint, no fsync per commit
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _begin_sqlite(conn):
+    # Writers ask for IMMEDIATE so they take the write lock up front (and wait on busy_timeout)
+    # instead of failing when a deferred read transaction later tries to upgrade
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+def enable_sqlite_production(target_engine):
+    """Applies the production pragmas to every new connection of a SQLite engine."""
+    if target_engine.dialect.name == "sqlite" and not event.contains(target_engine, "connect", _set_sqlite_pragmas):
+        event.listen(target_engine, "connect", _set_sqlite_pragmas)
+        event.listen(target_engine, "begin", _begin_sqlite)
+
+if config.SQLITE_PRODUCTION:
+    enable_sqlite_production(engine)
 
 def get_db():
     db = SessionLocal()
@@ -113,25 +198,91 @@ def get_db():
     finally:
         db.close()
 
-def get_knowledge_context():
-    """Returns all knowledge base items formatted as a specific context string."""
+# Assembled knowledge context per user (None = global only): user_id -> (version, built_at, text).
+# Writers call bump_knowledge_version(); the TTL bounds staleness for writes made by other processes.
+_knowledge_cache = {}
+_knowledge_version = 0
+
+def bump_knowledge_version():
+    """Invalidates every cached knowledge context. Call after writing to knowledge_base."""
+    global _knowledge_version
+    _knowledge_version += 1
+
+def get_knowledge_context(user_id=None):
+    """
+    Returns knowledge base items formatted as a context string: global items plus,
+    when user_id is given, that user's private items. Cached until the next write.
+    Bounded to KNOWLEDGE_CONTEXT_ITEMS items (the user's own first) and KNOWLEDGE_CONTEXT_MAX_CHARS,
+    since it is embedded in every prompt and /admin/train can load thousands of rows.
+    """
+    cached = _knowledge_cache.get(user_id)
+    if cached and cached[0] == _knowledge_version and time.monotonic() - cached[1] < config.KNOWLEDGE_CACHE_TTL:
+        return cached[2]
+
+    version = _knowledge_version
     db = next(get_db())
     try:
-        items = db.query(KnowledgeBase).all()
-        if not items: return ""
-        
-        context = "### Custom Knowledge Base ###\n"
-        for item in items:
-            context += f"[{item.category}]: {item.content}\n"
-        context += "#############################\n"
-        return context
+        scope = KnowledgeBase.is_global == True
+        order = [KnowledgeBase.id]
+        if user_id is not None:
+            scope = or_(scope, KnowledgeBase.user_id == user_id)
+            order.insert(0, case((KnowledgeBase.user_id == user_id, 0), else_=1))
+        items = db.query(KnowledgeBase.category, KnowledgeBase.content).filter(scope).order_by(
+            *order
+        ).limit(config.KNOWLEDGE_CONTEXT_ITEMS).all()
     finally:
         db.close()
 
+    context = ""
+    if items:
+        body = "".join(f"[{category}]: {content}\n" for category, content in items)
+        if len(body) > config.KNOWLEDGE_CONTEXT_MAX_CHARS:
+            body = body[:config.KNOWLEDGE_CONTEXT_MAX_CHARS].rstrip() + "\n...\n"
+        context = "### Custom Knowledge Base ###\n" + body + "#############################\n"
+    _knowledge_cache[user_id] = (version, time.monotonic(), context)
+    return context
+
+def ensure_schema():
+    """Adds columns introduced after a table was first created (create_all never alters tables)."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            print(f"[INFO] Adding column {table.name}.{column.name}")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+
+def ensure_indexes():
+    """Creates indexes added after their table existed (create_all skips tables that are already there)."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except (IntegrityError, OperationalError) as e:
+                if not index.unique:
+                    raise
+                # Existing duplicates block a unique index; startup continues, but upserts need it
+                print(f"[WARN] Could not create unique index {index.name}; remove duplicate rows and restart: {e.orig}")
+
+def prepare_schema():
+    """
+    Brings the schema up to date: tables, added columns, indexes and the search index. Idempotent;
+    runs when the web app or a send worker starts, and as `python -m src.data_manager` (release step).
+    """
+    Base.metadata.create_all(bind=engine)
+    ensure_schema()
+    ensure_indexes()
+    from src import lead_search
+    lead_search.ensure_search_index(engine)
+
 def initialize_db(db_url=DB_URL):
     """Creates tables and migrates data if needed."""
     print("[INFO] Initializing Database...")
-    Base.metadata.create_all(bind=engine)
+    prepare_schema()
     
     # Create Default Admin
     db = SessionLocal()
@@ -149,43 +300,17 @@ def initialize_db(db_url=DB_URL):
         migrate_excel_to_db()
 
 def migrate_excel_to_db():
-    """Migrates leads from old Excel file to new SQLite DB."""
+    """Migrates leads from old Excel file to new SQLite DB (owned by the admin user)."""
+    from src import lead_importer
     try:
-        df = pd.read_excel(config.DATA_FILE)
         session = SessionLocal()
-        
-        count = 0
-        for _, row in df.iterrows():
-            email = row.get("Email")
-            if not email or pd.isna(email):
-                continue
-                
-            # Check existence
-            exists = session.query(Lead).filter_by(email=email).first()
-            if exists:
-                continue
-                
-            lead = Lead(
-                email=email,
-                name=row.get("Name", ""),
-                company=row.get("Company", ""),
-                role=row.get("Role", ""),
-                website=row.get("Website", ""),
-                linkedin=row.get("LinkedIn", ""),
-                notes=row.get("Notes", ""),
-                personalization_line=row.get("Personalization_Line", ""),
-                status="Contacted" if row.get("Email_Sent") == "Yes" else "New",
-                email_sent=row.get("Email_Sent", "No"),
-                replied=row.get("Replied", "No"),
-                date_added=datetime.now() # Approximate
-            )
-            session.add(lead)
-            count += 1
-            
-        session.commit()
-        session.close()
-        if count > 0:
-            print(f"[SUCCESS] Migrated {count} leads from Excel to Database.")
+        try:
+            admin = session.query(User).filter_by(username="admin").first()
+        finally:
+            session.close()
+        stats = lead_importer.import_file(config.DATA_FILE, admin.id)
+        if stats["inserted"] > 0:
+            print(f"[SUCCESS] Migrated {stats['inserted']} leads from Excel to Database.")
             # Rename old file to avoid confusion? 
             # os.rename(config.DATA_FILE, config.DATA_FILE + ".bak")
     except Exception as e:
@@ -195,6 +320,7 @@ def migrate_excel_to_db():
 
 def load_data():
     """Returns all leads as a DataFrame for compatibility."""
+    import pandas as pd # Only this legacy helper needs pandas; keep it off the import path
     session = SessionLocal()
     query = session.query(Lead)
     df = pd.read_sql(query.statement, session.bind)
@@ -221,32 +347,63 @@ def save_data(df):
     """
     pass # No-op for now, as we treat DB as source of truth
 
-def add_lead(lead_dict):
-    """Adds a single lead."""
-    session = SessionLocal()
-    try:
-        email = lead_dict.get("Email")
-        if session.query(Lead).filter_by(email=email).first():
-            return False
-            
-        new_lead = Lead(
-            email=email,
-            name=lead_dict.get("Name", ""),
-            company=lead_dict.get("Company", ""),
-            role=lead_dict.get("Role", ""),
-            website=lead_dict.get("Website", ""),
-            linkedin=lead_dict.get("LinkedIn", ""),
-            personalization_line=lead_dict.get("Personalization_Line", ""),
-            # Default to Default Campaign if exists? N/A for now.
+# Dialects with INSERT ... ON CONFLICT
+_UPSERT_INSERT = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def insert_leads(records, session=None, update_fields=None):
+    """
+    Inserts lead dicts (Lead column names, user_id required) with INSERT ... ON CONFLICT on (user_id, email).
+    Existing leads are left alone, or have `update_fields` overwritten. Returns how many rows were written.
+    """
+    if not records:
+        return 0
+    dialect = (session.bind if session else engine).dialect.name
+    if dialect not in _UPSERT_INSERT:
+        raise NotImplementedError(f"Lead upsert is not supported on {dialect}")
+    stmt = _UPSERT_INSERT[dialect](Lead)
+    if update_fields:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "email"],
+            set_={field: stmt.excluded[field] for field in update_fields}
         )
-        session.add(new_lead)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["user_id", "email"])
+    stmt = stmt.returning(Lead.id)
+
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        written = len(session.execute(stmt, records).all())
         session.commit()
-        return True
+        if written:
+            from src import dashboard_stats # Imports this module
+            for user_id in {r["user_id"] for r in records}:
+                dashboard_stats.invalidate(user_id)
+        return written
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if own_session:
+            session.close()
+
+def add_lead(lead_dict, user_id=1):
+    """Adds a single lead (defaults to the admin user). False if the user already has that email."""
+    try:
+        return insert_leads([{
+            "user_id": user_id,
+            "email": (lead_dict.get("Email") or "").strip().lower(),
+            "name": lead_dict.get("Name", ""),
+            "company": lead_dict.get("Company", ""),
+            "role": lead_dict.get("Role", ""),
+            "website": lead_dict.get("Website", ""),
+            "linkedin": lead_dict.get("LinkedIn", ""),
+            "personalization_line": lead_dict.get("Personalization_Line", ""),
+            # Default to Default Campaign if exists? N/A for now.
+        }]) == 1
     except Exception as e:
         print(f"[ERROR] Add Lead Failed: {e}")
         return False
-    finally:
-        session.close()
 
 def get_unsent_leads(limit=50):
     """Gets leads that have not been sent (legacy check)."""
@@ -288,3 +445,8 @@ def update_personalization(email, line):
             session.commit()
     finally:
         session.close()
+
+
+if __name__ == "__main__":
+    prepare_schema()
+    print("[SUCCESS] Database schema is up to date.")
@@ -0,0 +1,37 @@
+# src/db_async.py
+"""
+Runs blocking database work from async request handlers without stalling the event loop.
+Calls go to worker threads through a dedicated limiter, sized to the DB connection pool, so a
+burst of requests waits for a free slot instead of piling up on pool checkouts.
+"""
+import functools
+import anyio
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+_limiter = anyio.CapacityLimiter(config.DB_THREADPOOL_SIZE)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Awaits fn(*args, **kwargs) run in the DB threadpool."""
+    return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=_limiter)
+
+
+async def run_db_within(seconds, fn, *args, **kwargs):
+    """
+    run_db() that raises TimeoutError after `seconds`. A plain run_db() can't be cancelled, so on
+    timeout the call is abandoned: its thread finishes (or hangs) in the background, off the limiter.
+    """
+    with anyio.fail_after(seconds):
+        return await anyio.to_thread.run_sync(
+            functools.partial(fn, *args, **kwargs), abandon_on_cancel=True, limiter=_limiter
+        )
+
+
+def in_use():
+    """DB threadpool slots currently taken."""
+    return _limiter.borrowed_tokens
@@ -0,0 +1,113 @@
+# src/db_writer.py
+"""
+Single-writer queue for SQLite. SQLite allows one writer at a time; when request handlers and
+background senders all commit directly they queue up on the database lock and eventually fail
+with "database is locked". In SQLite production mode every write is handed to one thread
+instead, which commits queued writes together (each in its own savepoint), so readers never
+block behind writers and writers never fight each other.
+
+On Postgres, or with SQLITE_PRODUCTION off, write() simply runs in the caller's thread.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from src import data_manager
+
+_queue = queue.Queue()
+_thread = None
+_start_lock = threading.Lock()
+
+
+def enabled():
+    return config.SQLITE_PRODUCTION and data_manager.engine.dialect.name == "sqlite"
+
+
+def write(fn, timeout=None):
+    """
+    Runs fn(db) in a write transaction and returns its result (exceptions propagate).
+    fn must not commit; the writer commits. Blocks until the write is committed.
+    """
+    if not enabled() or threading.current_thread() is _thread:
+        db = next(data_manager.get_db())
+        try:
+            result = fn(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return submit(fn).result(timeout)
+
+
+def submit(fn):
+    """Queues fn(db) for the writer thread; returns a Future for its result."""
+    _ensure_started()
+    future = Future()
+    _queue.put((fn, future))
+    return future
+
+
+def _ensure_started():
+    global _thread
+    with _start_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="db-writer", daemon=True)
+            _thread.start()
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < config.DB_WRITER_BATCH:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch)
+        except Exception as e:
+            print(f"[ERROR] DB writer batch failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+def _write_batch(batch):
+    db = next(data_manager.get_db())
+    results = []
+    try:
+        db.connection(execution_options={"sqlite_immediate": True})
+        for fn, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            savepoint = db.begin_nested()
+            try:
+                result = fn(db)
+                savepoint.commit() # Flushes, so constraint errors land on this write
+                results.append((future, result))
+            except Exception as e:
+                # Only this write is undone; the rest of the batch still commits
+                savepoint.rollback()
+                future.set_exception(e)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        for future, _ in results:
+            future.set_exception(e)
+        return
+    finally:
+        db.close()
+    for future, result in results:
+        future.set_result(result)
+
+
+def pending():
+    return _queue.qsize()
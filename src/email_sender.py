@@ -1,109 +1,212 @@
 # src/email_sender.py
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import formataddr
 import sys
 import os
-import time
-from jinja2 import Template
+import socket
+import threading
+import uuid
 
 # Add parent to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
-from src import campaign_manager, account_manager
+from src import campaign_manager, account_manager, send_engine, template_registry, prerender, job_queue, write_behind, metrics, sql_profiler
+from src.smtp_pool import SMTPConnectionPool, is_account_error
 
-def render_template(template_str, lead_context):
-    """Renders the email template with lead data."""
+# Authenticated sessions shared across sends (keyed by SMTPAccount.id)
+smtp_pool = SMTPConnectionPool()
+
+# Per-send DB state, written in bulk
+send_outcomes = write_behind.SendOutcomeBuffer()
+
+def render_template(template_str, lead_context, step_id=None, field="body"):
+    """Renders the email template with lead data (compiled once per step via the registry)."""
     try:
-        t = Template(template_str)
-        return t.render(**lead_context)
+        with metrics.TEMPLATE_RENDER_SECONDS.time(field):
+            t = template_registry.get_template(template_str, step_id, field)
+            return t.render(**lead_context)
     except Exception as e:
         print(f"[ERROR] Template Render Failed: {e}")
         return template_str
 
-def send_email_task(task_data):
+def build_context(task_data):
+    """Template variables for a due task."""
+    first_name = task_data.name.split(" ")[0] if task_data.name else "there"
+    return {
+        "name": task_data.name,
+        "first_name": first_name,
+        "company": task_data.company,
+        "personalization": task_data.personalization or "Hope you're doing well.",
+        "sender_name": "Agencies" # Generic name or pull from account?
+    }
+
+def build_message(task_data):
+    """
+    Renders a due task into wire-ready MIME bytes (CRLF line endings).
+    The From header is left out because the sending account is only chosen at send time.
+    """
+    context = build_context(task_data)
+    subject = render_template(task_data.subject, context, task_data.step_id, "subject")
+    body = render_template(task_data.body_template, context, task_data.step_id, "body")
+
+    msg = MIMEMultipart()
+    msg['To'] = task_data.email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+def send_email_task(task_data, account=None, prepared=None):
     """
     Sends a cold email based on campaign task data.
-    Uses Inbox Rotation to pick an account.
+    Uses Inbox Rotation to pick an account unless the send engine assigned one.
+    Streams `prepared` (the pre-rendered bytes, loaded per batch by the caller) when given,
+    rendering inline otherwise. Returns False on failure; see deliver() to get the error.
     """
-    recipient_email = task_data["email"]
+    try:
+        return deliver(task_data, account, prepared)
+    except Exception as e:
+        print(f"[ERROR] Failed to send to {task_data.email} via {account.email if account else '?'}: {e}")
+        return False
+
+def deliver(task_data, account=None, prepared=None):
+    """send_email_task(), but SMTP errors propagate so the caller can tell account from message failures."""
+    recipient_email = task_data.email
     
     # 1. Get Sending Account
-    account = account_manager.get_next_available_account()
+    if account is None:
+        account = account_manager.get_next_available_account()
     if not account:
         print("[LIMIT] No active accounts with quota remaining.")
         return False
 
-    # Prepare Context
-    first_name = task_data["name"].split(" ")[0] if task_data.get("name") else "there"
-    context = {
-        "name": task_data["name"],
-        "first_name": first_name,
-        "company": task_data["company"],
-        "personalization": task_data["personalization"] or "Hope you're doing well.",
-        "sender_name": "Agencies" # Generic name or pull from account?
-    }
+    message = prepared or build_message(task_data)
+    sender = formataddr((config.SENDER_NAME, account.email)).encode("utf-8")
     
-    subject = render_template(task_data["subject"], context)
-    body = render_template(task_data["body_template"], context)
-
-    msg = MIMEMultipart()
-    msg['From'] = f"{config.SENDER_NAME} <{account.email}>"
-    msg['To'] = recipient_email
-    msg['Subject'] = subject
-    
-    msg.attach(MIMEText(body, 'plain'))
+    smtp_pool.send(account, account.email, recipient_email, b"From: " + sender + b"\r\n" + message)
+        
+    print(f"[SUCCESS] Sent Step {task_data.step_number} to {recipient_email} via {account.email}")
+    metrics.LAST_SEND_SUCCESS.set_to_current_time()
     
+    # Update DB State (journaled now, written in bulk by the write-behind buffer).
+    # The email is out either way, so a failure here must not trigger a resend.
     try:
-        server = smtplib.SMTP(account.smtp_server, account.smtp_port)
-        server.starttls()
-        server.login(account.username, account.password)
-        text = msg.as_string()
-        server.sendmail(account.email, recipient_email, text)
-        server.quit()
-        
-        print(f"[SUCCESS] Sent Step {task_data['step_number']} to {recipient_email} via {account.email}")
-        
-        # Update DB State
-        campaign_manager.advance_lead(task_data["lead_obj"].id)
-        account_manager.increment_usage(account.id)
-        return True
-        
+        send_outcomes.record(write_behind.build_outcome(task_data, account.id))
     except Exception as e:
-        print(f"[ERROR] Failed to send to {recipient_email} via {account.email}: {e}")
-        # Automatically mark error or just retry? For now, log.
-        # account_manager.mark_error(account.id) 
-        return False
+        print(f"[ERROR] Sent to {recipient_email} but failed to record it: {e}")
+    return True
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _send_claimed(token, jobs, accounts, account_owner):
+    """Sends one batch of leased jobs, renewing the job and account leases until the batch is done."""
+    job_by_lead = {job.lead_id: job for job in jobs}
+    tasks = []
+    for task in campaign_manager.iter_due_tasks(lead_ids=list(job_by_lead)):
+        job = job_by_lead.pop(task.lead_id)
+        if task.step_number == job.step_number:
+            task.job_id = job.id
+            tasks.append(task)
+        else:
+            job_by_lead[task.lead_id] = job
+    # Whatever is left stopped being due after it was queued (replied, moved on, paused)
+    for job in job_by_lead.values():
+        job_queue.complete(job.id, token)
+    # One lookup for the whole batch rather than one per send
+    prepared = prerender.get_prepared_batch(tasks)
 
-def process_email_queue():
-    """Reads due leads from Campaign Manager and sends."""
+    stop = threading.Event()
+    def renew_lease():
+        while not stop.wait(config.JOB_LEASE_SECONDS / 3):
+            job_queue.heartbeat(token)
+            account_manager.renew_account_leases(account_owner)
+
+    attempted = set()
+    def send(task, account):
+        attempted.add(task.job_id)
+        try:
+            ok = deliver(task, account, prepared.get(task.lead_id))
+            error = None
+        except Exception as e:
+            print(f"[ERROR] Failed to send to {task.email} via {account.email}: {e}")
+            ok, error = False, e
+        if not ok:
+            # An account/server outage backs the job off without spending one of its attempts
+            account_error = error is not None and is_account_error(error)
+            job_queue.fail(task.job_id, token, f"Send via {account.email} failed: {error}", count_attempt=not account_error)
+        # Successful jobs are marked Done by the write-behind flush, together with the lead update
+        return ok
+
+    renewer = threading.Thread(target=renew_lease, daemon=True)
+    renewer.start()
+    try:
+        return send_engine.run(tasks, accounts, send)
+    finally:
+        stop.set()
+        try:
+            send_outcomes.flush() # So quotas are current for the next claim
+        except Exception as e:
+            print(f"[ERROR] Write-behind flush failed (will retry): {e}")
+        # Hand back only the jobs the accounts had no quota left for
+        job_queue.release(token, [t.job_id for t in tasks if t.job_id not in attempted])
+
+@sql_profiler.profiled("job:send")
+def process_email_queue(worker_id=None):
+    """
+    Queues every due send as a job, then claims and sends jobs through every available account at once.
+    Safe to run from several processes: each job is leased to exactly one worker, and each account
+    to one run at a time, so an inbox's daily limit and pacing hold however many workers there are.
+    """
     
     # Sync config account just in case it's fresh
     account_manager.sync_config_account()
+    write_behind.replay_orphans()
+    # Outcomes still buffered from an earlier run must land before anything is claimed,
+    # otherwise their leads still look due and would be sent again
+    try:
+        send_outcomes.flush()
+    except Exception as e:
+        print(f"[ERROR] Write-behind flush failed (will retry); not sending until it succeeds: {e}")
+        return
     
-    due_tasks = campaign_manager.get_due_leads()
+    job_queue.enqueue_due()
+    worker_id = worker_id or default_worker_id()
     
-    if not due_tasks:
-        print("[INFO] No emails due for sending.")
-        return
-
-    print(f"[INFO] Found {len(due_tasks)} emails due. Starting batch...")
+    # Unique per run: the web scheduler and /trigger/send can run in the same process
+    account_owner = f"{worker_id}:{uuid.uuid4().hex}"
     
-    count = 0
-    for task in due_tasks:
-        # Check global limit or just rely on account limits? 
-        # Rely on account limits (get_next_available_account will return None)
-        
-        if send_email_task(task):
-            count += 1
-            time.sleep(5) # Safety delay
-        else:
-            # If failed (likely no accounts), stop batch
-             if not account_manager.get_next_available_account():
-                 print("[STOP] No accounts available.")
-                 break
+    sent = failed = 0
+    try:
+        while True:
+            # Rely on account limits: each leased account is paced and capped by the send engine
+            accounts = account_manager.lease_sendable_accounts(account_owner)
+            if not accounts:
+                print("[STOP] No accounts available (out of quota, or in use by another worker).")
+                break
+
+            token, jobs = job_queue.claim(worker_id)
+            if not jobs:
+                break
+
+            print(f"[INFO] Claimed {len(jobs)} due emails. Sending via {len(accounts)} accounts...")
+            stats = _send_claimed(token, jobs, accounts, account_owner)
+            sent += stats["sent"]
+            failed += stats["failed"]
+            if not stats["sent"]:
+                break # Out of quota, or nothing got through (SMTP down): failed jobs wait out their backoff
+            if send_outcomes.pending():
+                break # Flush failed: sent_today is stale, so the next batch could overrun the quota
+    finally:
+        # With outcomes unflushed the accounts' usage is behind; let the leases expire instead
+        if not send_outcomes.pending():
+            account_manager.release_accounts(account_owner)
             
-    print(f"[DONE] Processed {count} emails.")
+    smtp_pool.reap_idle()
+    if sent or failed:
+        print(f"[DONE] Processed {sent} emails ({failed} failed).")
+    else:
+        print("[INFO] No emails due for sending.")
 
 def check_bounces():
     """
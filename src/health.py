@@ -0,0 +1,75 @@
+# src/health.py
+"""
+Checks behind the load-balancer probes. /healthz only proves the process is serving;
+/readyz adds one DB round trip (SELECT 1), an indexed count of open send jobs and in-memory
+reads of the pools and queues, so both are cheap enough to probe every few seconds.
+
+Timestamps are per process: a web process that never sends reports last_send_at as None.
+"""
+import time
+from datetime import datetime
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text
+from src import data_manager, db_writer, email_sender, job_queue, metrics, scheduler
+from src.data_manager import get_db
+
+_started_at = time.time()
+
+
+def _iso(ts):
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z" if ts else None
+
+
+def liveness():
+    return {"status": "ok", "uptime_seconds": round(time.time() - _started_at, 1)}
+
+
+def check_database():
+    """(ok, round-trip ms, error type) for a trivial query on a pooled connection."""
+    start = time.perf_counter()
+    db = next(get_db())
+    try:
+        db.execute(text("SELECT 1"))
+        return True, round((time.perf_counter() - start) * 1000, 2), None
+    except Exception as e:
+        # Probes are unauthenticated: log the detail (it can name hosts/paths), report the type
+        print(f"[ERROR] Readiness DB check failed: {e}")
+        return False, None, type(e).__name__
+    finally:
+        db.close()
+
+
+def _engine_pool():
+    pool = data_manager.engine.pool
+    # Only QueuePool reports usage; SQLite's default pools don't
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    return {"class": type(pool).__name__, "size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+
+def readiness():
+    """Report for /readyz. Ready means the DB answered; everything else is informational."""
+    db_ok, db_ms, db_error = check_database()
+    try:
+        send_jobs = job_queue.queue_depth(job_queue.OPEN_STATUSES) if db_ok else None
+    except Exception as e:
+        print(f"[WARN] Readiness could not count send jobs: {e}")
+        send_jobs = None
+    return {
+        "status": "ok" if db_ok else "unavailable",
+        "database": {"ok": db_ok, "latency_ms": db_ms, "error": db_error, "pool": _engine_pool()},
+        "smtp_pool_idle_sessions": email_sender.smtp_pool.size(),
+        "queues": {
+            "send_jobs": send_jobs,
+            "db_writer": db_writer.pending(),
+            "write_behind": email_sender.send_outcomes.pending(),
+            "scheduler": scheduler.pending(),
+        },
+        "last_send_at": _iso(metrics.LAST_SEND_SUCCESS.value()),
+        "last_reply_poll_at": _iso(metrics.LAST_REPLY_POLL.value()),
+        "uptime_seconds": round(time.time() - _started_at, 1),
+    }
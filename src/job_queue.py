@@ -0,0 +1,269 @@
+# src/job_queue.py
+"""
+Durable send-job queue. Any number of worker processes (on any number of machines)
+can claim due sends without overlap: a claim leases jobs to one worker, the worker
+renews the lease while it sends, and leases that are not renewed expire back to the queue.
+"""
+import uuid
+from datetime import datetime, timedelta
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from sqlalchemy import select, insert, update, func, and_, or_, exists, literal
+from sqlalchemy.exc import IntegrityError
+from src import campaign_manager
+from src.data_manager import SendJob, Lead, CampaignStep, get_db
+
+# Jobs still waiting to be sent (Done/Failed rows are history)
+OPEN_STATUSES = ("Queued", "Leased")
+
+
+def enqueue_due(now=None):
+    """
+    Creates a Queued job for every due lead that has no open job and whose current step
+    has not already failed for good. Returns how many were queued.
+    """
+    now = now or datetime.utcnow()
+    due = select(
+        Lead.id, Lead.current_step, literal("Queued"), literal(0), literal(now), literal(now)
+    ).join(
+        CampaignStep,
+        and_(CampaignStep.campaign_id == Lead.campaign_id, CampaignStep.step_number == Lead.current_step)
+    ).where(
+        *campaign_manager.due_filter(now),
+        ~exists().where(
+            SendJob.lead_id == Lead.id,
+            or_(
+                SendJob.status.in_(OPEN_STATUSES),
+                and_(SendJob.status == "Failed", SendJob.step_number == Lead.current_step)
+            )
+        )
+    )
+    stmt = insert(SendJob).from_select(
+        ["lead_id", "step_number", "status", "attempts", "created_at", "updated_at"], due
+    )
+
+    db = next(get_db())
+    try:
+        result = db.execute(stmt)
+        db.commit()
+        return result.rowcount
+    except IntegrityError:
+        # Another worker enqueued the same jobs first
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+
+def requeue_expired(now=None):
+    """Puts jobs whose lease ran out (crashed or stuck worker) back in the queue."""
+    now = now or datetime.utcnow()
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SendJob)
+            .where(SendJob.status == "Leased", SendJob.lease_expires_at < now)
+            .values(status="Queued", lease_owner=None, lease_expires_at=None, updated_at=now)
+        )
+        db.commit()
+        if result.rowcount:
+            print(f"[WARN] Re-queued {result.rowcount} send jobs with expired leases.")
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def claim(worker_id, limit=None, lease_seconds=None):
+    """
+    Atomically leases up to `limit` Queued jobs to this worker.
+    Returns (lease_token, [jobs]); the token is needed to heartbeat/complete/fail them.
+    """
+    limit = limit or config.JOB_BATCH_SIZE
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    now = datetime.utcnow()
+    requeue_expired(now)
+
+    token = f"{worker_id}:{uuid.uuid4().hex}"
+    db = next(get_db())
+    try:
+        candidates = select(SendJob.id).where(
+            SendJob.status == "Queued",
+            or_(SendJob.not_before.is_(None), SendJob.not_before <= now) # Still backing off otherwise
+        ).order_by(SendJob.id).limit(limit)
+        if db.bind.dialect.name == "postgresql":
+            # Concurrent claimers skip rows another transaction is already taking
+            candidates = candidates.with_for_update(skip_locked=True)
+        db.execute(
+            update(SendJob)
+            .where(SendJob.id.in_(candidates.scalar_subquery()), SendJob.status == "Queued")
+            .values(
+                status="Leased",
+                lease_owner=token,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=SendJob.attempts + 1,
+                updated_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        jobs = db.query(SendJob).filter_by(lease_owner=token, status="Leased").order_by(SendJob.id).all()
+        for job in jobs:
+            db.expunge(job)
+        return token, jobs
+    finally:
+        db.close()
+
+
+def heartbeat(token, lease_seconds=None):
+    """Extends the lease on every job still held under this token."""
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    now = datetime.utcnow()
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SendJob)
+            .where(SendJob.lease_owner == token, SendJob.status == "Leased")
+            .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def hold(job_ids, lease_seconds=None):
+    """
+    Extends the leases of specific jobs, whoever holds them. For jobs that were sent but whose
+    outcome is not written yet (write-behind flush failing): expiring would queue them again.
+    """
+    if not job_ids:
+        return 0
+    lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+    now = datetime.utcnow()
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SendJob)
+            .where(SendJob.id.in_(job_ids), SendJob.status == "Leased")
+            .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def complete(job_id, token):
+    """Marks a job Done. False if the lease was lost (the job may be sent by someone else)."""
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SendJob)
+            .where(SendJob.id == job_id, SendJob.lease_owner == token)
+            .values(status="Done", lease_expires_at=None, updated_at=datetime.utcnow())
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt: JOB_RETRY_BACKOFF_SECONDS, doubling per attempt, capped."""
+    return min(config.JOB_RETRY_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), config.JOB_RETRY_BACKOFF_MAX)
+
+
+def fail(job_id, token, error="", count_attempt=True):
+    """
+    Returns a job to the queue after a backoff, or marks it Failed once attempts run out.
+    count_attempt=False is for failures of the account or server (connect, login, timeout):
+    the message itself was never tried, so the attempt is handed back and only the backoff applies.
+    """
+    now = datetime.utcnow()
+    db = next(get_db())
+    try:
+        job = db.query(SendJob).filter_by(id=job_id, lease_owner=token).first()
+        if not job:
+            return
+        if not count_attempt:
+            job.attempts = max(job.attempts - 1, 0) # claim() counted it
+        if count_attempt and job.attempts >= config.JOB_MAX_ATTEMPTS:
+            job.status = "Failed"
+        else:
+            job.status = "Queued"
+            job.not_before = now + timedelta(seconds=retry_delay(max(job.attempts, 1)))
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.last_error = str(error)[:1000]
+        job.updated_at = now
+        db.commit()
+    finally:
+        db.close()
+
+
+def requeue_failed(lead_ids=None):
+    """
+    Gives leads whose current step failed for good another go: their Failed jobs become
+    Retried (kept as history) and the leads that are still due get fresh jobs.
+    Returns how many jobs were queued.
+    """
+    db = next(get_db())
+    try:
+        stmt = update(SendJob).where(SendJob.status == "Failed")
+        if lead_ids is not None:
+            stmt = stmt.where(SendJob.lead_id.in_(lead_ids))
+        result = db.execute(
+            stmt.values(status="Retried", updated_at=datetime.utcnow()).execution_options(synchronize_session=False)
+        )
+        db.commit()
+        cleared = result.rowcount
+    finally:
+        db.close()
+    queued = enqueue_due() if cleared else 0
+    print(f"[INFO] Cleared {cleared} failed send jobs; re-queued {queued} due sends.")
+    return queued
+
+
+def release(token, job_ids):
+    """Hands back claimed jobs this worker never attempted (e.g. accounts ran out of quota)."""
+    if not job_ids:
+        return 0
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SendJob)
+            .where(SendJob.lease_owner == token, SendJob.status == "Leased", SendJob.id.in_(job_ids))
+            .values(
+                status="Queued",
+                lease_owner=None,
+                lease_expires_at=None,
+                attempts=SendJob.attempts - 1,
+                updated_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def queue_depth(statuses=None):
+    """
+    Job counts by status, e.g. {"Queued": 12, "Leased": 200}.
+    Pass statuses=OPEN_STATUSES to skip the (ever-growing) finished jobs and stay on the claim index.
+    """
+    db = next(get_db())
+    try:
+        query = db.query(SendJob.status, func.count(SendJob.id))
+        if statuses:
+            query = query.filter(SendJob.status.in_(statuses))
+        rows = query.group_by(SendJob.status).all()
+        return {status: count for status, count in rows}
+    finally:
+        db.close()
@@ -0,0 +1,138 @@
+# src/lead_importer.py
+"""
+Bulk lead import. Streams a CSV, Excel or Parquet file in chunks, normalizes and validates
+each chunk with vectorized pandas operations, and inserts it with a single executemany
+upsert that skips emails the user already has.
+
+Run:  python -m src.lead_importer leads.csv [username]
+"""
+import time
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+import pandas as pd
+from src import data_manager
+from src.data_manager import User, get_db
+
+# Source header (case-insensitive) -> Lead column; matches the legacy Excel layout
+COLUMN_MAP = {
+    "email": "email",
+    "name": "name",
+    "company": "company",
+    "role": "role",
+    "website": "website",
+    "linkedin": "linkedin",
+    "notes": "notes",
+    "personalization_line": "personalization_line",
+    "email_sent": "email_sent",
+    "replied": "replied",
+}
+TEXT_COLUMNS = ["name", "company", "role", "website", "linkedin", "notes", "personalization_line"]
+EMAIL_PATTERN = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+
+def iter_chunks(path, chunk_size=None):
+    """Yields the file as DataFrames of at most chunk_size rows, without loading it whole."""
+    chunk_size = chunk_size or config.IMPORT_CHUNK_SIZE
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".csv", ".txt"):
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+    elif ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [str(h) if h is not None else "" for h in next(rows, [])]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunk_size:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            wb.close()
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported lead file type: {ext}")
+
+
+def normalize(df):
+    """Maps headers to Lead columns, trims values and keeps rows with a valid, unique email."""
+    df = df.rename(columns=lambda c: COLUMN_MAP.get(str(c).strip().lower(), str(c)))
+    if "email" not in df.columns:
+        raise ValueError("Lead file has no Email column")
+    for column in TEXT_COLUMNS + ["email", "email_sent", "replied"]:
+        if column not in df.columns:
+            df[column] = ""
+    out = df[TEXT_COLUMNS + ["email", "email_sent", "replied"]].fillna("").astype(str)
+    out = out.apply(lambda col: col.str.strip())
+    out["email"] = out["email"].str.lower()
+    out = out[out["email"].str.match(EMAIL_PATTERN)]
+    out = out.drop_duplicates(subset="email")
+    out["email_sent"] = out["email_sent"].where(out["email_sent"] == "Yes", "No")
+    out["replied"] = out["replied"].where(out["replied"] == "Yes", "No")
+    out["status"] = out["email_sent"].map({"Yes": "Contacted", "No": "New"})
+    return out
+
+
+def import_chunk(db, df, user_id):
+    """Inserts the chunk's leads the user does not have yet. Returns how many were inserted."""
+    if df.empty:
+        return 0
+    records = df.to_dict("records")
+    for record in records:
+        record["user_id"] = user_id
+    # ON CONFLICT (user_id, email) DO NOTHING: no lookup, and safe against concurrent imports
+    return data_manager.insert_leads(records, session=db)
+
+
+def import_file(path, user_id, chunk_size=None):
+    """
+    Imports a lead file for a user. Returns counts:
+    {"rows", "inserted", "invalid", "duplicates", "seconds", "rows_per_sec"}.
+    """
+    start_time = time.time()
+    stats = {"rows": 0, "inserted": 0, "invalid": 0, "duplicates": 0}
+    db = next(get_db())
+    try:
+        for chunk in iter_chunks(path, chunk_size):
+            clean = normalize(chunk)
+            inserted = import_chunk(db, clean, user_id)
+            stats["rows"] += len(chunk)
+            stats["inserted"] += inserted
+            stats["invalid"] += len(chunk) - len(clean) # Bad emails and repeats within the chunk
+            stats["duplicates"] += len(clean) - inserted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    stats["seconds"] = round(time.time() - start_time, 2)
+    stats["rows_per_sec"] = int(stats["rows"] / max(time.time() - start_time, 1e-6))
+    print(f"[SUCCESS] Imported {stats['inserted']} of {stats['rows']} rows from {os.path.basename(path)} "
+          f"({stats['duplicates']} already known, {stats['invalid']} invalid) at {stats['rows_per_sec']} rows/s.")
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m src.lead_importer <file> [username]")
+        sys.exit(1)
+    db = next(get_db())
+    try:
+        user = db.query(User).filter_by(username=sys.argv[2] if len(sys.argv) > 2 else "admin").first()
+    finally:
+        db.close()
+    if not user:
+        print("[ERROR] User not found.")
+        sys.exit(1)
+    import_file(sys.argv[1], user.id)
@@ -0,0 +1,123 @@
+# src/lead_listing.py
+"""
+Paged, filtered lead listings for /leads and /inbox.
+
+Both use keyset pagination: the cursor is the sort key of the last row shown, and the next page
+is "rows after that key", so every page costs the same however deep the user pages or however
+large the tenant is (no OFFSET, no unbounded .all()).
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from sqlalchemy import select, tuple_
+from src.data_manager import Lead, get_db
+
+INBOX_STATUSES = ['Replied', 'Contacted']
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The cursor's values, or None if it is missing or malformed (= first page)."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list):
+            return None
+        return [datetime.fromisoformat(v) if isinstance(v, str) else v for v in values]
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+
+def _filters(user_id, filters, date_column):
+    conditions = [Lead.user_id == user_id]
+    if filters.get("status"):
+        conditions.append(Lead.status == filters["status"])
+    if str(filters.get("campaign_id") or "").isdigit():
+        conditions.append(Lead.campaign_id == int(filters["campaign_id"]))
+    if filters.get("intent"):
+        conditions.append(Lead.reply_intent == filters["intent"])
+    if filters.get("q"):
+        conditions.append(Lead.email.like(filters["q"].strip().lower() + "%"))
+    date_from, date_to = parse_date(filters.get("date_from")), parse_date(filters.get("date_to"))
+    if date_from:
+        conditions.append(date_column >= date_from)
+    if date_to:
+        conditions.append(date_column < date_to + timedelta(days=1)) # Inclusive of the end day
+    return conditions
+
+
+def _fetch(query):
+    db = next(get_db())
+    try:
+        return db.execute(query).scalars().all()
+    finally:
+        db.close()
+
+
+def list_leads(user_id, filters=None, cursor=None, limit=None):
+    """
+    A page of the user's leads, newest first. filters: status, campaign_id, intent, q (email prefix),
+    date_from/date_to (date added, YYYY-MM-DD). Returns (leads, next_cursor or None).
+    """
+    limit = limit or config.LEADS_PAGE_SIZE
+    after = decode_cursor(cursor)
+    if after and not (len(after) == 1 and isinstance(after[0], int)):
+        after = None
+    query = select(Lead).where(*_filters(user_id, filters or {}, Lead.date_added))
+    if after:
+        query = query.where(Lead.id < after[0])
+    leads = _fetch(query.order_by(Lead.id.desc()).limit(limit + 1))
+    if len(leads) > limit:
+        return leads[:limit], encode_cursor([leads[limit - 1].id])
+    return leads, None
+
+
+def list_inbox(user_id, filters=None, cursor=None, limit=None):
+    """
+    A page of contacted/replied leads, most recently contacted first (never-contacted legacy rows last).
+    Same filters as list_leads, with the date range on last_contacted_at. Returns (leads, next_cursor or None).
+    """
+    limit = limit or config.LEADS_PAGE_SIZE
+    after = decode_cursor(cursor)
+    if after and not (len(after) == 2 and isinstance(after[1], int)):
+        after = None
+    conditions = _filters(user_id, filters or {}, Lead.last_contacted_at)
+    if not (filters or {}).get("status"):
+        conditions.append(Lead.status.in_(INBOX_STATUSES))
+
+    leads = []
+    # (last_contacted_at, id) descending over contacted rows, then rows without a contact time by id.
+    # Two index-friendly ranges instead of one NULL-aware sort, which each database orders differently.
+    if not after or after[0] is not None:
+        query = select(Lead).where(*conditions, Lead.last_contacted_at != None)
+        if after:
+            query = query.where(tuple_(Lead.last_contacted_at, Lead.id) < tuple(after))
+        leads = _fetch(query.order_by(Lead.last_contacted_at.desc(), Lead.id.desc()).limit(limit + 1))
+    if len(leads) <= limit:
+        query = select(Lead).where(*conditions, Lead.last_contacted_at == None)
+        if after and after[0] is None:
+            query = query.where(Lead.id < after[1])
+        leads += _fetch(query.order_by(Lead.id.desc()).limit(limit + 1 - len(leads)))
+
+    if len(leads) > limit:
+        last = leads[limit - 1]
+        return leads[:limit], encode_cursor([last.last_contacted_at, last.id])
+    return leads, None
@@ -0,0 +1,122 @@
+# src/lead_search.py
+"""
+Full-text lead search over name, company, role, notes, reply summary and email.
+
+SQLite: an external-content FTS5 table (leads_fts) kept in sync by triggers on leads.
+Postgres: a generated tsvector column with a GIN index.
+Both rank results (bm25 / ts_rank). Without either index, search falls back to a LIKE scan.
+"""
+import re
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text, inspect, or_
+from src import data_manager
+from src.data_manager import Lead
+
+SEARCH_COLUMNS = ["name", "company", "role", "notes", "reply_summary", "email"]
+
+_SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+        {', '.join(SEARCH_COLUMNS)}, content='leads', content_rowid='id', tokenize='unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads BEGIN
+        INSERT INTO leads_fts(rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in SEARCH_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads BEGIN
+        INSERT INTO leads_fts(leads_fts, rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in SEARCH_COLUMNS)});
+    END""",
+    # Only fires when a searched column changes, so send-state updates don't touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF {', '.join(SEARCH_COLUMNS)} ON leads BEGIN
+        INSERT INTO leads_fts(leads_fts, rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in SEARCH_COLUMNS)});
+        INSERT INTO leads_fts(rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in SEARCH_COLUMNS)});
+    END""",
+]
+
+_POSTGRES_DDL = [
+    f"""ALTER TABLE leads ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('simple', {" || ' ' || ".join(f"coalesce({c}, '')" for c in SEARCH_COLUMNS)})
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_leads_search ON leads USING GIN (search_vector)",
+]
+
+# "fts5", "tsvector" or "like"; detected on first search
+_backend = None
+
+
+def ensure_search_index(engine=None):
+    """Creates the full-text index and its sync triggers if missing (backfilling existing leads)."""
+    global _backend
+    engine = engine or data_manager.engine
+    dialect = engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            existed = inspect(engine).has_table("leads_fts")
+            with engine.begin() as conn:
+                for ddl in _SQLITE_DDL:
+                    conn.execute(text(ddl))
+                if not existed:
+                    print("[INFO] Building lead search index...")
+                    conn.execute(text("INSERT INTO leads_fts(leads_fts) VALUES ('rebuild')"))
+        elif dialect == "postgresql":
+            with engine.begin() as conn:
+                for ddl in _POSTGRES_DDL:
+                    conn.execute(text(ddl))
+    except Exception as e:
+        print(f"[WARN] Full-text lead search unavailable, falling back to LIKE: {e}")
+    _backend = None
+
+
+def _detect_backend(db):
+    dialect = db.bind.dialect.name
+    inspector = inspect(db.bind)
+    if dialect == "sqlite" and inspector.has_table("leads_fts"):
+        return "fts5"
+    if dialect == "postgresql" and "search_vector" in {c["name"] for c in inspector.get_columns("leads")}:
+        return "tsvector"
+    return "like"
+
+
+def _terms(query):
+    """Words in the user's query; punctuation is dropped so it can't inject FTS syntax."""
+    return re.findall(r"\w+", query.lower())[:10]
+
+
+def search_leads(user_id, query, limit=50):
+    """The user's leads matching every word of `query` (as prefixes), best match first."""
+    global _backend
+    terms = _terms(query or "")
+    if not terms:
+        return []
+    db = next(data_manager.get_db())
+    try:
+        if _backend is None:
+            _backend = _detect_backend(db)
+        if _backend == "fts5":
+            match = " ".join(f'"{t}"*' for t in terms)
+            ranked = text(
+                "SELECT leads.* FROM leads_fts JOIN leads ON leads.id = leads_fts.rowid "
+                "WHERE leads_fts MATCH :match AND leads.user_id = :user_id "
+                "ORDER BY bm25(leads_fts) LIMIT :limit"
+            )
+            params = {"match": match, "user_id": user_id, "limit": limit}
+        elif _backend == "tsvector":
+            ranked = text(
+                "SELECT * FROM leads WHERE user_id = :user_id AND search_vector @@ to_tsquery('simple', :q) "
+                "ORDER BY ts_rank(search_vector, to_tsquery('simple', :q)) DESC LIMIT :limit"
+            )
+            params = {"q": " & ".join(f"{t}:*" for t in terms), "user_id": user_id, "limit": limit}
+        else:
+            conditions = [Lead.user_id == user_id]
+            for t in terms:
+                conditions.append(or_(*[getattr(Lead, c).ilike(f"%{t}%") for c in SEARCH_COLUMNS]))
+            return db.query(Lead).filter(*conditions).order_by(Lead.id.desc()).limit(limit).all()
+        return db.query(Lead).from_statement(ranked).params(**params).all()
+    finally:
+        db.close()
@@ -0,0 +1,202 @@
+# src/metrics.py
+"""
+In-process counters and histograms, rendered in the Prometheus text exposition format at
+/metrics. Recording a sample is a dict lookup, a bisect and a few additions under a lock, so
+it is cheap enough for every SMTP command, template render and DB query.
+
+Series whose label values are open-ended (scraped hosts, accounts) are capped per metric;
+once a metric has MAX_SERIES label sets, new ones are folded into an "_other" series.
+"""
+import bisect
+import threading
+import time
+
+# Seconds; covers a sub-millisecond query up to a slow SMTP handshake or AI call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MAX_SERIES = 500
+OVERFLOW = "_other"
+
+_registry = {} # name -> metric, in registration order
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        if name in _registry:
+            raise ValueError(f"Metric {name} is already registered")
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, values):
+        # Caller holds self._lock
+        if values in self._series or len(self._series) < MAX_SERIES:
+            return values
+        return tuple(OVERFLOW for _ in values)
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            snapshot = [(values, self._snapshot(state)) for values, state in series]
+        for values, state in snapshot:
+            lines.extend(self._render_series(values, state))
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. errors per provider."""
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            key = self._key(label_values)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._series.get(label_values, 0)
+
+    def _snapshot(self, state):
+        return state
+
+    def _render_series(self, values, state):
+        yield f"{self.name}_total{_format_labels(self.labels, values)} {_format_value(state)}"
+
+
+class Gauge(_Metric):
+    """A value that goes up and down or is overwritten, e.g. the time of the last successful send."""
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._series[self._key(label_values)] = value
+
+    def set_to_current_time(self, *label_values):
+        self.set(time.time(), *label_values)
+
+    def value(self, *label_values):
+        """The current value, or None if it was never set."""
+        with self._lock:
+            return self._series.get(label_values)
+
+    def _snapshot(self, state):
+        return state
+
+    def _render_series(self, values, state):
+        yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(state)}"
+
+
+class Histogram(_Metric):
+    """Observations bucketed by upper bound, e.g. request latency in seconds."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(label_values)
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *label_values):
+        """Observes the duration of the with-block (also when it raises)."""
+        return _Timer(self, label_values)
+
+    def count(self, *label_values):
+        with self._lock:
+            state = self._series.get(label_values)
+            return state[2] if state else 0
+
+    def _snapshot(self, state):
+        return (list(state[0]), state[1], state[2])
+
+    def _render_series(self, values, state):
+        counts, total, count = state
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            labels = _format_labels(self.labels, values, [("le", _format_value(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labels, values)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {count}"
+
+
+class _Timer:
+    # A slotted class rather than @contextmanager: no generator per timed block
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+def render():
+    """Every registered metric in the text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Drops all recorded samples (the metrics stay registered). For tests."""
+    for metric in _registry.values():
+        metric.clear()
+
+
+# --- Hot-path metrics ---
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status"))
+SMTP_SECONDS = Histogram("smtp_operation_duration_seconds", "SMTP connect/login/send time per account.", ("account", "operation"))
+SMTP_ERRORS = Counter("smtp_errors", "Failed SMTP operations per account.", ("account", "operation"))
+TEMPLATE_RENDER_SECONDS = Histogram("template_render_duration_seconds", "Email template render time.", ("field",))
+AI_REQUEST_SECONDS = Histogram("ai_request_duration_seconds", "AI provider call latency.", ("provider",))
+AI_ERRORS = Counter("ai_errors", "Failed AI provider calls.", ("provider",))
+IMAP_FETCH_SECONDS = Histogram("imap_fetch_duration_seconds", "IMAP message fetch time per account.", ("account",))
+SCRAPER_FETCH_SECONDS = Histogram("scraper_fetch_duration_seconds", "Scraper page fetch time per host.", ("host",))
+SCRAPER_ERRORS = Counter("scraper_errors", "Failed scraper page fetches per host.", ("host",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database statement time by statement kind.", ("statement",))
+DB_ERRORS = Counter("db_errors", "Database statements that raised.")
+LAST_SEND_SUCCESS = Gauge("last_send_success_timestamp_seconds", "Unix time of this process's last successful email send.")
+LAST_REPLY_POLL = Gauge("last_reply_poll_timestamp_seconds", "Unix time of this process's last completed inbox poll.")
@@ -0,0 +1,151 @@
+# src/prerender.py
+"""
+Off-peak stage that renders upcoming sends into final MIME bytes ahead of time,
+so the sender only has to stream prepared bytes to SMTP.
+
+Run from cron:  python -m src.prerender
+"""
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from sqlalchemy import text
+from src.data_manager import RenderedMessage, get_db
+
+# Task fields a rendered message depends on; any change makes the prepared copy stale
+HASHED_FIELDS = ("email", "name", "company", "personalization", "subject", "body_template")
+
+
+def message_hash(task):
+    raw = "\x1f".join(str(getattr(task, f) or "") for f in HASHED_FIELDS)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_prepared_batch(tasks):
+    """
+    Pre-rendered bytes for a batch of tasks in one query, as {lead_id: message}.
+    Tasks without a current copy (missing, other step, or inputs changed since) are left out.
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return {}
+    db = next(get_db())
+    try:
+        rows = db.query(
+            RenderedMessage.lead_id, RenderedMessage.step_number, RenderedMessage.content_hash, RenderedMessage.message
+        ).filter(RenderedMessage.lead_id.in_([t.lead_id for t in tasks])).all()
+    finally:
+        db.close()
+    stored = {(r.lead_id, r.step_number): r for r in rows}
+    prepared = {}
+    for task in tasks:
+        row = stored.get((task.lead_id, task.step_number))
+        if row and row.content_hash == message_hash(task):
+            prepared[task.lead_id] = row.message
+    return prepared
+
+
+def get_prepared(task):
+    """Returns the pre-rendered bytes for a task if they exist and are still current, else None."""
+    return get_prepared_batch([task]).get(task.lead_id)
+
+
+def purge_stale():
+    """Drops prepared messages whose lead has moved past that step or left its sequence."""
+    db = next(get_db())
+    try:
+        result = db.execute(text("""
+            DELETE FROM rendered_messages WHERE NOT EXISTS (
+                SELECT 1 FROM leads
+                WHERE leads.id = rendered_messages.lead_id
+                  AND leads.current_step = rendered_messages.step_number
+                  AND leads.next_action_at IS NOT NULL
+            )
+        """))
+        db.commit()
+        return result.rowcount
+    finally:
+        db.close()
+
+
+def _render_chunk(db, pool, render, tasks):
+    """Renders the tasks in one chunk whose stored copy is missing or stale. Returns how many."""
+    current = dict(
+        db.query(RenderedMessage.lead_id, RenderedMessage.content_hash).filter(
+            RenderedMessage.lead_id.in_([t.lead_id for t in tasks])
+        ).all()
+    )
+    todo = []
+    for task in tasks:
+        digest = message_hash(task)
+        if current.get(task.lead_id) != digest:
+            todo.append((task, digest))
+    if not todo:
+        return 0
+
+    messages = pool.map(render, [t for t, _ in todo], chunksize=50)
+
+    # purge_stale() left at most one row per lead (its current step), so replacing means deleting by lead
+    stale_ids = [t.lead_id for t, _ in todo if t.lead_id in current]
+    if stale_ids:
+        db.query(RenderedMessage).filter(RenderedMessage.lead_id.in_(stale_ids)).delete(synchronize_session=False)
+    db.bulk_insert_mappings(RenderedMessage, [
+        {
+            "lead_id": t.lead_id,
+            "step_number": t.step_number,
+            "content_hash": digest,
+            "message": message,
+            "rendered_at": datetime.utcnow(),
+        }
+        for (t, digest), message in zip(todo, messages)
+    ])
+    db.commit()
+    return len(todo)
+
+
+def prerender_upcoming(window_hours=None, workers=None):
+    """
+    Renders every step falling due within the window using a process pool,
+    and stores the MIME bytes in rendered_messages. Returns the number rendered.
+    Streams the due leads chunk by chunk, so memory stays flat for large backlogs.
+    """
+    # Imported here: email_sender imports this module for get_prepared_batch()
+    from src import campaign_manager, email_sender
+
+    window_hours = window_hours or config.PRERENDER_WINDOW_HOURS
+    start_time = time.time()
+    purged = purge_stale()
+
+    until = datetime.utcnow() + timedelta(hours=window_hours)
+    rendered = 0
+    chunk = []
+    db = next(get_db())
+    try:
+        with ProcessPoolExecutor(max_workers=workers or config.PRERENDER_WORKERS) as pool:
+            for task in campaign_manager.iter_due_tasks(until=until):
+                chunk.append(task)
+                if len(chunk) >= config.DUE_TASK_PAGE_SIZE:
+                    rendered += _render_chunk(db, pool, email_sender.build_message, chunk)
+                    chunk = []
+            if chunk:
+                rendered += _render_chunk(db, pool, email_sender.build_message, chunk)
+    finally:
+        db.close()
+
+    if not rendered:
+        print(f"[INFO] Pre-render: nothing new in the next {window_hours}h (purged {purged} stale).")
+        return 0
+
+    elapsed = time.time() - start_time
+    print(f"[SUCCESS] Pre-rendered {rendered} messages due in the next {window_hours}h in {elapsed:.1f}s.")
+    return rendered
+
+
+if __name__ == "__main__":
+    prerender_upcoming()
@@ -3,7 +3,7 @@ import imaplib
 import email
 from email.header import decode_header
 import time
-from src import data_manager, account_manager, ai_engine, campaign_manager
+from src import data_manager, account_manager, ai_engine, campaign_manager, scheduler, db_writer, metrics, sql_profiler
 from src.data_manager import SMTPAccount, Lead, get_db
 
 def connect_imap(account):
@@ -38,7 +38,8 @@ def process_inbox(account):
         
         for e_id in email_ids:
             # Fetch the basic structure
-            _, msg_data = mail.fetch(e_id, '(RFC822)')
+            with metrics.IMAP_FETCH_SECONDS.time(account.email):
+                _, msg_data = mail.fetch(e_id, '(RFC822)')
             for response_part in msg_data:
                 if isinstance(response_part, tuple):
                     msg = email.message_from_bytes(response_part[1])
@@ -53,7 +54,11 @@ def process_inbox(account):
                     
                     # Check if this sender is a Lead in our DB
                     db = next(get_db())
-                    lead = db.query(Lead).filter_by(email=sender_email).first()
+                    # Only this account owner's leads; served by the (user_id, email) index
+                    lead = db.query(Lead).filter(
+                        Lead.user_id == account.user_id,
+                        Lead.email.in_({sender_email, sender_email.lower()})
+                    ).first()
                     db.close()
                     
                     if lead:
@@ -73,7 +78,7 @@ def process_inbox(account):
                             except: pass
                             
                         # Analyze with AI
-                        analysis = ai_engine.analyze_reply(body[:1000]) # Limit context
+                        analysis = ai_engine.analyze_reply(body[:1000], account.user_id) # Limit context
                         
                         # Update Lead Logic
                         update_lead_reply(lead.id, analysis)
@@ -85,13 +90,13 @@ def process_inbox(account):
                         
         mail.close()
         mail.logout()
+        metrics.LAST_REPLY_POLL.set_to_current_time()
     except Exception as e:
         print(f"[ERROR] IMAP Processing Failed: {e}")
 
 def update_lead_reply(lead_id, analysis):
     """Updates lead status and stops sequence."""
-    db = next(get_db())
-    try:
+    def write(db):
         lead = db.query(Lead).filter_by(id=lead_id).first()
         if lead:
             lead.status = "Replied"
@@ -102,12 +107,14 @@ def update_lead_reply(lead_id, analysis):
             # STOP SEQUENCE
             lead.campaign_id = None 
             lead.next_action_at = None
-            
-            db.commit()
-            print(f"[ACTION] Stopped sequence for {lead.email}. Intent: {lead.reply_intent}")
-    finally:
-        db.close()
+            return lead.email, lead.reply_intent
+
+    stopped = db_writer.write(write)
+    if stopped:
+        scheduler.cancel(lead_id)
+        print(f"[ACTION] Stopped sequence for {stopped[0]}. Intent: {stopped[1]}")
 
+@sql_profiler.profiled("job:reply_monitor")
 def run_reply_monitor():
     """Main loop to check all accounts."""
     db = next(get_db())
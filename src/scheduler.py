@@ -0,0 +1,171 @@
+# src/scheduler.py
+"""
+In-memory scheduler for sequence sends. Keeps upcoming next_action_at values in a heap and
+wakes the sender when the earliest one comes due, so idle deployments stop polling the
+leads table and due sends go out within seconds.
+
+The heap only holds a short horizon; it is reloaded from the due index periodically, which
+also picks up changes made by other processes. In-process changes (enrollment, advancing a
+lead, a reply stopping a sequence) are applied incrementally via notify()/cancel().
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from src.data_manager import Lead, get_db
+from src import campaign_manager
+
+
+class DueScheduler:
+    def __init__(self, on_due, horizon_seconds=None, reload_seconds=None):
+        self.on_due = on_due # Called with the list of lead ids that just came due
+        self.horizon = timedelta(seconds=horizon_seconds or config.SCHEDULER_HORIZON_SECONDS)
+        self.reload_every = timedelta(seconds=reload_seconds or config.SCHEDULER_RELOAD_SECONDS)
+        self._heap = [] # (when, lead_id); entries that no longer match _when are skipped
+        self._when = {} # lead_id -> current next_action_at
+        self._loaded_until = None
+        self._next_reload = datetime.min
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def load(self):
+        """Replaces the heap with every sequenced lead due within the horizon (reads the due index)."""
+        now = datetime.utcnow()
+        until = now + self.horizon
+        db = next(get_db())
+        try:
+            rows = db.query(Lead.id, Lead.next_action_at).filter(*campaign_manager.due_filter(until)).all()
+        finally:
+            db.close()
+        with self._cond:
+            self._when = {lead_id: when for lead_id, when in rows}
+            self._heap = [(when, lead_id) for lead_id, when in rows]
+            heapq.heapify(self._heap)
+            self._loaded_until = until
+            self._next_reload = now + self.reload_every
+            self._cond.notify()
+        return len(rows)
+
+    def notify(self, lead_id, when):
+        """A lead's next_action_at changed (None = it left its sequence)."""
+        with self._cond:
+            if when is None or (self._loaded_until and when > self._loaded_until):
+                # Beyond the horizon: the next reload will pick it up
+                self._when.pop(lead_id, None)
+                return
+            self._when[lead_id] = when
+            heapq.heappush(self._heap, (when, lead_id))
+            if self._heap[0] == (when, lead_id):
+                self._cond.notify() # New earliest entry: re-arm the wait
+
+    def cancel(self, lead_id):
+        self.notify(lead_id, None)
+
+    def _peek(self):
+        # Caller holds self._cond
+        while self._heap:
+            when, lead_id = self._heap[0]
+            if self._when.get(lead_id) == when:
+                return when
+            heapq.heappop(self._heap) # Stale entry
+        return None
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, lead_id = heapq.heappop(self._heap)
+            if self._when.get(lead_id) == when:
+                del self._when[lead_id]
+                due.append(lead_id)
+        return due
+
+    def pending(self):
+        with self._cond:
+            return len(self._when)
+
+    def next_wakeup(self):
+        with self._cond:
+            return self._peek()
+
+    def _run(self):
+        if self._loaded_until is None:
+            self.load()
+        while True:
+            with self._cond:
+                due = []
+                while not self._stopped:
+                    now = datetime.utcnow()
+                    if now >= self._next_reload:
+                        break
+                    earliest = self._peek()
+                    if earliest is not None and earliest <= now:
+                        due = self._pop_due(now)
+                        break
+                    wake_at = min(earliest or self._next_reload, self._next_reload)
+                    self._cond.wait((wake_at - now).total_seconds())
+                if self._stopped:
+                    return
+            try:
+                if due:
+                    self.on_due(due)
+                else:
+                    self.load()
+            except Exception as e:
+                print(f"[ERROR] Scheduler wake-up failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="due-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+# The process-wide scheduler, if one is running (hooks below are no-ops otherwise)
+_active = None
+
+
+def start(on_due):
+    global _active
+    _active = DueScheduler(on_due)
+    _active.start()
+    print(f"[INFO] Due scheduler started (horizon {config.SCHEDULER_HORIZON_SECONDS}s).")
+    return _active
+
+
+def stop():
+    global _active
+    if _active:
+        _active.stop()
+        _active = None
+
+
+def notify(lead_id, when):
+    if _active:
+        _active.notify(lead_id, when)
+
+
+def cancel(lead_id):
+    if _active:
+        _active.cancel(lead_id)
+
+
+def pending():
+    """Lead ids held in memory, or None when no scheduler runs in this process."""
+    return _active.pending() if _active else None
+
+
+def reload():
+    """For set-based changes too large to notify lead by lead."""
+    if _active:
+        _active.load()
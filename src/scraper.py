@@ -1,23 +1,21 @@
 # src/scraper.py
 import time
-import requests
 import re
 import random
 import sys
 import os
-from bs4 import BeautifulSoup
-from googlesearch import search
 from urllib.parse import urljoin, urlparse
 
 # Add parent to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
-from src import utils
+from src import utils, metrics
 
 def google_search_leads(query, num_results=10):
     """
     Searches Google for the query and returns a list of result URLs.
     """
+    from googlesearch import search # Heavy; imported on first scrape, not at server start
     print(f"[INFO] Searching Google for: {query}")
     results = []
     try:
@@ -47,6 +45,7 @@ def verify_email_with_eva(email):
     Verifies email using Eva API (Free, No Auth).
     Returns True if deliverable or unknown (safe to try), False if strictly undeliverable/spam.
     """
+    import requests
     try:
         url = f"https://api.eva.pingutil.com/email?email={email}"
         resp = requests.get(url, timeout=5)
@@ -81,6 +80,9 @@ USER_AGENTS = [
 
 def get_soup(url):
     """Helper to get BeautifulSoup object with safety headers and rotation."""
+    import requests
+    from bs4 import BeautifulSoup
+    host = urlparse(url).netloc or "unknown"
     try:
         # Rotate User Agent
         headers = {
@@ -90,10 +92,13 @@ def get_soup(url):
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         }
-        response = requests.get(url, headers=headers, timeout=10)
+        with metrics.SCRAPER_FETCH_SECONDS.time(host):
+            response = requests.get(url, headers=headers, timeout=10)
         if response.status_code == 200:
             return BeautifulSoup(response.text, 'html.parser')
+        metrics.SCRAPER_ERRORS.inc(host)
     except Exception as e:
+        metrics.SCRAPER_ERRORS.inc(host)
         print(f"[WARN] Failed to load {url}: {e}")
     return None
 
@@ -0,0 +1,121 @@
+# src/send_engine.py
+import contextvars
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+
+class AccountLane:
+    """
+    Pacing state for one sending account.
+    Sends start at least `interval` seconds apart, at most `max_in_flight` run at once,
+    and no more than `quota` are started in this batch.
+    """
+
+    def __init__(self, account, interval, max_in_flight, quota, wait=0.0):
+        self.account = account
+        self.interval = max(0.0, float(interval))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.quota = max(0, int(quota))
+        self.failures = 0
+        self._next_start = time.monotonic() + max(0.0, wait) # First send no sooner than `wait` from now
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Claims a send slot, sleeping until the account's pacing allows it. False if out of quota."""
+        with self._lock:
+            if self.quota <= 0 or self.failures >= config.SEND_MAX_FAILURES:
+                return False
+            self.quota -= 1
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+    def record(self, ok):
+        with self._lock:
+            self.failures = 0 if ok else self.failures + 1
+
+
+class _TaskSource:
+    """Thread-safe view over a task iterable, with room to hand tasks back."""
+
+    def __init__(self, tasks):
+        self._it = iter(tasks)
+        self._returned = deque()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self._returned:
+                return self._returned.popleft()
+            return next(self._it, None)
+
+    def give_back(self, task):
+        with self._lock:
+            self._returned.append(task)
+
+
+def lane_for(account):
+    """
+    Builds the pacing lane for an account from its settings (falling back to config defaults).
+    Pacing continues from the account's last recorded send, so a new batch or another worker
+    taking over the account (see account_manager.lease_sendable_accounts) keeps the interval.
+    """
+    interval = account.send_interval if account.send_interval is not None else config.SEND_INTERVAL_SECONDS
+    in_flight = account.max_in_flight or config.SEND_MAX_IN_FLIGHT
+    quota = (account.daily_limit or 0) - (account.sent_today or 0)
+    wait = 0.0
+    if account.last_used_at:
+        wait = interval - (datetime.utcnow() - account.last_used_at).total_seconds()
+    return AccountLane(account, interval, in_flight, quota, wait)
+
+
+def run(tasks, accounts, send_fn):
+    """
+    Sends `tasks` through all `accounts` concurrently.
+    `send_fn(task, account)` does one send and returns True on success.
+    Each account gets its own workers, so throughput grows with the pool while
+    every inbox keeps its own pace. Returns {"sent": n, "failed": n}.
+    """
+    source = _TaskSource(tasks)
+    lanes = [lane_for(a) for a in accounts]
+    stats = {"sent": 0, "failed": 0}
+    stats_lock = threading.Lock()
+
+    def worker(lane):
+        while True:
+            task = source.take()
+            if task is None:
+                return
+            if not lane.reserve():
+                source.give_back(task)
+                return
+            try:
+                ok = bool(send_fn(task, lane.account))
+            except Exception as e:
+                print(f"[ERROR] Send worker for {lane.account.email} crashed: {e}")
+                ok = False
+            lane.record(ok)
+            with stats_lock:
+                stats["sent" if ok else "failed"] += 1
+
+    threads = []
+    for lane in lanes:
+        for _ in range(lane.max_in_flight):
+            # Plain threads start with an empty context: copy the caller's so its SQL profile sees the sends
+            t = threading.Thread(target=contextvars.copy_context().run, args=(worker, lane), daemon=True)
+            t.start()
+            threads.append(t)
+    for t in threads:
+        t.join()
+    return stats
@@ -0,0 +1,41 @@
+# src/send_worker.py
+"""
+Standalone send worker. Run as many as you like, on one or more machines:
+
+    python -m src.send_worker
+"""
+import time
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from src import data_manager, email_sender, scheduler
+
+
+def run_worker(worker_id=None, once=False):
+    """
+    Drains the send-job queue, then waits for newly due sends:
+    woken by the due scheduler when SCHEDULER_ENABLED, by polling otherwise.
+    """
+    worker_id = worker_id or email_sender.default_worker_id()
+    data_manager.prepare_schema() # Workers may start before (or without) the web app
+    print(f"[INFO] Send worker {worker_id} started.")
+    if config.SCHEDULER_ENABLED and not once:
+        email_sender.process_email_queue(worker_id)
+        scheduler.start(lambda lead_ids: email_sender.process_email_queue(worker_id))
+        while True:
+            time.sleep(3600)
+    while True:
+        try:
+            email_sender.process_email_queue(worker_id)
+        except Exception as e:
+            print(f"[ERROR] Send worker round failed: {e}")
+        if once:
+            return
+        time.sleep(config.WORKER_POLL_SECONDS)
+
+
+if __name__ == "__main__":
+    run_worker()
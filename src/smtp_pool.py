@@ -0,0 +1,166 @@
+# src/smtp_pool.py
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from src import metrics
+
+# Errors after which the session is dead and a fresh login is worth one retry
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def _is_reconnect_error(e):
+    """True if the server dropped us (421 / disconnect / timeout) rather than rejecting the message."""
+    if isinstance(e, RECONNECT_ERRORS):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421:
+        return True
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return any(code == 421 for code, _ in e.recipients.values())
+    return False
+
+
+@contextmanager
+def _timed(account, operation):
+    """Records the operation's duration, and its failure, under the account's address."""
+    try:
+        with metrics.SMTP_SECONDS.time(account.email, operation):
+            yield
+    except Exception:
+        metrics.SMTP_ERRORS.inc(account.email, operation)
+        raise
+
+
+def is_account_error(e):
+    """
+    True if a send failed because of the account or server (can't connect, login refused,
+    session dropped, timeout) rather than the message or recipient. Those are worth retrying
+    later and should not count against the message's attempts.
+    """
+    if _is_reconnect_error(e):
+        return True
+    if isinstance(e, (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError,
+                      smtplib.SMTPHeloError, smtplib.SMTPSenderRefused, smtplib.SMTPNotSupportedError)):
+        return True
+    # Socket-level failures (refused, DNS, unreachable); SMTPException also subclasses OSError
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+class SMTPConnectionPool:
+    """
+    Keeps authenticated SMTP sessions open per SMTPAccount.id.
+    Idle sessions are checked with NOOP before reuse and closed after `idle_ttl` seconds.
+    """
+
+    def __init__(self, idle_ttl=None, timeout=None):
+        self.idle_ttl = idle_ttl if idle_ttl is not None else config.SMTP_POOL_IDLE_TTL
+        self.timeout = timeout if timeout is not None else config.SMTP_TIMEOUT
+        self._idle = {}  # account_id -> [(server, last_used), ...]
+        self._lock = threading.Lock()
+
+    def _connect(self, account):
+        with _timed(account, "connect"):
+            server = smtplib.SMTP(account.smtp_server, account.smtp_port, timeout=self.timeout)
+        try:
+            with _timed(account, "starttls"):
+                server.starttls()
+            with _timed(account, "login"):
+                server.login(account.username, account.password)
+        except Exception:
+            self._close(server)
+            raise
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self, account):
+        """Returns a live, logged-in session for the account (reused if possible)."""
+        while True:
+            with self._lock:
+                idle = self._idle.get(account.id)
+                entry = idle.pop() if idle else None
+            if entry is None:
+                return self._connect(account)
+
+            server, last_used = entry
+            if time.monotonic() - last_used > self.idle_ttl or not self._is_alive(server):
+                self._close(server)
+                continue
+            return server
+
+    def release(self, account, server):
+        """Returns a healthy session to the pool."""
+        with self._lock:
+            self._idle.setdefault(account.id, []).append((server, time.monotonic()))
+
+    def send(self, account, from_addr, to_addrs, msg):
+        """
+        Sends a message through a pooled session.
+        Reconnects once, transparently, if the server dropped the session (421 / timeout).
+        """
+        for attempt in range(2):
+            server = self.acquire(account)
+            try:
+                with _timed(account, "send"):
+                    server.sendmail(from_addr, to_addrs, msg)
+            except Exception as e:
+                if _is_reconnect_error(e):
+                    self._close(server)
+                    if attempt == 0:
+                        print(f"[WARN] SMTP session for {account.email} dropped ({e}). Reconnecting...")
+                        continue
+                elif isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)):
+                    # Message was rejected but the session is still usable
+                    self.release(account, server)
+                else:
+                    self._close(server)
+                raise
+            self.release(account, server)
+            return
+
+    def reap_idle(self):
+        """Closes sessions that have been idle longer than the TTL."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for account_id, idle in list(self._idle.items()):
+                keep = [(s, t) for s, t in idle if now - t <= self.idle_ttl]
+                expired.extend(s for s, t in idle if now - t > self.idle_ttl)
+                if keep:
+                    self._idle[account_id] = keep
+                else:
+                    del self._idle[account_id]
+        for server in expired:
+            self._close(server)
+        return len(expired)
+
+    def close_all(self):
+        """Closes every pooled session."""
+        with self._lock:
+            servers = [s for idle in self._idle.values() for s, _ in idle]
+            self._idle = {}
+        for server in servers:
+            self._close(server)
+
+    def size(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
@@ -0,0 +1,177 @@
+# src/sql_profiler.py
+"""
+Per-request / per-job SQL profiling on the engine's cursor events.
+
+Wrap a unit of work in `profile(name)` (the HTTP middleware does this for every request,
+`@profiled(name)` for background jobs) and each statement it runs is counted, timed and
+fingerprinted (literals and IN-lists collapsed), so the same query issued once per row shows
+up as one fingerprint with a high count. On exit a unit that repeated a fingerprint
+SQL_N_PLUS_ONE_THRESHOLD times is logged as a likely N+1. Any statement slower than
+SQL_SLOW_QUERY_MS is logged as it finishes.
+
+Tests use `budget(max_queries=..., max_repeats=...)`, which raises QueryBudgetExceeded.
+
+The active profiles live in a context variable, so they follow the request into run_db()
+threads and send_engine workers; work handed to another thread's queue (db_writer) is not
+attributed to the caller.
+
+install() is the engine's only statement timer: the same sample also feeds the
+db_query_duration_seconds histogram, so metrics don't time every query a second time.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+import sys
+import os
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from src import metrics
+
+_active = ContextVar("sql_profiles", default=()) # Enclosing profiles, outermost first
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A budget() block ran more queries, or repeated one more often, than allowed."""
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """The statement with literals, placeholders and value lists normalized to `?`."""
+    s = _STRING.sub("?", statement)
+    s = _PARAM.sub("?", s)
+    s = _NUMBER.sub("?", s)
+    s = _LIST.sub("(?+)", s) # IN (?, ?, ?) and single VALUES rows
+    s = _ROWS.sub("(?+)+", s) # Multi-row VALUES
+    return _SPACE.sub(" ", s).strip()
+
+
+class Profile:
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+        self._lock = threading.Lock() # run_db threads of one request share the profile
+
+    def record(self, fp, seconds):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+            self.fingerprints[fp] += 1
+
+    def repeated(self, threshold):
+        """(fingerprint, count) for statements run at least `threshold` times, most frequent first."""
+        with self._lock:
+            return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= threshold]
+
+    def summary(self):
+        return f"{self.name}: {self.queries} queries, {self.seconds * 1000:.1f} ms in DB"
+
+
+def current():
+    """The innermost active profile, or None."""
+    profiles = _active.get()
+    return profiles[-1] if profiles else None
+
+
+@contextmanager
+def profile(name, log=True):
+    """
+    Profiles the queries run inside the block (and in enclosing profiles too).
+    The name may be updated on the yielded Profile before the block ends (e.g. once routed).
+    """
+    p = Profile(name)
+    token = _active.set(_active.get() + (p,))
+    try:
+        yield p
+    finally:
+        _active.reset(token)
+        if log:
+            for fp, n in p.repeated(config.SQL_N_PLUS_ONE_THRESHOLD)[:3]:
+                print(f"[WARN] Possible N+1 in {p.name}: {n}x {fp[:300]}")
+
+
+def profiled(name):
+    """Decorator form of profile() for background job entry points."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def budget(max_queries=None, max_repeats=None, name="budget"):
+    """
+    Fails (QueryBudgetExceeded) if the block runs more than `max_queries` statements or any
+    single fingerprint more than `max_repeats` times. For tests guarding against N+1 regressions.
+    """
+    with profile(name, log=False) as p:
+        yield p
+    problems = []
+    if max_queries is not None and p.queries > max_queries:
+        problems.append(f"{p.queries} queries (budget {max_queries})")
+    if max_repeats is not None:
+        problems += [f"{n}x {fp[:200]}" for fp, n in p.repeated(max_repeats + 1)]
+    if problems:
+        raise QueryBudgetExceeded(f"{p.name} over budget: " + "; ".join(problems))
+
+
+def install(engine):
+    """
+    Attaches the engine's one statement timer (once per engine). Each statement is timed once and
+    the sample feeds both metrics.DB_QUERY_SECONDS and, when SQL_PROFILER_ENABLED, the active profiles.
+    """
+    from sqlalchemy import event
+    if event.contains(engine, "before_cursor_execute", _before):
+        return
+    event.listen(engine, "before_cursor_execute", _before)
+    event.listen(engine, "after_cursor_execute", _after)
+    event.listen(engine, "handle_error", _failed)
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("query_start")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    metrics.DB_QUERY_SECONDS.observe(elapsed, (statement.split(None, 1) or ["?"])[0].upper())
+    if not config.SQL_PROFILER_ENABLED:
+        return
+    profiles = _active.get()
+    if not profiles and elapsed * 1000 < config.SQL_SLOW_QUERY_MS:
+        return # Unprofiled and fast: skip the fingerprint
+    fp = fingerprint(statement)
+    for p in profiles:
+        p.record(fp, elapsed)
+    if elapsed * 1000 >= config.SQL_SLOW_QUERY_MS:
+        where = profiles[-1].name if profiles else "unprofiled"
+        print(f"[WARN] Slow query ({elapsed * 1000:.0f} ms) in {where}: {fp[:300]}")
+
+
+def _failed(exception_context):
+    conn = exception_context.connection
+    stack = conn.info.get("query_start") if conn is not None else None
+    if stack:
+        stack.pop()
+    metrics.DB_ERRORS.inc()
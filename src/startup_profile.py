@@ -0,0 +1,82 @@
+# src/startup_profile.py
+"""
+Import-time report for the web app: runs `python -X importtime -c "import server"` in a fresh
+interpreter and prints the slowest top-level imports plus the total, then checks the total
+against IMPORT_BUDGET_MS. Heavy optional dependencies (pandas, bs4, the AI SDKs) are imported
+at first use, so they should not appear here; if one does, something pulled it back in.
+
+    python -m src.startup_profile [--top N] [--module server]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Add parent to path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import config
+
+# Should only be imported on first use, never at startup
+LAZY_MODULES = ("pandas", "bs4", "googlesearch", "openai", "anthropic", "google.generativeai")
+
+
+def parse_importtime(stderr):
+    """(cumulative_us, self_us, module, depth) for each line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2 # One space, then two per nesting level
+        rows.append((int(cumulative_us), int(self_us), name.strip(), depth))
+    return rows
+
+
+def profile(module="server"):
+    """Imports `module` in a subprocess from the repo root and returns the parsed rows."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def report(rows, top=15):
+    """Prints the breakdown; returns (total_ms, lazy modules that were imported anyway)."""
+    # Top-level (depth 0) entries are disjoint, so their cumulative times sum to the total;
+    # the breakdown also lists depth 1, i.e. what the profiled module itself pulls in
+    total_ms = sum(r[0] for r in rows if r[3] == 0) / 1000
+    roots = sorted((r for r in rows if r[3] <= 1), key=lambda r: r[0], reverse=True)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name, _ in roots[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+    loaded = {r[2] for r in rows}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    print(f"\nTotal import time: {total_ms:.0f} ms (budget {config.IMPORT_BUDGET_MS} ms)")
+    return total_ms, eager
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time breakdown for the web app.")
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    total_ms, eager = report(profile(args.module), args.top)
+    ok = True
+    if eager:
+        print(f"[WARN] Imported at startup but should be lazy: {', '.join(eager)}")
+        ok = False
+    if total_ms > config.IMPORT_BUDGET_MS:
+        print(f"[ERROR] Import time {total_ms:.0f} ms is over budget ({config.IMPORT_BUDGET_MS} ms).")
+        ok = False
+    if ok:
+        print("[SUCCESS] Startup is within budget.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# src/template_registry.py
+import hashlib
+import threading
+from jinja2 import Environment
+from sqlalchemy import event
+from src.data_manager import CampaignStep
+
+# One shared environment so every step template is parsed/compiled once, not once per email
+env = Environment()
+
+MAX_CACHED = 5000
+_cache = {}  # (step_id, field, content_hash) -> compiled Template
+_lock = threading.Lock()
+
+
+def content_hash(source):
+    return hashlib.sha1((source or "").encode("utf-8")).hexdigest()
+
+
+def get_template(source, step_id=None, field="body"):
+    """Returns the compiled template for a step field, compiling only on first use or after an edit."""
+    key = (step_id, field, content_hash(source))
+    template = _cache.get(key)
+    if template is None:
+        template = env.from_string(source or "")
+        with _lock:
+            if len(_cache) >= MAX_CACHED:
+                _cache.pop(next(iter(_cache)))
+            _cache[key] = template
+    return template
+
+
+def invalidate_step(step_id):
+    """Drops every compiled template belonging to a step."""
+    with _lock:
+        for key in [k for k in _cache if k[0] == step_id]:
+            del _cache[key]
+
+
+def validate_steps(steps_data):
+    """
+    Compiles every step's subject/body once so syntax errors surface at campaign creation.
+    Raises ValueError naming the broken step.
+    """
+    for index, step in enumerate(steps_data):
+        for field in ("subject", "body"):
+            try:
+                env.parse(step.get(field, "") or "")
+            except Exception as e:
+                raise ValueError(f"Step {index + 1} {field} template is invalid: {e}")
+
+
+@event.listens_for(CampaignStep, "after_update")
+@event.listens_for(CampaignStep, "after_delete")
+def _on_step_changed(mapper, connection, target):
+    invalidate_step(target.id)
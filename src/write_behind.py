@@ -0,0 +1,264 @@
+# src/write_behind.py
+"""
+Write-behind buffer for per-send state. Instead of several queries and two commits per email,
+send outcomes (step advance, next_action_at, last_contacted_at, sent flag, account usage,
+job completion) are collected and written in a few bulk UPDATEs once the buffer is large or old enough.
+
+Every outcome is appended to an fsync'd journal before it is acknowledged, so a crash loses
+nothing: journals left behind by a dead process are replayed on the next start.
+"""
+import glob
+import json
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+import sys
+
+# Add parent to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from sqlalchemy import bindparam, update, func
+from src import campaign_manager, scheduler, db_writer, job_queue
+from src.data_manager import Lead, SMTPAccount, SendJob
+
+# A lead that replied or bounced while its email was in the buffer keeps that status
+_PROTECTED_STATUSES = ["Replied", "Bounced"]
+
+# Distinguishes this process from an earlier one with the same host and pid (e.g. a restarted
+# container), whose journal must be replayed rather than mistaken for ours
+_INSTANCE = uuid.uuid4().hex[:12]
+
+
+def build_outcome(task, account_id, sent_at=None):
+    """The state a successful send leaves behind, as a JSON-safe dict (same rules as advance_lead)."""
+    sent_at = sent_at or datetime.utcnow()
+    next_step = task.step_number + 1
+    next_delay = campaign_manager.get_step_delay(task.campaign_id, next_step)
+    if next_delay is not None:
+        step, status, next_action_at = next_step, "Contacted", sent_at + timedelta(days=next_delay)
+    else:
+        # Sequence complete
+        step, status, next_action_at = task.step_number, "Completed", None
+    return {
+        "lead_id": task.lead_id,
+        "job_id": task.job_id,
+        "account_id": account_id,
+        "current_step": step,
+        "status": status,
+        "next_action_at": next_action_at.isoformat() if next_action_at else None,
+        "sent_at": sent_at.isoformat(),
+    }
+
+
+def _parse(ts):
+    return datetime.fromisoformat(ts) if ts else None
+
+
+def apply_outcomes(outcomes):
+    """Writes a batch of outcomes in one transaction with bulk UPDATEs. Safe to re-apply."""
+    if not outcomes:
+        return
+    leads = Lead.__table__
+    # Plain comparisons: an expanding NOT IN cannot be used with executemany
+    keep_status = [func.coalesce(leads.c.status, "") != status for status in _PROTECTED_STATUSES]
+    lead_update = update(leads).where(leads.c.id == bindparam("b_id"), *keep_status).values(
+        current_step=bindparam("b_step"),
+        status=bindparam("b_status"),
+        next_action_at=bindparam("b_next"),
+        last_contacted_at=bindparam("b_sent"),
+        email_sent="Yes",
+    )
+
+    usage = {}
+    for o in outcomes:
+        count, last = usage.get(o["account_id"], (0, None))
+        usage[o["account_id"]] = (count + 1, max(last or o["sent_at"], o["sent_at"]))
+    accounts = SMTPAccount.__table__
+    account_update = update(accounts).where(accounts.c.id == bindparam("b_id")).values(
+        sent_today=accounts.c.sent_today + bindparam("b_count"),
+        last_used_at=bindparam("b_last"),
+    )
+
+    job_ids = [o["job_id"] for o in outcomes if o.get("job_id")]
+    now = datetime.utcnow()
+
+    def write(db):
+        db.execute(lead_update, [
+            {
+                "b_id": o["lead_id"],
+                "b_step": o["current_step"],
+                "b_status": o["status"],
+                "b_next": _parse(o["next_action_at"]),
+                "b_sent": _parse(o["sent_at"]),
+            }
+            for o in outcomes
+        ])
+        db.execute(account_update, [
+            {"b_id": account_id, "b_count": count, "b_last": _parse(last)}
+            for account_id, (count, last) in usage.items()
+        ])
+        for i in range(0, len(job_ids), 500):
+            db.execute(
+                update(SendJob.__table__)
+                .where(SendJob.__table__.c.id.in_(job_ids[i:i + 500]))
+                .values(status="Done", lease_expires_at=None, updated_at=now)
+            )
+
+    db_writer.write(write)
+
+    for o in outcomes:
+        scheduler.notify(o["lead_id"], _parse(o["next_action_at"]))
+
+
+def _read_journal(path):
+    outcomes = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                outcomes.append(json.loads(line))
+            except ValueError:
+                pass # Torn last line from a crash mid-write; the send was never acknowledged
+    return outcomes
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+
+def journal_path(journal_dir):
+    """This process's journal: send-<host>-<pid>-<instance>.jsonl"""
+    return os.path.join(journal_dir, f"send-{socket.gethostname()}-{os.getpid()}-{_INSTANCE}.jsonl")
+
+
+def _replay_file(path):
+    outcomes = _read_journal(path)
+    apply_outcomes(outcomes)
+    os.remove(path)
+    return len(outcomes)
+
+
+def replay_orphans(journal_dir=None):
+    """Applies and removes journals left by dead processes on this host. Returns outcomes replayed."""
+    journal_dir = journal_dir or config.WRITE_BEHIND_JOURNAL_DIR
+    prefix = f"send-{socket.gethostname()}-"
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(journal_dir, prefix + "*.jsonl*"))):
+        # "<pid>-<instance>", or just "<pid>" for journals written before instances were added
+        owner = os.path.basename(path)[len(prefix):].split(".")[0].split("-")
+        try:
+            pid = int(owner[0])
+        except ValueError:
+            continue
+        instance = owner[1] if len(owner) > 1 else None
+        if instance == _INSTANCE:
+            continue # Ours
+        if pid != os.getpid() and _pid_alive(pid):
+            continue # Another live worker's; same pid but another instance means a dead predecessor
+        replayed += _replay_file(path)
+    if replayed:
+        print(f"[INFO] Replayed {replayed} unflushed send outcomes from crashed workers.")
+    return replayed
+
+
+class SendOutcomeBuffer:
+    """Collects send outcomes and flushes them in bulk on a size or age threshold."""
+
+    def __init__(self, journal_dir=None, max_items=None, max_age=None):
+        self.journal_dir = journal_dir or config.WRITE_BEHIND_JOURNAL_DIR
+        self.max_items = max_items or config.WRITE_BEHIND_MAX_ITEMS
+        self.max_age = max_age or config.WRITE_BEHIND_MAX_AGE
+        self._pending = []
+        self._journal = None
+        self._journal_path = None
+        self._unapplied = [] # Rotated journals whose outcomes are not committed yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def _open_journal(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._journal_path = journal_path(self.journal_dir)
+        if os.path.exists(self._journal_path):
+            # Not written by this buffer (it rotates its own away): apply it before appending,
+            # otherwise the next flush would delete it with only our batch applied
+            print(f"[WARN] Replaying existing write-behind journal {self._journal_path}.")
+            _replay_file(self._journal_path)
+        self._journal = open(self._journal_path, "a")
+
+    def record(self, outcome):
+        """Journals an outcome durably, then buffers it. Flushes when the buffer is full."""
+        with self._lock:
+            if self._journal is None:
+                self._open_journal()
+            self._journal.write(json.dumps(outcome) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending.append(outcome)
+            full = len(self._pending) >= self.max_items
+            self._arm()
+        if full:
+            self.flush()
+
+    def _arm(self):
+        # Caller holds self._lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_age, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[ERROR] Write-behind flush failed (will retry): {e}")
+
+    def flush(self):
+        """Writes everything buffered so far. On failure the outcomes stay buffered and journaled."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, []
+                # Rotate the journal so outcomes recorded during the flush land in a fresh file
+                self._journal.close()
+                rotated = f"{self._journal_path}.{uuid.uuid4().hex[:8]}.flushing"
+                os.replace(self._journal_path, rotated)
+                self._unapplied.append(rotated)
+                self._open_journal()
+            try:
+                apply_outcomes(batch)
+            except Exception:
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._arm() # Retry on the timer, whoever called flush()
+                self._hold_jobs(batch)
+                raise
+            with self._lock:
+                done, self._unapplied = self._unapplied, []
+            for path in done:
+                os.remove(path)
+            return len(batch)
+
+    def _hold_jobs(self, outcomes):
+        # These emails are out but their jobs aren't Done yet: keep the leases from expiring into a resend
+        try:
+            job_queue.hold([o["job_id"] for o in outcomes if o.get("job_id")])
+        except Exception as e:
+            print(f"[ERROR] Could not extend leases of sent jobs awaiting their write: {e}")
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
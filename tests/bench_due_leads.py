@@ -0,0 +1,94 @@
+"""
+Benchmark: due-lead scan time as the leads table grows.
+
+Each round builds a fresh SQLite DB where a fixed number of leads are due and the rest are
+either outside any sequence or scheduled in the future, then times a full pass of
+campaign_manager.iter_due_tasks(). With the partial ix_leads_due index the scan cost follows
+the number of sequenced leads, not the table size.
+
+    python tests/bench_due_leads.py [sizes...]     e.g.  python tests/bench_due_leads.py 10000 100000 1000000
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+from src import data_manager, campaign_manager
+from src.data_manager import Base, User, Campaign, CampaignStep, Lead
+
+DUE = 1000          # Leads due right now (constant across sizes)
+SEQUENCED = 0.05    # Share of the table scheduled for a future step
+RUNS = 5
+
+
+def build(path, total):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": 1, "username": "bench", "password_hash": "x"}])
+        conn.execute(insert(Campaign), [{"id": 1, "user_id": 1, "name": "Bench", "status": "Active", "created_at": now}])
+        conn.execute(insert(CampaignStep), [
+            {"campaign_id": 1, "step_number": n, "day_delay": 2, "template_subject": "Hi", "template_body": "Body"}
+            for n in (1, 2, 3)
+        ])
+        batch = []
+        for i in range(total):
+            if i < DUE:
+                campaign_id, next_at = 1, now - timedelta(minutes=i % 60)
+            elif i < DUE + total * SEQUENCED:
+                campaign_id, next_at = 1, now + timedelta(hours=1 + i % 72)
+            else:
+                campaign_id, next_at = None, None
+            batch.append({
+                "user_id": 1, "email": f"lead{i}@corp{i % 997}.com", "status": "New", "current_step": 1,
+                "campaign_id": campaign_id, "next_action_at": next_at,
+            })
+            if len(batch) == 50000:
+                conn.execute(insert(Lead), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Lead), batch)
+    return engine
+
+
+def time_scan(engine):
+    data_manager.engine = engine
+    data_manager.SessionLocal = sessionmaker(bind=engine)
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        count = sum(1 for _ in campaign_manager.iter_due_tasks())
+        timings.append(time.perf_counter() - start)
+    assert count == DUE, count
+    return sorted(timings)[RUNS // 2]
+
+
+def main(sizes):
+    print(f"Due-lead scan benchmark ({DUE} due leads, median of {RUNS} runs)")
+    print(f"{'leads':>12} {'build (s)':>10} {'scan (ms)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for total in sizes:
+            path = os.path.join(tmp, f"bench_{total}.db")
+            start = time.perf_counter()
+            engine = build(path, total)
+            built = time.perf_counter() - start
+            print(f"{total:>12,} {built:>10.1f} {time_scan(engine) * 1000:>10.1f}")
+            engine.dispose()
+
+        with engine.connect() as conn:
+            plan = conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT id FROM leads WHERE next_action_at <= :now "
+                "AND status NOT IN ('Replied', 'Bounced', 'Completed') AND campaign_id IS NOT NULL "
+                "ORDER BY next_action_at, id"
+            ), {"now": datetime.utcnow()}).all()
+        print("\nQuery plan:", "; ".join(row[-1] for row in plan))
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
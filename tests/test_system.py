@@ -3,12 +3,13 @@ import os
 import sys
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Add src to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.data_manager import Base, User, Campaign, Lead, KnowledgeBase
-from src import auth, campaign_manager
+from src.data_manager import Base, User, Campaign, CampaignStep, Lead, KnowledgeBase
+from src import auth, campaign_manager, data_manager, sql_profiler
 
 # Use an in-memory DB for testing to not mess up real data
 TEST_DB_URL = "sqlite:///:memory:"
@@ -23,6 +24,19 @@ def db_session():
     yield session
     session.close()
 
+@pytest.fixture
+def app_db(monkeypatch):
+    """Points the app's own session factory at a fresh in-memory DB, for testing module functions."""
+    engine = create_engine(TEST_DB_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    sql_profiler.install(engine) # So tests can assert query budgets and DB metrics
+    monkeypatch.setattr(data_manager, "engine", engine)
+    monkeypatch.setattr(data_manager, "SessionLocal", Session)
+    session = Session()
+    yield session
+    session.close()
+
 def test_user_registration_and_auth(db_session):
     """Verify we can register and login users."""
     print("   [TEST] User Auth...")
@@ -122,3 +136,1113 @@ def test_knowledge_base_scoping(db_session):
     assert len(items2) == 1
     assert items2[0].content == "Professional"
     print("   [PASS] Knowledge Scoping OK.")
+
+def test_smtp_pool_reuses_and_reconnects(monkeypatch):
+    """Verify pooled SMTP sessions are reused and rebuilt after a drop."""
+    print("   [TEST] SMTP Pool...")
+    import smtplib
+    from types import SimpleNamespace
+    from src import smtp_pool
+
+    logins = []
+
+    class FakeSMTP:
+        drop_next = False
+
+        def __init__(self, host, port, timeout=None):
+            self.sent = []
+        def starttls(self): pass
+        def login(self, user, pw): logins.append(user)
+        def noop(self): return (250, b"OK")
+        def sendmail(self, frm, to, msg):
+            if FakeSMTP.drop_next:
+                FakeSMTP.drop_next = False
+                raise smtplib.SMTPServerDisconnected("421 closing")
+            self.sent.append(to)
+        def quit(self): pass
+        def close(self): pass
+
+    monkeypatch.setattr(smtp_pool.smtplib, "SMTP", FakeSMTP)
+    pool = smtp_pool.SMTPConnectionPool(idle_ttl=60)
+    account = SimpleNamespace(id=1, email="a@x.com", smtp_server="smtp", smtp_port=587, username="a", password="pw")
+
+    pool.send(account, account.email, "lead1@corp.com", "hi")
+    pool.send(account, account.email, "lead2@corp.com", "hi")
+    assert len(logins) == 1  # Session reused
+
+    FakeSMTP.drop_next = True
+    pool.send(account, account.email, "lead3@corp.com", "hi")
+    assert len(logins) == 2  # Transparent reconnect
+    assert pool.size() == 1
+
+    pool.close_all()
+    assert pool.size() == 0
+    print("   [PASS] SMTP Pool OK.")
+
+def test_send_engine_spreads_across_accounts():
+    """Verify the send engine uses every account and respects per-account quota."""
+    print("   [TEST] Send Engine...")
+    import threading
+    import time
+    from types import SimpleNamespace
+    from src import send_engine
+
+    def make_account(i, quota):
+        return SimpleNamespace(id=i, email=f"sender{i}@x.com", send_interval=0, max_in_flight=2,
+                               daily_limit=quota, sent_today=0, last_used_at=None)
+
+    accounts = [make_account(1, 3), make_account(2, 10), make_account(3, 10)]
+    used = {}
+    lock = threading.Lock()
+
+    def fake_send(task, account):
+        time.sleep(0.01)
+        with lock:
+            used.setdefault(account.id, []).append(task)
+        return True
+
+    stats = send_engine.run(range(20), accounts, fake_send)
+
+    assert stats == {"sent": 20, "failed": 0}
+    assert len(used[1]) <= 3  # Quota respected
+    assert set(used) == {1, 2, 3}
+    assert sorted(t for tasks in used.values() for t in tasks) == list(range(20))  # No double sends
+    print("   [PASS] Send Engine OK.")
+
+def test_campaign_templates_compiled_once(app_db):
+    """Verify step templates are validated up front and compiled once per step."""
+    print("   [TEST] Template Registry...")
+    from src import template_registry
+
+    user = User(username="tpl_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+
+    bad = campaign_manager.create_campaign("Broken", [{"subject": "Hi {{ name", "body": "x"}], user_id=user.id)
+    assert bad is None
+    assert app_db.query(Campaign).count() == 0  # Nothing half-created
+
+    camp = campaign_manager.create_campaign("Good", [{"subject": "Hi {{ first_name }}", "body": "Body"}], user_id=user.id)
+    step = app_db.query(CampaignStep).filter_by(campaign_id=camp.id).one()
+
+    t1 = template_registry.get_template(step.template_subject, step.id, "subject")
+    t2 = template_registry.get_template(step.template_subject, step.id, "subject")
+    assert t1 is t2
+    assert t1.render(first_name="Ana") == "Hi Ana"
+
+    step.template_subject = "Hello {{ first_name }}"
+    app_db.commit()  # Edit drops the stale compiled copy
+    assert not [k for k in template_registry._cache if k[0] == step.id]
+    print("   [PASS] Template Registry OK.")
+
+def test_prerender_materializes_upcoming_messages(app_db):
+    """Verify upcoming sends are rendered ahead of time and go stale when inputs change."""
+    print("   [TEST] Pre-render...")
+    from datetime import datetime, timedelta
+    from src import prerender
+    from src.data_manager import RenderedMessage
+
+    user = User(username="pre_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Pre", [{"subject": "Hi {{ first_name }}", "body": "About {{ company }}"}], user_id=user.id)
+    lead = Lead(user_id=user.id, email="jo@corp.com", name="Jo Doe", company="Corp",
+                campaign_id=camp.id, current_step=1, next_action_at=datetime.utcnow() + timedelta(hours=3))
+    app_db.add(lead)
+    app_db.commit()
+
+    assert prerender.prerender_upcoming(window_hours=24, workers=1) == 1
+    assert prerender.prerender_upcoming(window_hours=24, workers=1) == 0  # Already current
+
+    task = campaign_manager.get_due_leads(until=datetime.utcnow() + timedelta(days=1))[0]
+    message = prerender.get_prepared(task)
+    assert b"Subject: Hi Jo" in message and b"About Corp" in message
+    with sql_profiler.budget(max_queries=1): # The sender loads a claimed batch's copies at once
+        assert prerender.get_prepared_batch([task]) == {task.lead_id: message}
+
+    task.company = "NewCorp"
+    assert prerender.get_prepared(task) is None  # Inputs changed -> render inline
+    assert app_db.query(RenderedMessage).count() == 1
+    print("   [PASS] Pre-render OK.")
+
+def test_send_job_leases_do_not_overlap(app_db):
+    """Verify two workers never claim the same send job and expired leases return to the queue."""
+    print("   [TEST] Send Job Queue...")
+    from datetime import datetime, timedelta
+    from src import job_queue
+    from src.data_manager import SendJob
+
+    user = User(username="queue_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Queue", [{"subject": "Hi", "body": "Body"}], user_id=user.id)
+    past = datetime.utcnow() - timedelta(minutes=1)
+    app_db.add_all([
+        Lead(user_id=user.id, email=f"lead{i}@corp.com", campaign_id=camp.id, current_step=1, next_action_at=past)
+        for i in range(5)
+    ])
+    app_db.commit()
+
+    assert job_queue.enqueue_due() == 5
+    assert job_queue.enqueue_due() == 0  # Idempotent
+
+    token_a, jobs_a = job_queue.claim("worker-a", limit=3)
+    token_b, jobs_b = job_queue.claim("worker-b", limit=3)
+    assert len(jobs_a) == 3 and len(jobs_b) == 2
+    assert not {j.id for j in jobs_a} & {j.id for j in jobs_b}
+
+    assert job_queue.complete(jobs_a[0].id, token_a)
+    assert not job_queue.complete(jobs_b[0].id, token_a)  # Not our lease
+
+    # Worker B dies: its lease expires and the jobs go back to the queue
+    app_db.query(SendJob).filter_by(lease_owner=token_b).update({"lease_expires_at": past})
+    app_db.commit()
+    token_c, jobs_c = job_queue.claim("worker-c", limit=10)
+    assert {j.id for j in jobs_c} == {j.id for j in jobs_b}
+    assert job_queue.queue_depth() == {"Done": 1, "Leased": 4}
+    print("   [PASS] Send Job Queue OK.")
+
+def test_smtp_outage_backs_off_without_burning_attempts(app_db, monkeypatch):
+    """Verify an SMTP outage stops the send loop, backs jobs off and keeps their attempts; failed steps can be requeued."""
+    print("   [TEST] Send Retry Backoff...")
+    from datetime import datetime, timedelta
+    import config
+    from src import job_queue, email_sender, account_manager, write_behind, smtp_pool
+    from src.data_manager import SendJob, SMTPAccount
+
+    user = User(username="outage_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Outage", [{"subject": "Hi", "body": "Body"}], user_id=user.id)
+    past = datetime.utcnow() - timedelta(minutes=1)
+    app_db.add_all([Lead(user_id=user.id, email=f"out{i}@corp.com", campaign_id=camp.id, current_step=1, next_action_at=past)
+                    for i in range(30)])
+    app_db.add(SMTPAccount(user_id=user.id, email="down@x.com", smtp_server="smtp.x.com", smtp_port=587,
+                           daily_limit=100, sent_today=0, send_interval=0, max_in_flight=1))
+    app_db.commit()
+
+    connects = []
+    def refused(*args, **kwargs):
+        connects.append(args)
+        raise ConnectionRefusedError("Connection refused")
+    monkeypatch.setattr(smtp_pool.smtplib, "SMTP", refused)
+    monkeypatch.setattr(account_manager, "sync_config_account", lambda: None)
+    monkeypatch.setattr(write_behind, "replay_orphans", lambda *a, **k: 0)
+
+    email_sender.process_email_queue()
+    assert len(connects) == config.SEND_MAX_FAILURES # The lane gives up, and the loop does not re-claim
+    jobs = app_db.query(SendJob).all()
+    assert len(jobs) == 30
+    assert all(j.status == "Queued" and j.attempts == 0 for j in jobs) # Outage doesn't spend attempts
+    assert sum(1 for j in jobs if j.not_before and j.not_before > datetime.utcnow()) == config.SEND_MAX_FAILURES
+    assert job_queue.claim("w", limit=100)[1] and not job_queue.claim("w2", limit=100)[1] # Backing-off jobs wait
+
+    # A message-level failure on the last attempt is terminal until requeued
+    app_db.query(SendJob).update({"status": "Queued", "lease_owner": None, "not_before": None})
+    app_db.commit()
+    monkeypatch.setattr(config, "JOB_MAX_ATTEMPTS", 1)
+    token, claimed = job_queue.claim("w3", limit=100)
+    for job in claimed:
+        job_queue.fail(job.id, token, "550 mailbox unavailable")
+    assert job_queue.queue_depth() == {"Failed": 30}
+    assert job_queue.enqueue_due() == 0
+    assert job_queue.requeue_failed() == 30
+    assert job_queue.queue_depth() == {"Queued": 30, "Retried": 30}
+    print("   [PASS] Send Retry Backoff OK.")
+
+def test_failed_outcome_flush_does_not_resend(app_db, monkeypatch, tmp_path):
+    """Verify a send whose outcome failed to flush is not sent again once its lease would have expired."""
+    print("   [TEST] Failed Flush No Resend...")
+    import time
+    from datetime import datetime, timedelta
+    import config
+    from src import email_sender, account_manager, write_behind
+    from src.data_manager import SendJob, SMTPAccount
+
+    user = User(username="flush_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Flush", [{"subject": "Hi", "body": "Body"}], user_id=user.id)
+    app_db.add(Lead(user_id=user.id, email="a@b.com", campaign_id=camp.id, current_step=1,
+                    next_action_at=datetime.utcnow() - timedelta(minutes=1)))
+    app_db.add(SMTPAccount(user_id=user.id, email="up@x.com", smtp_server="smtp.x.com", smtp_port=587,
+                           daily_limit=100, sent_today=0, send_interval=0, max_in_flight=1))
+    app_db.commit()
+
+    sent_to = []
+    monkeypatch.setattr(email_sender.smtp_pool, "send", lambda account, sender, to, message: sent_to.append(to))
+    monkeypatch.setattr(email_sender, "send_outcomes", write_behind.SendOutcomeBuffer(journal_dir=str(tmp_path), max_age=60))
+    monkeypatch.setattr(account_manager, "sync_config_account", lambda: None)
+    monkeypatch.setattr(write_behind, "replay_orphans", lambda *a, **k: 0)
+    monkeypatch.setattr(config, "JOB_LEASE_SECONDS", 1)
+
+    real_apply = write_behind.apply_outcomes
+    calls = []
+    def apply_twice_broken(outcomes):
+        calls.append(len(outcomes))
+        if len(calls) <= 2:
+            raise RuntimeError("database is locked")
+        real_apply(outcomes)
+    monkeypatch.setattr(write_behind, "apply_outcomes", apply_twice_broken)
+
+    email_sender.process_email_queue()
+    assert sent_to == ["a@b.com"]
+    buffer = email_sender.send_outcomes
+    assert buffer.pending() == 1
+    buffer._timer.cancel()
+    buffer._timer = None
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer._timer is not None # A failed flush schedules its own retry
+
+    time.sleep(1.2) # The lease has run out
+    email_sender.process_email_queue()
+    assert sent_to == ["a@b.com"] # Buffered outcome landed first, so the lead was no longer due
+    assert buffer.pending() == 0
+    assert [j.status for j in app_db.query(SendJob).all()] == ["Done"]
+    buffer._timer.cancel()
+    print("   [PASS] Failed Flush No Resend OK.")
+
+def test_account_quota_and_pacing_hold_across_workers(app_db, monkeypatch, tmp_path):
+    """Verify an inbox is leased to one send run at a time, so its daily cap and pacing are not multiplied by workers."""
+    print("   [TEST] Account Leases...")
+    from datetime import datetime, timedelta
+    import time
+    from src import email_sender, account_manager, write_behind, send_engine
+    from src.data_manager import SMTPAccount
+
+    user = User(username="lease_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Leases", [{"subject": "Hi", "body": "Body"}], user_id=user.id)
+    past = datetime.utcnow() - timedelta(minutes=1)
+    app_db.add_all([Lead(user_id=user.id, email=f"l{i}@corp.com", campaign_id=camp.id, current_step=1, next_action_at=past)
+                    for i in range(10)])
+    app_db.add(SMTPAccount(user_id=user.id, email="capped@x.com", smtp_server="smtp.x.com", smtp_port=587,
+                           daily_limit=4, sent_today=0, send_interval=0, max_in_flight=2))
+    app_db.commit()
+
+    sent_to = []
+    monkeypatch.setattr(email_sender.smtp_pool, "send", lambda account, sender, to, message: sent_to.append(to))
+    monkeypatch.setattr(email_sender, "send_outcomes", write_behind.SendOutcomeBuffer(journal_dir=str(tmp_path)))
+    monkeypatch.setattr(account_manager, "sync_config_account", lambda: None)
+    monkeypatch.setattr(write_behind, "replay_orphans", lambda *a, **k: 0)
+
+    # Another worker is sending through the inbox: this run must not use it too
+    assert [a.email for a in account_manager.lease_sendable_accounts("other-worker")] == ["capped@x.com"]
+    assert account_manager.lease_sendable_accounts("second-worker") == []
+    email_sender.process_email_queue("second-worker")
+    assert sent_to == []
+
+    account_manager.release_accounts("other-worker")
+    email_sender.process_email_queue("w1")
+    email_sender.process_email_queue("w2")
+    assert len(sent_to) == 4 # The daily limit, once across both runs
+    account = app_db.query(SMTPAccount).one()
+    app_db.refresh(account)
+    assert account.sent_today == 4 and account.lease_owner is None
+
+    # A new lane keeps the pace from the account's last send
+    account.send_interval, account.last_used_at = 10, datetime.utcnow()
+    lane = send_engine.lane_for(account)
+    assert lane._next_start - time.monotonic() > 9
+    print("   [PASS] Account Leases OK.")
+
+def test_due_leads_query_count_is_flat(app_db):
+    """Verify due-lead resolution costs the same number of queries for 3 or 30 leads."""
+    print("   [TEST] Due Lead Queries...")
+    from datetime import datetime, timedelta
+    from sqlalchemy import event
+
+    user = User(username="due_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Due", [{"subject": "Hi", "body": "A"}, {"subject": "Re", "body": "B"}], user_id=user.id)
+    past = datetime.utcnow() - timedelta(minutes=1)
+
+    statements = []
+    event.listen(data_manager.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    counts = []
+    for n in (3, 30):
+        app_db.query(Lead).delete()
+        app_db.add_all([
+            Lead(user_id=user.id, email=f"d{i}@corp.com", campaign_id=camp.id, current_step=1 + i % 2, next_action_at=past)
+            for i in range(n)
+        ])
+        app_db.commit()
+        statements.clear()
+        tasks = campaign_manager.get_due_leads()
+        assert len(tasks) == n
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1] == 1
+    print("   [PASS] Due Lead Queries OK.")
+
+def test_due_task_iterator_pages_with_compact_records(app_db):
+    """Verify the due-task iterator pages through every due lead once and yields slot-only records."""
+    print("   [TEST] Due Task Iterator...")
+    from datetime import datetime, timedelta
+
+    user = User(username="iter_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Iter", [{"subject": "Hi", "body": "A"}], user_id=user.id)
+    base = datetime.utcnow() - timedelta(hours=1)
+    app_db.add_all([
+        # Several leads share a timestamp, so the (next_action_at, id) cursor must break ties
+        Lead(user_id=user.id, email=f"it{i}@corp.com", campaign_id=camp.id, current_step=1,
+             next_action_at=base + timedelta(seconds=i // 3))
+        for i in range(25)
+    ])
+    app_db.commit()
+
+    tasks = list(campaign_manager.iter_due_tasks(batch_size=4))
+    assert len(tasks) == 25
+    assert len({t.lead_id for t in tasks}) == 25
+    assert not hasattr(tasks[0], "__dict__")
+    assert tasks[0].subject == "Hi" and tasks[0].step_number == 1
+    print("   [PASS] Due Task Iterator OK.")
+
+def test_write_behind_flushes_in_bulk_and_replays_journal(app_db, tmp_path):
+    """Verify send outcomes are written in one flush and orphaned journals are replayed."""
+    print("   [TEST] Write-Behind Buffer...")
+    import json
+    import socket
+    from datetime import datetime, timedelta
+    from src import write_behind
+    from src.data_manager import SMTPAccount
+
+    user = User(username="wb_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("WB", [{"subject": "A", "body": "A", "delay": 3}, {"subject": "B", "body": "B"}], user_id=user.id)
+    account = SMTPAccount(user_id=user.id, email="s@x.com", daily_limit=50, sent_today=0)
+    past = datetime.utcnow() - timedelta(minutes=1)
+    app_db.add_all([account] + [
+        Lead(user_id=user.id, email=f"wb{i}@corp.com", campaign_id=camp.id, current_step=1 + i % 2, next_action_at=past)
+        for i in range(4)
+    ])
+    app_db.commit()
+
+    buffer = write_behind.SendOutcomeBuffer(journal_dir=str(tmp_path), max_items=100, max_age=60)
+    tasks = campaign_manager.get_due_leads()
+    for task in tasks[:3]:
+        buffer.record(write_behind.build_outcome(task, account.id))
+    assert buffer.pending() == 3
+    assert app_db.query(SMTPAccount).one().sent_today == 0  # Nothing written yet
+
+    assert buffer.flush() == 3
+    app_db.expire_all()
+    assert app_db.query(SMTPAccount).one().sent_today == 3
+    assert {l.status for l in app_db.query(Lead).filter(Lead.email_sent == "Yes")} == {"Contacted", "Completed"}
+
+    # A worker crashed with the 4th outcome journaled but not flushed. Its container restarted
+    # with the same hostname and pid as ours: still someone else's journal, so it is replayed
+    dead_journal = tmp_path / f"send-{socket.gethostname()}-{os.getpid()}-0123456789ab.jsonl"
+    dead_journal.write_text(json.dumps(write_behind.build_outcome(tasks[3], account.id)) + "\n{torn")
+    own_journal = write_behind.journal_path(str(tmp_path))
+    assert os.path.exists(own_journal) # Left open by the buffer above; never replayed from under it
+    assert write_behind.replay_orphans(str(tmp_path)) == 1
+    assert not dead_journal.exists() and os.path.exists(own_journal)
+    app_db.expire_all()
+    assert app_db.query(SMTPAccount).one().sent_today == 4
+    assert app_db.query(Lead).filter(Lead.email_sent == "Yes").count() == 4
+    print("   [PASS] Write-Behind Buffer OK.")
+
+def test_due_index_created_idempotently(app_db, monkeypatch):
+    """Verify the scheduler index is (re)created on startup and used by the due-lead scan."""
+    print("   [TEST] Due Index...")
+    from datetime import datetime
+    from sqlalchemy import inspect, text
+    from fastapi.testclient import TestClient
+    import server
+
+    app_db.execute(text("DROP INDEX ix_leads_due"))
+    app_db.commit()
+    data_manager.ensure_indexes()
+    data_manager.ensure_indexes()  # Second run is a no-op
+    assert "ix_leads_due" in {ix["name"] for ix in inspect(data_manager.engine).get_indexes("leads")}
+
+    # A plain `uvicorn server:app` start (as in the Procfile) builds the schema too
+    app_db.execute(text("DROP INDEX ix_leads_due"))
+    app_db.execute(text("DROP INDEX uq_leads_user_email"))
+    app_db.commit()
+    monkeypatch.setattr(server, "refresh_server_location", lambda: None)
+    with TestClient(server.app):
+        pass
+    indexes = {ix["name"] for ix in inspect(data_manager.engine).get_indexes("leads")}
+    assert {"ix_leads_due", "uq_leads_user_email"} <= indexes
+
+    plan = app_db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM leads WHERE next_action_at <= :now "
+        "AND status NOT IN ('Replied', 'Bounced', 'Completed') AND campaign_id IS NOT NULL "
+        "ORDER BY next_action_at, id"
+    ), {"now": datetime.utcnow()}).all()
+    assert "ix_leads_due" in " ".join(row[-1] for row in plan)
+    print("   [PASS] Due Index OK.")
+
+def test_due_scheduler_wakes_when_work_is_due(app_db):
+    """Verify the scheduler fires for due leads, honours notify/cancel and ignores stale entries."""
+    print("   [TEST] Due Scheduler...")
+    import threading
+    from datetime import datetime, timedelta
+    from src.scheduler import DueScheduler
+
+    user = User(username="sched_tester", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Sched", [{"subject": "Hi", "body": "A"}], user_id=user.id)
+    soon = datetime.utcnow() + timedelta(seconds=0.3)
+    leads = [Lead(user_id=user.id, email=f"s{i}@corp.com", campaign_id=camp.id, current_step=1, next_action_at=soon)
+             for i in range(3)]
+    app_db.add_all(leads)
+    app_db.commit()
+
+    fired = []
+    woke = threading.Event()
+    def on_due(lead_ids):
+        fired.extend(lead_ids)
+        woke.set()
+
+    sched = DueScheduler(on_due, horizon_seconds=3600, reload_seconds=3600)
+    assert sched.load() == 3
+    sched.cancel(leads[0].id)                                           # Replied
+    sched.notify(leads[1].id, datetime.utcnow() + timedelta(hours=2))   # Advanced past the horizon
+    sched.start()
+    try:
+        assert woke.wait(5)
+    finally:
+        sched.stop()
+
+    assert fired == [leads[2].id]
+    assert sched.pending() == 0
+    print("   [PASS] Due Scheduler OK.")
+
+def test_bulk_enroll_is_set_based_and_staggered(app_db):
+    """Verify enrollment is one UPDATE scoped to the owner, skips replied leads and spreads the start."""
+    print("   [TEST] Bulk Enrollment...")
+    from datetime import datetime, timedelta
+
+    owner = User(username="enroll_owner", password_hash="pw")
+    other = User(username="enroll_other", password_hash="pw")
+    app_db.add_all([owner, other])
+    app_db.commit()
+    camp = campaign_manager.create_campaign("Bulk", [{"subject": "Hi", "body": "A"}], user_id=owner.id)
+    app_db.add_all([Lead(user_id=owner.id, email=f"e{i}@corp.com", status="New") for i in range(300)])
+    app_db.add(Lead(user_id=owner.id, email="replied@corp.com", status="Replied"))
+    app_db.add(Lead(user_id=other.id, email="theirs@corp.com", status="New"))
+    app_db.commit()
+
+    start = datetime.utcnow().replace(microsecond=0)
+    assert campaign_manager.enroll_leads(camp.id, limit=100) == 100
+    assert campaign_manager.enroll_leads(camp.id, limit=None, spread_seconds=600) == 200
+    assert campaign_manager.enroll_leads(camp.id, limit=None) == 0
+
+    app_db.expire_all()
+    enrolled = app_db.query(Lead).filter(Lead.campaign_id == camp.id).all()
+    assert len(enrolled) == 300
+    assert all(l.user_id == owner.id and l.current_step == 1 for l in enrolled)
+    starts = sorted(l.next_action_at for l in enrolled)
+    assert starts[0] >= start and starts[-1] <= start + timedelta(seconds=601)
+    assert len(set(starts)) > 100 # Spread out, not one burst
+
+    # Many leads share each staggered second: keyset pages must not skip any of them
+    camp2 = campaign_manager.create_campaign("Dense", [{"subject": "Hi", "body": "A"}], user_id=owner.id)
+    app_db.add_all([Lead(user_id=owner.id, email=f"d{i}@corp.com", status="New") for i in range(100)])
+    app_db.commit()
+    assert campaign_manager.enroll_leads(camp2.id, limit=None, spread_seconds=3) == 100
+    until = datetime.utcnow() + timedelta(hours=1)
+    dense = [t.lead_id for t in campaign_manager.iter_due_tasks(until=until, batch_size=10) if t.campaign_id == camp2.id]
+    assert len(dense) == len(set(dense)) == 100
+    print("   [PASS] Bulk Enrollment OK.")
+
+def test_lead_import_streams_and_dedupes(app_db, tmp_path):
+    """Verify the importer validates in batches, skips known emails and works for CSV and Excel."""
+    print("   [TEST] Lead Import...")
+    import pandas as pd
+    from src import lead_importer
+
+    user = User(username="importer", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    app_db.add(Lead(user_id=user.id, email="known@corp.com"))
+    app_db.commit()
+
+    rows = [{"Email": f" Lead{i}@Corp.com ", "Name": f"Lead {i}", "Email_Sent": "No"} for i in range(250)]
+    rows += [{"Email": "known@corp.com"}, {"Email": "not-an-email"}, {"Email": "lead0@corp.com"}]
+    csv_path = tmp_path / "leads.csv"
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+
+    stats = lead_importer.import_file(str(csv_path), user.id, chunk_size=100)
+    assert stats["rows"] == 253
+    assert stats["inserted"] == 250
+    assert stats["duplicates"] == 2 # known@ and lead0@ (seen in an earlier chunk)
+    assert stats["invalid"] == 1
+    assert app_db.query(Lead).filter_by(user_id=user.id, email="lead7@corp.com").one().name == "Lead 7"
+
+    xlsx_path = tmp_path / "leads.xlsx"
+    pd.DataFrame([{"Email": "new@corp.com", "Email_Sent": "Yes"}, {"Email": "lead1@corp.com"}]).to_excel(xlsx_path, index=False)
+    stats = lead_importer.import_file(str(xlsx_path), user.id)
+    assert stats["inserted"] == 1
+    assert app_db.query(Lead).filter_by(email="new@corp.com").one().status == "Contacted"
+    print("   [PASS] Lead Import OK.")
+
+def test_lead_upsert_is_unique_per_tenant(app_db):
+    """Verify (user_id, email) is unique, add_lead upserts instead of check-then-insert, and tenants don't collide."""
+    print("   [TEST] Lead Upsert...")
+    from sqlalchemy.exc import IntegrityError
+
+    alice = User(username="upsert_a", password_hash="pw")
+    bob = User(username="upsert_b", password_hash="pw")
+    app_db.add_all([alice, bob])
+    app_db.commit()
+
+    assert data_manager.add_lead({"Email": "Dup@Corp.com", "Name": "First"}, user_id=alice.id) is True
+    assert data_manager.add_lead({"Email": "dup@corp.com", "Name": "Second"}, user_id=alice.id) is False
+    assert data_manager.add_lead({"Email": "dup@corp.com"}, user_id=bob.id) is True
+
+    written = data_manager.insert_leads(
+        [{"user_id": alice.id, "email": "dup@corp.com", "name": "Updated"},
+         {"user_id": alice.id, "email": "other@corp.com", "name": "Other"}],
+        update_fields=["name"]
+    )
+    assert written == 2
+    assert app_db.query(Lead).filter_by(user_id=alice.id, email="dup@corp.com").one().name == "Updated"
+
+    app_db.add(Lead(user_id=alice.id, email="other@corp.com"))
+    with pytest.raises(IntegrityError):
+        app_db.commit()
+    app_db.rollback()
+    print("   [PASS] Lead Upsert OK.")
+
+def test_knowledge_context_cached_until_write(app_db):
+    """Verify the assembled knowledge context is reused, scoped per user, and rebuilt after a write."""
+    print("   [TEST] Knowledge Context Cache...")
+    import config
+    from sqlalchemy import event
+
+    user = User(username="kb_cache", password_hash="pw")
+    other = User(username="kb_other", password_hash="pw")
+    app_db.add_all([user, other])
+    app_db.commit()
+    app_db.add_all([
+        KnowledgeBase(user_id=None, is_global=True, category="Global", content="shared fact"),
+        KnowledgeBase(user_id=user.id, is_global=False, category="Mine", content="private fact"),
+        KnowledgeBase(user_id=other.id, is_global=False, category="Theirs", content="other fact"),
+    ])
+    app_db.commit()
+    data_manager.bump_knowledge_version()
+    user_id = user.id
+
+    queries = []
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(data_manager.engine, "before_cursor_execute", listener)
+    try:
+        first = data_manager.get_knowledge_context(user_id)
+        for _ in range(5):
+            assert data_manager.get_knowledge_context(user_id) == first
+        assert len(queries) == 1
+    finally:
+        event.remove(data_manager.engine, "before_cursor_execute", listener)
+
+    assert "shared fact" in first and "private fact" in first and "other fact" not in first
+    assert "private fact" not in data_manager.get_knowledge_context()
+
+    app_db.add(KnowledgeBase(user_id=user.id, is_global=False, category="Mine", content="new fact"))
+    app_db.commit()
+    data_manager.bump_knowledge_version()
+    assert "new fact" in data_manager.get_knowledge_context(user.id)
+
+    # Bounded however much /admin/train loads; the user's own items win the slots
+    app_db.add_all([KnowledgeBase(user_id=None, is_global=True, category="Bulk", content="x" * 5000) for _ in range(30)])
+    app_db.commit()
+    data_manager.bump_knowledge_version()
+    bounded = data_manager.get_knowledge_context(user_id)
+    assert len(bounded) < config.KNOWLEDGE_CONTEXT_MAX_CHARS + 200
+    assert bounded.index("private fact") < bounded.index("shared fact")
+    print("   [PASS] Knowledge Context Cache OK.")
+
+def test_sqlite_production_mode_single_writer(monkeypatch, tmp_path):
+    """Verify WAL/pragmas are applied and concurrent writes funnel through one writer without lock errors."""
+    print("   [TEST] SQLite Production Mode...")
+    import threading
+    import config
+    from sqlalchemy import text
+    from src import db_writer
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'prod.db'}", connect_args={"check_same_thread": False})
+    data_manager.enable_sqlite_production(engine)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(data_manager, "engine", engine)
+    monkeypatch.setattr(data_manager, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    monkeypatch.setattr(config, "SQLITE_PRODUCTION", True)
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1 # NORMAL
+
+    def add_user(db):
+        user = User(username="writer", password_hash="pw")
+        db.add(user)
+        db.flush()
+        return user.id
+    user_id = db_writer.write(add_user)
+    errors = []
+    def writer(n):
+        try:
+            for i in range(25):
+                db_writer.write(lambda db: db.add(KnowledgeBase(user_id=user_id, category="c", content=f"{n}-{i}")))
+        except Exception as e:
+            errors.append(e)
+    def reader():
+        try:
+            for _ in range(25):
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT count(*) FROM knowledge_base")).scalar()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)] + [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+    # A failing write is undone on its own; writes batched with it still commit
+    bad = db_writer.submit(lambda db: db.add(User(username="writer", password_hash="dup")))
+    good = db_writer.submit(lambda db: db.add(KnowledgeBase(user_id=user_id, category="c", content="after")))
+    with pytest.raises(Exception):
+        bad.result(5)
+    good.result(5)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM knowledge_base")).scalar() == 8 * 25 + 1
+    print("   [PASS] SQLite Production Mode OK.")
+
+def test_handlers_keep_event_loop_free_during_db_work(app_db, monkeypatch):
+    """Verify a slow DB call in one request doesn't stall other requests on the same worker."""
+    print("   [TEST] Async Handlers...")
+    import asyncio
+    import time
+    import httpx
+    import server
+    server._user_cache.clear()
+
+    user = User(username="async_user", password_hash=auth.get_password_hash("pw"))
+    app_db.add(user)
+    app_db.commit()
+    token = auth.create_session_token(user.id)
+
+    def slow_dashboard_data(user_id):
+        time.sleep(0.5)
+        return {"total_leads": 0, "emails_sent": 0, "replies": 0, "reply_rate": 0, "active_campaigns": 0}, []
+    monkeypatch.setattr(server, "dashboard_data", slow_dashboard_data)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", cookies={"session": token}) as client:
+            start = time.monotonic()
+            slow = asyncio.create_task(client.get("/dashboard"))
+            await asyncio.sleep(0.05)
+            fast = await client.get("/leads")
+            fast_done = time.monotonic() - start
+            slow_resp = await slow
+            return fast.status_code, fast_done, slow_resp.status_code
+
+    fast_status, fast_done, slow_status = asyncio.run(scenario())
+    assert fast_status == 200 and slow_status == 200
+    assert fast_done < 0.4 # Served while the dashboard query was still running
+    print("   [PASS] Async Handlers OK.")
+
+def test_dashboard_stats_single_query_and_cached(app_db):
+    """Verify dashboard stats come from one aggregate round trip (plus recent activity) and are cached."""
+    print("   [TEST] Dashboard Stats...")
+    from datetime import datetime
+    from sqlalchemy import event
+    from src import dashboard_stats
+
+    user = User(username="dash_user", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    user_id = user.id
+    app_db.add(Campaign(user_id=user_id, name="Live", status="Active"))
+    app_db.add(Campaign(user_id=user_id, name="Old", status="Paused"))
+    statuses = ["New"] * 5 + ["Contacted"] * 3 + ["Replied"] * 2 + ["Completed"]
+    app_db.add_all([Lead(user_id=user_id, email=f"d{i}@corp.com", status=s,
+                         last_contacted_at=datetime(2026, 1, 1, 9, i) if s != "New" else None)
+                    for i, s in enumerate(statuses)])
+    app_db.commit()
+
+    queries = []
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(data_manager.engine, "before_cursor_execute", listener)
+    try:
+        dashboard_stats.invalidate()
+        stats, recent = dashboard_stats.get_dashboard(user_id)
+        assert len(queries) == 2
+        for _ in range(5):
+            assert dashboard_stats.get_dashboard(user_id) == (stats, recent)
+        assert len(queries) == 2
+    finally:
+        event.remove(data_manager.engine, "before_cursor_execute", listener)
+
+    assert stats == {"total_leads": 11, "emails_sent": 5, "replies": 2, "reply_rate": 40.0, "active_campaigns": 1}
+    assert [r["time"] for r in recent] == ["09:10", "09:09", "09:08", "09:07", "09:06"]
+
+    # Imports and enrollment show up right away, not after the TTL
+    assert data_manager.insert_leads([{"user_id": user_id, "email": "imported@corp.com", "status": "New"}]) == 1
+    assert dashboard_stats.get_dashboard(user_id)[0]["total_leads"] == 12
+    camp = campaign_manager.create_campaign("Fresh", [{"subject": "Hi", "body": "A"}], user_id=user_id)
+    assert dashboard_stats.get_dashboard(user_id)[0]["active_campaigns"] == 2
+    campaign_manager.enroll_leads(camp.id, limit=None)
+    assert dashboard_stats._cache.get(user_id) is None
+    print("   [PASS] Dashboard Stats OK.")
+
+def test_campaign_summaries_grouped_counts(app_db):
+    """Verify the campaigns listing counts leads per status/step with a fixed number of queries."""
+    print("   [TEST] Campaign Summaries...")
+    from sqlalchemy import event
+
+    user = User(username="summary_user", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    user_id = user.id
+    camps = [campaign_manager.create_campaign(f"C{i}", [{"subject": "Hi", "body": "A"}], user_id=user_id) for i in range(3)]
+    leads = []
+    for n, camp in enumerate(camps[:2]):
+        leads += [Lead(user_id=user_id, email=f"c{n}-{i}@corp.com", campaign_id=camp.id,
+                       status="Contacted" if i % 2 else "New", current_step=1 + (i % 3)) for i in range(6 * (n + 1))]
+    app_db.add_all(leads)
+    app_db.commit()
+
+    queries = []
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(data_manager.engine, "before_cursor_execute", listener)
+    try:
+        summaries = campaign_manager.get_campaign_summaries(user_id)
+    finally:
+        event.remove(data_manager.engine, "before_cursor_execute", listener)
+
+    assert len(queries) == 2
+    assert [s["leads_count"] for s in summaries] == [6, 12, 0]
+    assert summaries[1]["by_status"] == {"New": 6, "Contacted": 6}
+    assert summaries[1]["by_step"] == {1: 4, 2: 4, 3: 4}
+    print("   [PASS] Campaign Summaries OK.")
+
+def test_lead_listing_keyset_pages(app_db):
+    """Verify /leads and /inbox page with keyset cursors (no gaps/repeats) and honour filters."""
+    print("   [TEST] Lead Listing...")
+    from datetime import datetime, timedelta
+    from src import lead_listing
+
+    user = User(username="list_user", password_hash="pw")
+    app_db.add(user)
+    app_db.commit()
+    user_id = user.id
+    base = datetime(2026, 3, 1)
+    leads = []
+    for i in range(23):
+        contacted = None if i % 5 == 0 else base + timedelta(hours=i // 2) # Ties on the timestamp, some never contacted
+        leads.append(Lead(user_id=user_id, email=f"l{i:02d}@corp.com", status="Replied" if i % 3 == 0 else "Contacted",
+                          reply_intent="Interested" if i % 3 == 0 else None, last_contacted_at=contacted))
+    app_db.add_all(leads)
+    app_db.commit()
+
+    def walk(fn, **filters):
+        seen, cursor = [], None
+        while True:
+            page, cursor = fn(user_id, filters, cursor, limit=4)
+            assert len(page) <= 4
+            seen += [l.id for l in page]
+            if not cursor:
+                return seen
+
+    assert walk(lead_listing.list_leads) == sorted((l.id for l in leads), reverse=True)
+
+    inbox = walk(lead_listing.list_inbox)
+    expected = sorted((l for l in leads if l.last_contacted_at), key=lambda l: (l.last_contacted_at, l.id), reverse=True)
+    expected += sorted((l for l in leads if not l.last_contacted_at), key=lambda l: l.id, reverse=True)
+    assert inbox == [l.id for l in expected]
+
+    assert set(walk(lead_listing.list_inbox, intent="Interested")) == {l.id for l in leads if l.reply_intent}
+    in_range = walk(lead_listing.list_inbox, date_from="2026-03-01", date_to="2026-03-01")
+    assert set(in_range) == {l.id for l in leads if l.last_contacted_at}
+    assert walk(lead_listing.list_leads, q="L07") == [leads[7].id]
+    assert lead_listing.list_leads(user_id, {}, "not-a-cursor", limit=2)[0][0].id == leads[-1].id
+    print("   [PASS] Lead Listing OK.")
+
+def test_lead_search_full_text_index(app_db, monkeypatch):
+    """Verify the FTS index stays in sync on insert/update/delete, ranks results and is scoped per user."""
+    print("   [TEST] Lead Search...")
+    from src import lead_search
+    monkeypatch.setattr(lead_search, "_backend", None)
+    lead_search.ensure_search_index(data_manager.engine)
+
+    user = User(username="search_user", password_hash="pw")
+    other = User(username="search_other", password_hash="pw")
+    app_db.add_all([user, other])
+    app_db.commit()
+    user_id = user.id
+    acme = Lead(user_id=user_id, email="ceo@acme.io", name="Dana Smith", company="Acme Robotics", role="CEO")
+    notes = Lead(user_id=user_id, email="x@beta.io", name="Lee", company="Beta", notes="met at robotics expo")
+    app_db.add_all([acme, notes, Lead(user_id=other.id, email="spy@acme.io", company="Acme Robotics")])
+    app_db.commit()
+
+    found = lead_search.search_leads(user_id, "robot")
+    assert [l.id for l in found] == [acme.id, notes.id] # Company match outranks a notes mention
+    assert [l.id for l in lead_search.search_leads(user_id, "dana acme")] == [acme.id]
+    assert [l.id for l in lead_search.search_leads(user_id, 'acme")*')] == [acme.id] # FTS syntax is stripped
+
+    notes.reply_summary = "Wants a demo of the gizmo"
+    app_db.commit()
+    assert [l.id for l in lead_search.search_leads(user_id, "gizmo")] == [notes.id]
+    app_db.delete(acme)
+    app_db.commit()
+    assert lead_search.search_leads(user_id, "dana") == []
+    print("   [PASS] Lead Search OK.")
+
+def test_signed_session_tokens(app_db):
+    """Verify login issues a signed token, tampered/expired tokens are rejected, and pages skip the user query."""
+    print("   [TEST] Session Tokens...")
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    import server
+    server._user_cache.clear()
+
+    user = User(username="token_user", password_hash=auth.get_password_hash("pw"))
+    app_db.add(user)
+    app_db.commit()
+    user_id = user.id
+
+    token = auth.create_session_token(user_id)
+    assert auth.verify_session_token(token) == user_id
+    uid, expires, sig = token.split(".")
+    assert auth.verify_session_token(f"{user_id + 1}.{expires}.{sig}") is None # Forged user id
+    assert auth.verify_session_token(auth.create_session_token(user_id, ttl_seconds=-1)) is None # Expired
+    assert auth.verify_session_token("token_user") is None # Old-style plain cookie
+    assert auth.verify_session_token("1.99999999999.\u00e9abc") is None # Non-ASCII signature
+
+    client = TestClient(server.app)
+    resp = client.post("/login", data={"username": "token_user", "password": "pw"}, follow_redirects=False)
+    assert resp.status_code == 303
+    assert auth.verify_session_token(resp.cookies["session"]) == user_id
+
+    client.cookies.set("session", resp.cookies["session"])
+    assert client.get("/settings").status_code == 200 # Warms the user cache
+    queries = []
+    listener = lambda conn, cursor, statement, *args: queries.append(statement)
+    event.listen(data_manager.engine, "before_cursor_execute", listener)
+    try:
+        assert client.get("/settings").status_code == 200
+    finally:
+        event.remove(data_manager.engine, "before_cursor_execute", listener)
+    assert not any("FROM users" in q for q in queries)
+
+    client.cookies.set("session", f"{user_id}.{expires}.{'0' * 64}")
+    assert client.get("/settings", follow_redirects=False).headers["location"] == "/login"
+    resp = TestClient(server.app).get("/settings", headers={"Cookie": b"session=1.99999999999.\xc3\xa9abc"},
+                                      follow_redirects=False)
+    assert resp.headers["location"] == "/login" # Crafted non-ASCII cookie: redirected, not a 500
+    print("   [PASS] Session Tokens OK.")
+
+def test_session_secret_required_when_deployed(tmp_path):
+    """Verify a deployment without SESSION_SECRET refuses to start instead of minting a per-process key."""
+    print("   [TEST] Session Secret Required...")
+    import subprocess
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    env = {k: v for k, v in os.environ.items() if k not in ("SESSION_SECRET", "DATABASE_URL", "VERCEL", "DYNO", "RENDER")}
+    env["PYTHONPATH"] = root
+    probe = [sys.executable, "-c", "import config; print(config.SESSION_SECRET)"]
+
+    deployed = subprocess.run(probe, cwd=tmp_path, capture_output=True, text=True, env={**env, "DATABASE_URL": "postgresql://db/app"})
+    assert deployed.returncode != 0
+    assert "SESSION_SECRET is not set" in deployed.stderr
+    assert not (tmp_path / "secrets.json").exists()
+
+    dev = subprocess.run(probe, cwd=tmp_path, capture_output=True, text=True, env=env)
+    assert dev.returncode == 0, dev.stderr[-2000:]
+    assert "[WARN] SESSION_SECRET is not set" in dev.stdout
+    assert (tmp_path / "secrets.json").exists()
+    print("   [PASS] Session Secret Required OK.")
+
+def test_server_import_is_lazy_and_offline():
+    """Verify importing the app loads no heavy optional SDKs and makes no network calls."""
+    print("   [TEST] Startup Imports...")
+    import subprocess
+    from src import startup_profile
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    probe = (
+        "import socket, sys\n"
+        "def offline(*a, **k): raise AssertionError('network call at import')\n"
+        "socket.create_connection = offline\n"
+        "socket.socket.connect = offline\n"
+        "import server\n"
+        f"print('EAGER:' + ','.join(m for m in {startup_profile.LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", probe], cwd=root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.strip().splitlines()[-1] == "EAGER:"
+
+    rows = startup_profile.parse_importtime(
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       100 |        300 | server\n"
+        "import time:       200 |        200 |   src.data_manager\n"
+    )
+    assert rows == [(300, 100, "server", 0), (200, 200, "src.data_manager", 1)]
+    print("   [PASS] Startup Imports OK.")
+
+def test_metrics_endpoint_exposes_hot_path_histograms(app_db, monkeypatch):
+    """Verify samples land in labelled histograms and /metrics serves the text exposition format."""
+    print("   [TEST] Metrics...")
+    from fastapi.testclient import TestClient
+    import config
+    from src import metrics, email_sender
+    import server
+    metrics.reset()
+
+    assert email_sender.render_template("Hi {{ name }}", {"name": "Ann"}, field="subject") == "Hi Ann"
+    assert metrics.TEMPLATE_RENDER_SECONDS.count("subject") == 1
+
+    h = metrics.Histogram("test_latency_seconds", "Test.", ("host",), buckets=(0.1, 1))
+    try:
+        h.observe(0.05, "a")
+        h.observe(0.5, "a")
+        monkeypatch.setattr(metrics, "MAX_SERIES", 1)
+        h.observe(5, "b") # Over the series cap: folded into _other
+        text = "\n".join(h.render())
+        assert 'test_latency_seconds_bucket{host="a",le="0.1"} 1' in text
+        assert 'test_latency_seconds_bucket{host="a",le="1"} 2' in text
+        assert 'test_latency_seconds_bucket{host="a",le="+Inf"} 2' in text
+        assert 'test_latency_seconds_count{host="_other"} 1' in text
+    finally:
+        metrics._registry.pop("test_latency_seconds")
+
+    app_db.query(Lead).count() # Timed by the one hook sql_profiler.install() attached in the fixture
+    assert metrics.DB_QUERY_SECONDS.count("SELECT") >= 1
+
+    client = TestClient(server.app)
+    client.get("/login")
+    monkeypatch.setattr(config, "METRICS_TOKEN", "scrape-me")
+    assert client.get("/metrics").status_code == 401
+    resp = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert resp.status_code == 200
+    assert "# TYPE http_request_duration_seconds histogram" in resp.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/login",status="200"} 1' in resp.text
+    print("   [PASS] Metrics OK.")
+
+def test_health_probes_are_cheap_and_public(app_db, monkeypatch):
+    """Verify /healthz and /readyz answer without a session and report DB, queue and send state."""
+    print("   [TEST] Health Probes...")
+    from fastapi.testclient import TestClient
+    import config
+    from src import health, metrics
+    import server
+    client = TestClient(server.app)
+
+    assert client.get("/healthz").json()["status"] == "ok"
+
+    metrics.LAST_SEND_SUCCESS.set_to_current_time()
+    resp = client.get("/readyz")
+    assert resp.status_code == 200
+    report = resp.json()
+    assert report["database"]["ok"] and report["database"]["latency_ms"] is not None
+    assert report["queues"]["send_jobs"] == {}
+    assert report["queues"]["db_writer"] == 0
+    assert report["last_send_at"].endswith("Z")
+
+    # Unreachable database: not ready
+    broken = create_engine("sqlite:////nonexistent-dir/leads.db")
+    monkeypatch.setattr(data_manager, "SessionLocal", sessionmaker(bind=broken))
+    resp = client.get("/readyz")
+    assert resp.status_code == 503
+    assert resp.json()["database"]["error"] == "OperationalError"
+
+    # Hung database: the probe gives up on time instead of waiting for the check
+    import threading
+    import time
+    release = threading.Event()
+    def hang():
+        release.wait(10)
+        return True, 0.0, None
+    monkeypatch.setattr(health, "check_database", hang)
+    monkeypatch.setattr(config, "READINESS_TIMEOUT_SECONDS", 0.2)
+    try:
+        start = time.perf_counter()
+        resp = client.get("/readyz")
+        assert time.perf_counter() - start < 2
+        assert resp.status_code == 503
+        assert resp.json()["database"]["error"] == "timed out"
+    finally:
+        release.set()
+    print("   [PASS] Health Probes OK.")
+
+def test_sql_profiler_budgets_and_n_plus_one(app_db, capsys):
+    """Verify per-unit query profiles, N+1 detection and budgets over the hot paths."""
+    print("   [TEST] SQL Profiler...")
+    from fastapi.testclient import TestClient
+    from src import dashboard_stats, lead_listing
+    import server
+
+    assert sql_profiler.fingerprint("SELECT * FROM leads WHERE id IN (?, ?, ?) AND email = 'a@b.com'") == \
+        sql_profiler.fingerprint("SELECT * FROM leads WHERE id IN (?) AND email = 'c@d.com'")
+
+    user = User(username="profiled_user", password_hash=auth.get_password_hash("pw"))
+    app_db.add(user)
+    app_db.commit()
+    user_id = user.id
+    camp = campaign_manager.create_campaign("Profiled", [{"subject": "Hi", "body": "A"}], user_id=user_id)
+    app_db.add_all([Lead(user_id=user_id, email=f"p{i}@corp.com", name=f"P {i}", status="New") for i in range(30)])
+    app_db.commit()
+    campaign_manager.enroll_leads(camp.id, limit=30)
+
+    # A per-row loop is one fingerprint repeated: over budget, and logged as N+1 when profiled
+    ids = [lead_id for (lead_id,) in app_db.query(Lead.id).all()]
+    with pytest.raises(sql_profiler.QueryBudgetExceeded):
+        with sql_profiler.budget(max_repeats=5):
+            for lead_id in ids:
+                app_db.get(Lead, lead_id, populate_existing=True)
+    with sql_profiler.profile("job:test") as p:
+        for lead_id in ids:
+            app_db.get(Lead, lead_id, populate_existing=True)
+    assert p.queries == 30
+    assert "Possible N+1 in job:test: 30x SELECT" in capsys.readouterr().out
+
+    # Hot paths stay flat however many leads there are
+    with sql_profiler.budget(max_queries=3, max_repeats=1):
+        campaign_manager.get_campaign_summaries(user_id)
+    with sql_profiler.budget(max_queries=2, max_repeats=1):
+        dashboard_stats.compute_dashboard(user_id)
+    with sql_profiler.budget(max_queries=2, max_repeats=1):
+        lead_listing.list_leads(user_id)
+    with sql_profiler.budget(max_queries=3, max_repeats=1):
+        assert len(campaign_manager.get_due_leads()) == 30
+
+    # Requests report their DB totals
+    client = TestClient(server.app)
+    client.cookies.set("session", auth.create_session_token(user_id))
+    resp = client.get("/campaigns")
+    assert resp.status_code == 200
+    assert resp.headers["Server-Timing"].startswith("db;dur=")
+    assert 'desc="0 queries"' not in resp.headers["Server-Timing"] # Counted across run_db() threads
+
+    # Send workers run in their own threads but still count toward the job's profile
+    from types import SimpleNamespace
+    from src import metrics, send_engine
+    account = SimpleNamespace(id=1, email="s@x.com", send_interval=0, max_in_flight=3, daily_limit=10, sent_today=0, last_used_at=None)
+    def send(lead_id, account):
+        db = next(data_manager.get_db())
+        try:
+            return db.get(Lead, lead_id) is not None
+        finally:
+            db.close()
+    @sql_profiler.profiled("job:send-test")
+    def job():
+        before = metrics.DB_QUERY_SECONDS.count("SELECT")
+        stats = send_engine.run(ids[:6], [account], send)
+        return stats, sql_profiler.current().queries, metrics.DB_QUERY_SECONDS.count("SELECT") - before
+    stats, profiled_queries, timed_selects = job()
+    assert stats == {"sent": 6, "failed": 0}
+    assert profiled_queries == 6
+    assert timed_selects == 6 # Each statement timed once, shared by metrics and the profiler
+    print("   [PASS] SQL Profiler OK.")